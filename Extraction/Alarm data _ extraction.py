@@ -221,7 +221,7 @@ def summarize_alarms(df_details: pd.DataFrame) -> pd.DataFrame:
 
 
 
-def plot_alarm_timeline(df_details: pd.DataFrame) -> None:
+def plot_alarm_timeline(df_details: pd.DataFrame):
     """
     Plot alarms timeline per alarm category.
 
@@ -232,20 +232,21 @@ def plot_alarm_timeline(df_details: pd.DataFrame) -> None:
 
     Returns
     -------
-    None
-        Displays a Matplotlib figure.
+    matplotlib.figure.Figure or None
+        The figure, to be shown or saved by the caller; None when there
+        are no alarms.
     """
 
     if df_details.empty:
         print("No alarm detected this day.")
-        return
+        return None
 
     df_details = df_details.copy()
     df_details["alarm_category_id"], categories = pd.factorize(
         df_details["alarm_msg"], sort=True
     )
 
-    plt.figure(figsize=(15, 6))
+    fig = plt.figure(figsize=(15, 6))
     plt.scatter(df_details["real_date"], df_details["alarm_category_id"], s=30)
 
     plt.yticks(range(len(categories)), categories)
@@ -255,7 +256,7 @@ def plot_alarm_timeline(df_details: pd.DataFrame) -> None:
     plt.grid(True, linestyle="--", alpha=0.4)
 
     plt.tight_layout()
-    plt.show()
+    return fig
 
 
 if __name__ == "__main__":
@@ -287,3 +288,4 @@ if __name__ == "__main__":
 
     # 4. Plot
     plot_alarm_timeline(df_details)
+    plt.show()
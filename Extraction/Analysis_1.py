@@ -62,30 +62,31 @@ def write_to_csv(rows, filename):
 
 # Main script
 
-try:
-    conn = get_connection()
-    print("Connected to database.")
+if __name__ == "__main__":
+    try:
+        conn = get_connection()
+        print("Connected to database.")
 
-    # Example: fetch multiple IDs from each table
-    float_ids = [828,829]
-    string_ids = []
+        # Example: fetch multiple IDs from each table
+        float_ids = [828,829]
+        string_ids = []
 
-    # newest_first=True → sort by descending date within each ID
-    float_rows = get_run(conn, "float", float_ids, limit=500, newest_first=True)
-    string_rows = get_run(conn, "string", string_ids, limit=200, newest_first=True)
+        # newest_first=True → sort by descending date within each ID
+        float_rows = get_run(conn, "float", float_ids, limit=500, newest_first=True)
+        string_rows = get_run(conn, "string", string_ids, limit=200, newest_first=True)
 
-    print(f"Float rows retrieved: {len(float_rows)}")
-    print(f"String rows retrieved: {len(string_rows)}")
+        print(f"Float rows retrieved: {len(float_rows)}")
+        print(f"String rows retrieved: {len(string_rows)}")
 
-    # Save to timestamped CSV files
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    write_to_csv(float_rows, f"float_data_{timestamp}.csv")
-    write_to_csv(string_rows, f"string_data_{timestamp}.csv")
+        # Save to timestamped CSV files
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        write_to_csv(float_rows, f"float_data_{timestamp}.csv")
+        write_to_csv(string_rows, f"string_data_{timestamp}.csv")
 
-except Exception as e:
-    print("An error occurred:", e)
+    except Exception as e:
+        print("An error occurred:", e)
 
-finally:
-    if 'conn' in locals() and conn:
-        conn.close()
-        print("Connection closed.")
+    finally:
+        if 'conn' in locals() and conn:
+            conn.close()
+            print("Connection closed.")
@@ -1,47 +1,108 @@
+"""
+Spindle Power and Energy Estimation.
+
+This module converts the spindle load (% of the 37 kW spindle motor) of one
+day into power, integrates it into energy per logged segment (the signal is
+a step function between samples) and reports the hourly average power.
+
+Functions
+---------
+load_db_config :
+    Load database connection settings from config.yaml.
+create_engine_from_config :
+    Create SQLAlchemy engine from configuration dictionary.
+convert_timestamp_to_epoch_ms :
+    Convert human-readable timestamps to epoch milliseconds.
+fetch_spindle_load :
+    Retrieve the raw spindle load logs.
+compute_energy :
+    Convert load to power and integrate energy per segment.
+hourly_average_power :
+    Average power per hour.
+"""
+
 import pandas as pd
 from sqlalchemy import create_engine, text
 import yaml
 
-# ---------------------------------------------------------
-# 1. Load database config
-# ---------------------------------------------------------
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
-
-db = config["database"]
-
-engine = create_engine(
-    f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['dbname']}"
-)
+SPINDLE_ID = 630
+MAX_POWER_KW = 37.0
 
-# ---------------------------------------------------------
-# 2. Parameters
-# ---------------------------------------------------------
-date_day = "2021-01-12"
-start_ts = f"{date_day} 00:00:00"
-end_ts = f"{date_day} 23:59:59"
 
-temp_ids = [630]
-names = {
-    630: "MANDRINO_CONSUMO_VISUALIZADO",
-}
+def load_db_config(path: str = "config.yaml") -> dict:
+    """
+    Load database connection parameters from a YAML file.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to the YAML config file (default: "config.yaml").
+
+    Returns
+    -------
+    dict
+        Dictionary containing database parameters.
+    """
+    with open(path, "r") as f:
+        return yaml.safe_load(f)["database"]
+
+
+def create_engine_from_config(db: dict):
+    """
+    Create an SQLAlchemy engine using database configuration.
+
+    Parameters
+    ----------
+    db : dict
+        Must contain keys `user`, `password`, `host`, `port`, `dbname`.
+
+    Returns
+    -------
+    sqlalchemy.Engine
+        Database engine ready for querying.
+    """
+    return create_engine(
+        f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['dbname']}"
+    )
+
+
+def convert_timestamp_to_epoch_ms(engine, timestamp: str) -> int:
+    """
+    Convert a timestamp (YYYY-MM-DD HH:MM:SS) to epoch milliseconds.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        SQLAlchemy engine.
+    timestamp : str
+        Timestamp to convert.
+
+    Returns
+    -------
+    int
+        Epoch milliseconds.
+    """
+    epoch_query = text("SELECT extract(epoch FROM timestamp :t) AS s")
+    with engine.connect() as conn:
+        return int(conn.execute(epoch_query, {"t": timestamp}).scalar() * 1000)
 
-MAX_POWER_KW = 37.0
 
-# ---------------------------------------------------------
-# 3. Convert timestamps to epoch ms
-# ---------------------------------------------------------
-epoch_query = text("SELECT extract(epoch FROM timestamp :t) AS s")
-with engine.connect() as conn:
-    start_ms = int(conn.execute(epoch_query, {"t": start_ts}).scalar() * 1000)
-    end_ms = int(conn.execute(epoch_query, {"t": end_ts}).scalar() * 1000)
+def fetch_spindle_load(engine, start_ms: int, end_ms: int) -> pd.DataFrame:
+    """
+    Retrieve the spindle load logs of an interval.
 
-# ---------------------------------------------------------
-# 4. Fetch data
-# ---------------------------------------------------------
-dfs = []
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        Database connection engine.
+    start_ms, end_ms : int
+        Interval bounds in epoch ms (inclusive).
 
-for vid in temp_ids:
+    Returns
+    -------
+    pandas.DataFrame
+        Dataframe with columns real_date and value (% load).
+    """
     q = text("""
         SELECT to_timestamp(date/1000) AS real_date, value
         FROM public.variable_log_float
@@ -50,54 +111,75 @@ for vid in temp_ids:
         ORDER BY date;
     """)
     with engine.connect() as conn:
-        df = pd.read_sql(q, conn, params={"vid": vid, "start_ms": start_ms, "end_ms": end_ms})
+        df = pd.read_sql(q, conn, params={"vid": SPINDLE_ID, "start_ms": start_ms, "end_ms": end_ms})
+    df["value"] = pd.to_numeric(df["value"], errors="coerce")
+    return df
+
+
+def compute_energy(df_load: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert spindle load to power and integrate energy per segment.
+
+    Parameters
+    ----------
+    df_load : pandas.DataFrame
+        Dataframe with real_date and value (% load).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Dataframe indexed by real_date with power_kW, t_end, duration_h
+        and energy_kWh.
+    """
+    df = df_load[["real_date", "value"]].copy()
+
+    # Convert % spindle load to kW
+    df["power_kW"] = MAX_POWER_KW * (df["value"] / 100.0)
+
+    # Sort by time
+    df = df.sort_values("real_date")
 
-    if not df.empty:
-        df["id_var"] = vid
-        df["name"] = names[vid]
-        df["value"] = pd.to_numeric(df["value"], errors="coerce")
-        dfs.append(df)
+    # Compute segment end times (step signal)
+    df["t_end"] = df["real_date"].shift(-1)
+    df.loc[df["t_end"].isna(), "t_end"] = df["real_date"].iloc[-1]
 
-# ---------------------------------------------------------
-# 5. If no data stop
-# ---------------------------------------------------------
-if not dfs:
-    print("No data retrieved for this day.")
-    raise SystemExit
+    # Duration in hours
+    df["duration_h"] = (df["t_end"] - df["real_date"]).dt.total_seconds() / 3600.0
 
-df_all = pd.concat(dfs, ignore_index=True)
+    # Energy per segment
+    df["energy_kWh"] = df["power_kW"] * df["duration_h"]
 
-# ---------------------------------------------------------
-# 6. Power & Energy calculation
-# ---------------------------------------------------------
-df = df_all[["real_date", "value"]].copy()
+    df["real_date"] = pd.to_datetime(df["real_date"])
+    return df.set_index("real_date")
 
-# Convert % spindle load to kW
-df["power_kW"] = MAX_POWER_KW * (df["value"] / 100.0)
 
-# Sort by time
-df = df.sort_values("real_date")
+def hourly_average_power(df_energy: pd.DataFrame) -> pd.DataFrame:
+    """
+    Average power per hour.
 
-# Compute segment end times (step signal)
-df["t_end"] = df["real_date"].shift(-1)
-df.loc[df["t_end"].isna(), "t_end"] = df["real_date"].iloc[-1]
+    Parameters
+    ----------
+    df_energy : pandas.DataFrame
+        Dataframe returned by `compute_energy`.
 
-# Duration in hours
-df["duration_h"] = (df["t_end"] - df["real_date"]).dt.total_seconds() / 3600.0
+    Returns
+    -------
+    pandas.DataFrame
+        Columns real_date (hour start) and power_kW.
+    """
+    return df_energy["power_kW"].resample("1h").mean().reset_index()
 
-# Energy per segment
-df["energy_kWh"] = df["power_kW"] * df["duration_h"]
 
-# ---------------------------------------------------------
-# 7. Hourly average power
-# ---------------------------------------------------------
-df["real_date"] = pd.to_datetime(df["real_date"])
-df = df.set_index("real_date")
+if __name__ == "__main__":
+    engine = create_engine_from_config(load_db_config())
 
-df_hourly = df["power_kW"].resample("1H").mean().reset_index()
+    date_day = "2021-01-12"
+    start_ms = convert_timestamp_to_epoch_ms(engine, f"{date_day} 00:00:00")
+    end_ms = convert_timestamp_to_epoch_ms(engine, f"{date_day} 23:59:59")
 
-# ---------------------------------------------------------
-# 8. Print only hourly averages
-# ---------------------------------------------------------
-print(df_hourly)
+    df_load = fetch_spindle_load(engine, start_ms, end_ms)
+    if df_load.empty:
+        print("No data retrieved for this day.")
+        raise SystemExit
 
+    print(hourly_average_power(compute_energy(df_load)))
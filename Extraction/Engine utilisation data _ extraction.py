@@ -24,6 +24,16 @@ import pandas as pd
 from sqlalchemy import create_engine, text
 import yaml
 
+MOTOR_IDS = [584, 593, 598, 565, 514]
+NAMES = {
+    584: "Axis_8_Motor_Utilization",
+    593: "Axis_7_Motor_Utilization",
+    598: "Axis_6_Motor_Utilization",
+    565: "Axis_5_Motor_Utilization",
+    514: "Axis_4_Motor_Utilization"
+}
+
+
 def load_db_config(path: str = "config.yaml") -> dict:
     """
     Load the database configuration from a YAML file.
@@ -159,10 +169,10 @@ def plot_motor_utilization(df, var_ids, var_names, date_day):
 
     Returns
     -------
-    None
-        Displays a Matplotlib figure.
+    matplotlib.figure.Figure
+        The figure, to be shown or saved by the caller.
     """
-    plt.figure(figsize=(14, 5))
+    fig = plt.figure(figsize=(14, 5))
 
     for vid in var_ids:
         subset = df[df["id_var"] == vid]
@@ -174,7 +184,7 @@ def plot_motor_utilization(df, var_ids, var_names, date_day):
     plt.ylabel("Motor Utilization (%)")
     plt.legend()
     plt.tight_layout()
-    plt.show()
+    return fig
     
 
 if __name__ == "__main__":
@@ -187,25 +197,16 @@ if __name__ == "__main__":
     start_ts = f"{date_day} 00:00:00"
     end_ts = f"{date_day} 23:59:59"
 
-    # Variable IDs
-    motor_ids = [584, 593, 598, 565, 514]
-    names = {
-        584: "Axis_8_Motor_Utilization",
-        593: "Axis_7_Motor_Utilization",
-        598: "Axis_6_Motor_Utilization",
-        565: "Axis_5_Motor_Utilization",
-        514: "Axis_4_Motor_Utilization"
-    }
-
     # Convert timestamps
     start_ms = convert_timestamp_to_epoch_ms(engine, start_ts)
     end_ms = convert_timestamp_to_epoch_ms(engine, end_ts)
 
     # Fetch data
-    df_all = fetch_motor_utilization(engine, motor_ids, names, start_ms, end_ms)
+    df_all = fetch_motor_utilization(engine, MOTOR_IDS, NAMES, start_ms, end_ms)
 
     if df_all.empty:
         print("No data retrieved for this day.")
     else:
-        plot_motor_utilization(df_all, motor_ids, names, date_day)
+        plot_motor_utilization(df_all, MOTOR_IDS, NAMES, date_day)
+        plt.show()
 
@@ -1,3 +1,28 @@
+"""
+Machine Operation Timeline.
+
+This module retrieves MACHINE_IN_OPERATION (id 597) for one day, classifies
+every sample as ON (> 0), IDLE (= 0) or OFF / no signal (NaN), merges
+consecutive samples into state intervals and plots them as a timeline.
+
+Functions
+---------
+load_db_config :
+    Load database connection settings from config.yaml.
+create_engine_from_config :
+    Create SQLAlchemy engine from configuration dictionary.
+convert_timestamp_to_epoch_ms :
+    Convert human-readable timestamps to epoch milliseconds.
+fetch_operation_state :
+    Retrieve the raw MACHINE_IN_OPERATION logs.
+classify_state :
+    Map one value to OFF (0), IDLE (1) or ON (2).
+build_state_intervals :
+    Merge consecutive samples with the same state into intervals.
+plot_operation_timeline :
+    Plot the state intervals as a colored timeline.
+"""
+
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import pandas as pd
@@ -5,58 +30,99 @@ from sqlalchemy import create_engine, text
 import yaml
 import matplotlib.patches as mpatches
 
-# -----------------------------
-# 1. Load database config
-# -----------------------------
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
-
-db = config["database"]
-
-engine = create_engine(
-    f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['dbname']}"
-)
-
-# -----------------------------
-# 2. Parameters
-# -----------------------------
-date_day = "2021-01-12"
-start_ts = f"{date_day} 00:00:00"
-end_ts   = f"{date_day} 23:59:59"
-
-target_var = 597   # MACHINE_IN_OPERATION
-
-# -----------------------------
-# 3. Convert timestamps to epoch ms
-# -----------------------------
-epoch_query = text("SELECT extract(epoch FROM timestamp :t) AS s")
-with engine.connect() as conn:
-    start_ms = int(conn.execute(epoch_query, {"t": start_ts}).scalar() * 1000)
-    end_ms   = int(conn.execute(epoch_query, {"t": end_ts}).scalar() * 1000)
-
-# -----------------------------
-# 4. Fetch raw data
-# -----------------------------
-q = text("""
-    SELECT to_timestamp(date/1000) AS real_date, value
-    FROM public.variable_log_float
-    WHERE id_var = :vid
-      AND date BETWEEN :start_ms AND :end_ms
-    ORDER BY date;
-""")
-
-with engine.connect() as conn:
-    df = pd.read_sql(q, conn, params={"vid": target_var, "start_ms": start_ms, "end_ms": end_ms})
-
-if df.empty:
-    print("No data found for ID 597.")
-    raise SystemExit
-
-df["value"] = pd.to_numeric(df["value"], errors="coerce")
-
-# -----------------------------
-# 5. Define state: ON / IDLE / OFF
-# -----------------------------
+TARGET_VAR = 597   # MACHINE_IN_OPERATION
+STATE_NAMES = {2: "ON", 1: "IDLE", 0: "OFF"}
+
+
+def load_db_config(path: str = "config.yaml") -> dict:
+    """
+    Load database connection parameters from a YAML file.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to the YAML config file (default: "config.yaml").
+
+    Returns
+    -------
+    dict
+        Dictionary containing database parameters.
+    """
+    with open(path, "r") as f:
+        return yaml.safe_load(f)["database"]
+
+
+def create_engine_from_config(db: dict):
+    """
+    Create an SQLAlchemy engine using database configuration.
+
+    Parameters
+    ----------
+    db : dict
+        Must contain keys `user`, `password`, `host`, `port`, `dbname`.
+
+    Returns
+    -------
+    sqlalchemy.Engine
+        Database engine ready for querying.
+    """
+    return create_engine(
+        f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['dbname']}"
+    )
+
+
+def convert_timestamp_to_epoch_ms(engine, timestamp: str) -> int:
+    """
+    Convert a timestamp (YYYY-MM-DD HH:MM:SS) to epoch milliseconds.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        SQLAlchemy engine.
+    timestamp : str
+        Timestamp to convert.
+
+    Returns
+    -------
+    int
+        Epoch milliseconds.
+    """
+    epoch_query = text("SELECT extract(epoch FROM timestamp :t) AS s")
+    with engine.connect() as conn:
+        return int(conn.execute(epoch_query, {"t": timestamp}).scalar() * 1000)
+
+
+def fetch_operation_state(engine, start_ms: int, end_ms: int) -> pd.DataFrame:
+    """
+    Retrieve the MACHINE_IN_OPERATION logs of an interval.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        Database connection engine.
+    start_ms, end_ms : int
+        Interval bounds in epoch ms (inclusive).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Dataframe with columns real_date, value and state.
+    """
+    q = text("""
+        SELECT to_timestamp(date/1000) AS real_date, value
+        FROM public.variable_log_float
+        WHERE id_var = :vid
+          AND date BETWEEN :start_ms AND :end_ms
+        ORDER BY date;
+    """)
+    with engine.connect() as conn:
+        df = pd.read_sql(q, conn, params={"vid": TARGET_VAR, "start_ms": start_ms, "end_ms": end_ms})
+
+    df["value"] = pd.to_numeric(df["value"], errors="coerce")
+    df["state"] = df["value"].apply(classify_state)
+    return df
+
+
 # 2 = ON (>0), 1 = IDLE (=0), 0 = OFF / No Signal (NaN or missing)
 def classify_state(val):
     if pd.isna(val):
@@ -66,72 +132,113 @@ def classify_state(val):
     else:  # val > 0
         return 2   # ON → grön
 
-df["state"] = df["value"].apply(classify_state)
-
-# -----------------------------
-# 6. Build intervals for plotting
-# -----------------------------
-intervals = []
-start_time = df["real_date"].iloc[0]
-prev_state = df["state"].iloc[0]
-
-for i in range(1, len(df)):
-    current_time = df["real_date"].iloc[i]
-    current_state = df["state"].iloc[i]
-
-    if current_state != prev_state:
-        intervals.append((start_time, current_time, prev_state))
-        start_time = current_time
-        prev_state = current_state
-
-# -----------------------------
-# NEW: Extend final segment to day end
-# -----------------------------
-day_end = pd.to_datetime(end_ts)
-intervals.append((start_time, day_end, prev_state))
-
-
-# Convert intervals to matplotlib float-date format
-bar_data = []
-colors = []
-
-for start, end, state in intervals:
-    start_num = mdates.date2num(start)
-    duration = mdates.date2num(end) - start_num
-    bar_data.append((start_num, duration))
-
-    if state == 2:
-        colors.append("tab:green")   # ON
-    elif state == 1:
-        colors.append("gold")        # IDLE
-    else:
-        colors.append("tab:red")     # OFF / no signal
-
-# -----------------------------
-# 7. Plot timeline
-# -----------------------------
-fig, ax = plt.subplots(figsize=(16, 3))
-
-ax.broken_barh(bar_data, (0, 1), facecolors=colors, alpha=0.9)
-
-# Time axis: 5-minute intervals
-ax.xaxis.set_major_locator(mdates.MinuteLocator(interval=5))
-ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
-
-ax.set_ylim(0, 1)
-ax.set_yticks([])
-ax.set_xlabel("Time of Day")
-ax.set_title(f"Machine Operation Timeline — ID 597 — {date_day}", fontsize=15)
-
-# Legend
-legend_patches = [
-    mpatches.Patch(color="tab:green", label="ON"),
-    mpatches.Patch(color="gold", label="IDLE"),
-    mpatches.Patch(color="tab:red", label="OFF / No Signal")
-]
-ax.legend(handles=legend_patches, loc="upper right")
-
-plt.grid(axis="x", linestyle="--", alpha=0.3)
-plt.tight_layout()
-plt.show()
-print(df[['real_date', 'value', 'state']].to_string(index=False))
+
+def build_state_intervals(df: pd.DataFrame, day_end) -> list:
+    """
+    Merge consecutive samples with the same state into intervals.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Dataframe returned by `fetch_operation_state`.
+    day_end : datetime-like
+        End of the last interval (end of the day).
+
+    Returns
+    -------
+    list of tuple
+        (start, end, state) tuples covering the day from the first sample.
+    """
+    intervals = []
+    start_time = df["real_date"].iloc[0]
+    prev_state = df["state"].iloc[0]
+
+    for i in range(1, len(df)):
+        current_time = df["real_date"].iloc[i]
+        current_state = df["state"].iloc[i]
+
+        if current_state != prev_state:
+            intervals.append((start_time, current_time, prev_state))
+            start_time = current_time
+            prev_state = current_state
+
+    # Extend final segment to day end
+    intervals.append((start_time, day_end, prev_state))
+    return intervals
+
+
+def plot_operation_timeline(intervals: list, date_day: str):
+    """
+    Plot state intervals as a colored timeline.
+
+    Parameters
+    ----------
+    intervals : list of tuple
+        (start, end, state) tuples from `build_state_intervals`.
+    date_day : str
+        The date being plotted (format YYYY-MM-DD).
+
+    Returns
+    -------
+    matplotlib.figure.Figure
+        The figure, to be shown or saved by the caller.
+    """
+    # Convert intervals to matplotlib float-date format
+    bar_data = []
+    colors = []
+
+    for start, end, state in intervals:
+        start_num = mdates.date2num(start)
+        duration = mdates.date2num(end) - start_num
+        bar_data.append((start_num, duration))
+
+        if state == 2:
+            colors.append("tab:green")   # ON
+        elif state == 1:
+            colors.append("gold")        # IDLE
+        else:
+            colors.append("tab:red")     # OFF / no signal
+
+    fig, ax = plt.subplots(figsize=(16, 3))
+
+    ax.broken_barh(bar_data, (0, 1), facecolors=colors, alpha=0.9)
+
+    # Time axis: 5-minute intervals
+    ax.xaxis.set_major_locator(mdates.MinuteLocator(interval=5))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
+
+    ax.set_ylim(0, 1)
+    ax.set_yticks([])
+    ax.set_xlabel("Time of Day")
+    ax.set_title(f"Machine Operation Timeline — ID 597 — {date_day}", fontsize=15)
+
+    # Legend
+    legend_patches = [
+        mpatches.Patch(color="tab:green", label="ON"),
+        mpatches.Patch(color="gold", label="IDLE"),
+        mpatches.Patch(color="tab:red", label="OFF / No Signal")
+    ]
+    ax.legend(handles=legend_patches, loc="upper right")
+
+    plt.grid(axis="x", linestyle="--", alpha=0.3)
+    plt.tight_layout()
+    return fig
+
+
+if __name__ == "__main__":
+    engine = create_engine_from_config(load_db_config())
+
+    date_day = "2021-01-12"
+    end_ts = f"{date_day} 23:59:59"
+    start_ms = convert_timestamp_to_epoch_ms(engine, f"{date_day} 00:00:00")
+    end_ms = convert_timestamp_to_epoch_ms(engine, end_ts)
+
+    df = fetch_operation_state(engine, start_ms, end_ms)
+    if df.empty:
+        print("No data found for ID 597.")
+        raise SystemExit
+
+    intervals = build_state_intervals(df, pd.to_datetime(end_ts))
+    plot_operation_timeline(intervals, date_day)
+    plt.show()
+    print(df[['real_date', 'value', 'state']].to_string(index=False))
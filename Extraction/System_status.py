@@ -52,91 +52,193 @@ import pandas as pd
 from sqlalchemy import create_engine, text
 import yaml
 
-# --- 1. Load configuration file ---
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
-
-db = config["database"]
-
-engine = create_engine(
-    f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['dbname']}"
-)
-
-# --- 2. Date interval ---
-date_start = "2021-01-10"
-date_end   = "2021-01-15"
-
-start_ts = f"{date_start} 00:00:00"
-end_ts   = f"{date_end} 23:59:59"
-
-# --- 3. Convert timestamps to epoch milliseconds ---
-epoch_query = text("SELECT extract(epoch FROM timestamp :t) AS s")
-with engine.connect() as conn:
-    start_ms = int(conn.execute(epoch_query, {"t": start_ts}).scalar() * 1000)
-    end_ms   = int(conn.execute(epoch_query, {"t": end_ts}).scalar() * 1000)
-
-# --- 4. SQL: fetch log rows per hour and day ---
-q = text("""
-    SELECT
-        DATE(to_timestamp(date/1000)) AS day,
-        EXTRACT(HOUR FROM to_timestamp(date/1000)) AS hour,
-        COUNT(*) AS log_count
-    FROM public.variable_log_float
-    WHERE date BETWEEN :start_ms AND :end_ms
-    GROUP BY day, hour
-    ORDER BY day, hour;
-""")
-
-with engine.connect() as conn:
-    df = pd.read_sql(q, conn, params={"start_ms": start_ms, "end_ms": end_ms})
-
-if df.empty:
-    print("No data found.")
-    exit()
-
-df["hour"] = df["hour"].astype(int)
-
-# --- 5. Create pivot table (hours × days) ---
-pivot_table = df.pivot(index="hour", columns="day", values="log_count").fillna(0)
-
-# --- 6. DISPLAY THE TABLE using matplotlib.table ---
-fig, ax = plt.subplots(figsize=(14, 7))
-ax.axis('off')
-
-tbl = ax.table(
-    cellText=pivot_table.values,
-    rowLabels=pivot_table.index,
-    colLabels=pivot_table.columns,
-    loc='center',
-    cellLoc='center'
-)
-
-tbl.auto_set_font_size(False)
-tbl.set_fontsize(8)
-tbl.scale(1.2, 1.4)
-
-plt.title(f"Activity Table (logged rows per hour) – {date_start} to {date_end}", fontsize=14)
-plt.show()
-
-# --- 7. PLOT – Line chart across multiple days ---
-plt.figure(figsize=(15, 8))
-plt.style.use("seaborn-v0_8")
-
-for day in pivot_table.columns:
-    plt.plot(
-        pivot_table.index,
-        pivot_table[day],
-        marker="o",
-        linewidth=2,
-        label=str(day)
+
+def load_db_config(path: str = "config.yaml") -> dict:
+    """
+    Load database connection parameters from a YAML file.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to the YAML config file (default: "config.yaml").
+
+    Returns
+    -------
+    dict
+        Dictionary containing database parameters.
+    """
+    with open(path, "r") as f:
+        return yaml.safe_load(f)["database"]
+
+
+def create_engine_from_config(db: dict):
+    """
+    Create an SQLAlchemy engine using database configuration.
+
+    Parameters
+    ----------
+    db : dict
+        Must contain keys `user`, `password`, `host`, `port`, `dbname`.
+
+    Returns
+    -------
+    sqlalchemy.Engine
+        Database engine ready for querying.
+    """
+    return create_engine(
+        f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['dbname']}"
+    )
+
+
+def convert_timestamp_to_epoch_ms(engine, timestamp: str) -> int:
+    """
+    Convert a timestamp (YYYY-MM-DD HH:MM:SS) to epoch milliseconds.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        SQLAlchemy engine.
+    timestamp : str
+        Timestamp to convert.
+
+    Returns
+    -------
+    int
+        Epoch milliseconds.
+    """
+    epoch_query = text("SELECT extract(epoch FROM timestamp :t) AS s")
+    with engine.connect() as conn:
+        return int(conn.execute(epoch_query, {"t": timestamp}).scalar() * 1000)
+
+
+def fetch_activity_data(engine, start_ms: int, end_ms: int) -> pd.DataFrame:
+    """
+    Count logged rows per day and hour.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        Database connection engine.
+    start_ms, end_ms : int
+        Interval bounds in epoch ms (inclusive).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns day, hour (int) and log_count.
+    """
+    q = text("""
+        SELECT
+            DATE(to_timestamp(date/1000)) AS day,
+            EXTRACT(HOUR FROM to_timestamp(date/1000)) AS hour,
+            COUNT(*) AS log_count
+        FROM public.variable_log_float
+        WHERE date BETWEEN :start_ms AND :end_ms
+        GROUP BY day, hour
+        ORDER BY day, hour;
+    """)
+
+    with engine.connect() as conn:
+        df = pd.read_sql(q, conn, params={"start_ms": start_ms, "end_ms": end_ms})
+
+    df["hour"] = df["hour"].astype(int)
+    return df
+
+
+def build_pivot_table(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert hourly counts into an hour × day matrix.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Dataframe returned by `fetch_activity_data`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Rows are hours (0–23), columns are days, cells are log counts.
+    """
+    return df.pivot(index="hour", columns="day", values="log_count").fillna(0)
+
+
+def display_pivot_table(pivot_table: pd.DataFrame, date_start: str, date_end: str):
+    """
+    Render the pivot table as a matplotlib table.
+
+    Returns
+    -------
+    matplotlib.figure.Figure
+        The figure, to be shown or saved by the caller.
+    """
+    fig, ax = plt.subplots(figsize=(14, 7))
+    ax.axis('off')
+
+    tbl = ax.table(
+        cellText=pivot_table.values,
+        rowLabels=pivot_table.index,
+        colLabels=pivot_table.columns,
+        loc='center',
+        cellLoc='center'
     )
 
-plt.title(f"Activity per Hour – {date_start} to {date_end}", fontsize=16)
-plt.xlabel("Hour of Day (0–23)", fontsize=13)
-plt.ylabel("Number of Logged Rows", fontsize=13)
-plt.xticks(range(24))
-plt.grid(True, linestyle="--", alpha=0.5)
-plt.legend(title="Date")
-plt.tight_layout()
-plt.subplots_adjust(top=0.5)
-plt.show()
+    tbl.auto_set_font_size(False)
+    tbl.set_fontsize(8)
+    tbl.scale(1.2, 1.4)
+
+    plt.title(f"Activity Table (logged rows per hour) – {date_start} to {date_end}", fontsize=14)
+    return fig
+
+
+def plot_activity_trends(pivot_table: pd.DataFrame, date_start: str, date_end: str):
+    """
+    Plot one hourly activity curve per day.
+
+    Returns
+    -------
+    matplotlib.figure.Figure
+        The figure, to be shown or saved by the caller.
+    """
+    plt.style.use("seaborn-v0_8")
+    fig = plt.figure(figsize=(15, 8))
+
+    for day in pivot_table.columns:
+        plt.plot(
+            pivot_table.index,
+            pivot_table[day],
+            marker="o",
+            linewidth=2,
+            label=str(day)
+        )
+
+    plt.title(f"Activity per Hour – {date_start} to {date_end}", fontsize=16)
+    plt.xlabel("Hour of Day (0–23)", fontsize=13)
+    plt.ylabel("Number of Logged Rows", fontsize=13)
+    plt.xticks(range(24))
+    plt.grid(True, linestyle="--", alpha=0.5)
+    plt.legend(title="Date")
+    plt.tight_layout()
+    plt.subplots_adjust(top=0.5)
+    return fig
+
+
+if __name__ == "__main__":
+    engine = create_engine_from_config(load_db_config())
+
+    # --- Date interval ---
+    date_start = "2021-01-10"
+    date_end   = "2021-01-15"
+
+    start_ms = convert_timestamp_to_epoch_ms(engine, f"{date_start} 00:00:00")
+    end_ms = convert_timestamp_to_epoch_ms(engine, f"{date_end} 23:59:59")
+
+    df = fetch_activity_data(engine, start_ms, end_ms)
+    if df.empty:
+        print("No data found.")
+        raise SystemExit
+
+    pivot_table = build_pivot_table(df)
+    display_pivot_table(pivot_table, date_start, date_end)
+    plt.show()
+    plot_activity_trends(pivot_table, date_start, date_end)
+    plt.show()
@@ -1,26 +1,30 @@
+"""
+Motor Temperature Extraction and Plotting.
+
+This module retrieves the raw motor temperature logs of the selected axes
+for one day and plots them as a scatter plot per axis.
+
+Functions
+---------
+load_db_config :
+    Load database connection settings from config.yaml.
+create_engine_from_config :
+    Create SQLAlchemy engine from configuration dictionary.
+convert_timestamp_to_epoch_ms :
+    Convert human-readable timestamps to epoch milliseconds.
+fetch_motor_temperatures :
+    Retrieve raw temperature logs for a list of variable IDs.
+plot_motor_temperatures :
+    Scatter plot of the temperature of each axis.
+"""
+
 import matplotlib.pyplot as plt
 import pandas as pd
 from sqlalchemy import create_engine, text
-
-#create engine for connection to the database
 import yaml
 
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
-
-db = config["database"]
-
-engine = create_engine(
-    f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['dbname']}"
-)
-
-# --- Parameters ---
-date_day = "2021-01-12"
-start_ts = f"{date_day} 00:00:00"
-end_ts   = f"{date_day} 23:59:59"
-
-temp_ids = [449, 453, 456, 448, 454]
-names = {
+TEMP_IDS = [449, 453, 456, 448, 454]
+NAMES = {
     449: "TEMPERATURA_MOTOR_8",
     453: "TEMPERATURA_MOTOR_7",
     456: "TEMPERATURA_MOTOR_6",
@@ -28,16 +32,85 @@ names = {
     454: "TEMPERATURA_MOTOR_4"
 }
 
-# --- Convert timestamps to epoch (ms) ---
-epoch_query = text("SELECT extract(epoch FROM timestamp :t) AS s")
-with engine.connect() as conn:
-    start_ms = int(conn.execute(epoch_query, {"t": start_ts}).scalar() * 1000)
-    end_ms   = int(conn.execute(epoch_query, {"t": end_ts}).scalar() * 1000)
 
-dfs = []
+def load_db_config(path: str = "config.yaml") -> dict:
+    """
+    Load database connection parameters from a YAML file.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to the YAML config file (default: "config.yaml").
+
+    Returns
+    -------
+    dict
+        Dictionary containing database parameters.
+    """
+    with open(path, "r") as f:
+        return yaml.safe_load(f)["database"]
+
+
+def create_engine_from_config(db: dict):
+    """
+    Create an SQLAlchemy engine using database configuration.
+
+    Parameters
+    ----------
+    db : dict
+        Must contain keys `user`, `password`, `host`, `port`, `dbname`.
+
+    Returns
+    -------
+    sqlalchemy.Engine
+        Database engine ready for querying.
+    """
+    return create_engine(
+        f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['dbname']}"
+    )
+
+
+def convert_timestamp_to_epoch_ms(engine, timestamp: str) -> int:
+    """
+    Convert a timestamp (YYYY-MM-DD HH:MM:SS) to epoch milliseconds.
 
-# --- Fetch data for each variable ---
-for vid in temp_ids:
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        SQLAlchemy engine.
+    timestamp : str
+        Timestamp to convert.
+
+    Returns
+    -------
+    int
+        Epoch milliseconds.
+    """
+    epoch_query = text("SELECT extract(epoch FROM timestamp :t) AS s")
+    with engine.connect() as conn:
+        return int(conn.execute(epoch_query, {"t": timestamp}).scalar() * 1000)
+
+
+def fetch_motor_temperatures(engine, var_ids: list, names: dict, start_ms: int, end_ms: int) -> pd.DataFrame:
+    """
+    Retrieve raw temperature logs for several variables.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        Database connection engine.
+    var_ids : list of int
+        Variable IDs to load.
+    names : dict
+        Mapping from variable ID to human-readable label.
+    start_ms, end_ms : int
+        Interval bounds in epoch ms (inclusive).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Combined dataframe with columns real_date, value, id_var and name.
+    """
     q = text("""
         SELECT to_timestamp(date/1000) AS real_date, value
         FROM public.variable_log_float
@@ -45,24 +118,44 @@ for vid in temp_ids:
           AND date BETWEEN :start_ms AND :end_ms
         ORDER BY date;
     """)
-    with engine.connect() as conn:
-        df = pd.read_sql(q, conn, params={"vid": vid, "start_ms": start_ms, "end_ms": end_ms})
-    if not df.empty:
-        df["id_var"] = vid
-        df["name"] = names[vid]
-        df["value"] = pd.to_numeric(df["value"], errors="coerce")
-        dfs.append(df)
-    else:
-        print(f"No data found for {names[vid]}")
 
-# --- Combine and plot ---
-if not dfs:
-    print("No data retrieved for this day.")
-else:
-    df_all = pd.concat(dfs, ignore_index=True)
+    dfs = []
+    for vid in var_ids:
+        with engine.connect() as conn:
+            df = pd.read_sql(q, conn, params={"vid": vid, "start_ms": start_ms, "end_ms": end_ms})
+        if not df.empty:
+            df["id_var"] = vid
+            df["name"] = names[vid]
+            df["value"] = pd.to_numeric(df["value"], errors="coerce")
+            dfs.append(df)
+        else:
+            print(f"No data found for {names[vid]}")
 
-    plt.figure(figsize=(14, 5))
-    for vid in temp_ids:
+    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+
+
+def plot_motor_temperatures(df_all: pd.DataFrame, var_ids: list, names: dict, date_day: str):
+    """
+    Scatter plot of the temperature of each axis over the day.
+
+    Parameters
+    ----------
+    df_all : pandas.DataFrame
+        Dataframe returned by `fetch_motor_temperatures`.
+    var_ids : list of int
+        Ordered list of variable IDs.
+    names : dict
+        Mapping of variable ID to descriptive label.
+    date_day : str
+        The date being plotted (format YYYY-MM-DD).
+
+    Returns
+    -------
+    matplotlib.figure.Figure
+        The figure, to be shown or saved by the caller.
+    """
+    fig = plt.figure(figsize=(14, 5))
+    for vid in var_ids:
         sub = df_all[df_all["id_var"] == vid]
         if not sub.empty:
             plt.scatter(sub["real_date"], sub["value"], s=10, label=names[vid])
@@ -72,5 +165,20 @@ else:
     plt.ylabel("Temperature (°C)")
     plt.legend()
     plt.tight_layout()
+    return fig
 
-    plt.show()
+
+if __name__ == "__main__":
+    engine = create_engine_from_config(load_db_config())
+
+    # --- Parameters ---
+    date_day = "2021-01-12"
+    start_ms = convert_timestamp_to_epoch_ms(engine, f"{date_day} 00:00:00")
+    end_ms = convert_timestamp_to_epoch_ms(engine, f"{date_day} 23:59:59")
+
+    df_all = fetch_motor_temperatures(engine, TEMP_IDS, NAMES, start_ms, end_ms)
+    if df_all.empty:
+        print("No data retrieved for this day.")
+    else:
+        plot_motor_temperatures(df_all, TEMP_IDS, NAMES, date_day)
+        plt.show()
@@ -24,6 +24,15 @@ import pandas as pd
 from sqlalchemy import create_engine, text
 import yaml
 
+TEMP_IDS = [449, 453, 456, 448, 454]
+NAMES = {
+    449: "TEMPERATURA_MOTOR_8",
+    453: "TEMPERATURA_MOTOR_7",
+    456: "TEMPERATURA_MOTOR_6",
+    448: "TEMPERATURA_MOTOR_5",
+    454: "TEMPERATURA_MOTOR_4",
+}
+
 
 def load_config(path: str) -> dict:
     """
@@ -157,12 +166,12 @@ def resample_temperature_data(df: pd.DataFrame, freq: str = "30T") -> dict:
     dict
         Mapping: variable ID → resampled DataFrame (mean & max).
     """
-    results = {}
-    for vid in df["id_var"].unique():
-        sub = df[df["id_var"] == vid]
-        resampled = sub["value"].resample(freq).agg(["mean", "max"])
-        results[vid] = resampled
-    return results
+    # One grouped pass over the frame instead of filtering it once per variable.
+    resampled = df.groupby("id_var")["value"].resample(freq).agg(["mean", "max"])
+    return {
+        vid: resampled.xs(vid, level="id_var")
+        for vid in resampled.index.unique(level="id_var")
+    }
 
 
 def plot_temperature_resampled(resampled_dict: dict, names: dict, date_day: str):
@@ -177,8 +186,13 @@ def plot_temperature_resampled(resampled_dict: dict, names: dict, date_day: str)
         Mapping variable ID → descriptive name.
     date_day : str
         Day of analysis (YYYY-MM-DD).
+
+    Returns
+    -------
+    matplotlib.figure.Figure
+        The figure, to be shown or saved by the caller.
     """
-    plt.figure(figsize=(14, 6))
+    fig = plt.figure(figsize=(14, 6))
 
     for vid, df_res in resampled_dict.items():
         plt.scatter(df_res.index, df_res["mean"],
@@ -192,7 +206,7 @@ def plot_temperature_resampled(resampled_dict: dict, names: dict, date_day: str)
     plt.legend()
     plt.grid(True)
     plt.tight_layout()
-    plt.show()
+    return fig
 
 
 def main():
@@ -211,22 +225,14 @@ def main():
     start_ms = convert_timestamp_to_epoch_ms(engine, f"{date_day} 00:00:00")
     end_ms = convert_timestamp_to_epoch_ms(engine, f"{date_day} 23:59:59")
 
-    temp_ids = [449, 453, 456, 448, 454]
-    names = {
-        449: "TEMPERATURA_MOTOR_8",
-        453: "TEMPERATURA_MOTOR_7",
-        456: "TEMPERATURA_MOTOR_6",
-        448: "TEMPERATURA_MOTOR_5",
-        454: "TEMPERATURA_MOTOR_4",
-    }
-
-    df = fetch_temperature_data(engine, temp_ids, names, start_ms, end_ms)
+    df = fetch_temperature_data(engine, TEMP_IDS, NAMES, start_ms, end_ms)
     if df.empty:
         print("No data retrieved for this day.")
         return
 
     resampled = resample_temperature_data(df)
-    plot_temperature_resampled(resampled, names, date_day)
+    plot_temperature_resampled(resampled, NAMES, date_day)
+    plt.show()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+"""
+Local Archive Access for the Extraction Toolbox.
+
+This module reads signals from the local memory-mapped archive maintained
+by `python -m backend.archive sync`, instead of pulling the same months
+over the network from `variable_log_float` again.
+
+The returned dataframe has the same layout as the `fetch_*` functions of
+the extraction scripts (value, id_var, name, indexed by real_date), so it
+can be passed directly to their resampling and plotting functions.
+
+Functions
+---------
+fetch_archive_data :
+    Load several variables for a time interval from the archive.
+archive_covers :
+    Check whether the archive holds a complete copy of an interval.
+"""
+
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+# The archive code lives in the backend package at the project root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.archive import Archive, ARCHIVE_DIR  # noqa: E402
+
+
+def _to_epoch_ms(timestamp: str) -> int:
+    return int(datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").timestamp() * 1000)
+
+
+def archive_covers(var_ids: list, start_ts: str, end_ts: str, root: str = ARCHIVE_DIR) -> bool:
+    """
+    Check whether every variable is fully archived for the interval.
+
+    Parameters
+    ----------
+    var_ids : list of int
+        Variable IDs to check.
+    start_ts, end_ts : str
+        Interval bounds in format 'YYYY-MM-DD HH:MM:SS' (end inclusive).
+    root : str, optional
+        Archive directory.
+
+    Returns
+    -------
+    bool
+        True if the interval can be read without querying the database.
+    """
+    archive = Archive(root)
+    start_ms, end_ms = _to_epoch_ms(start_ts), _to_epoch_ms(end_ts) + 1000
+    return all(archive.covers(vid, start_ms, end_ms) for vid in var_ids)
+
+
+def fetch_archive_data(var_ids: list, names: dict, start_ts: str, end_ts: str,
+                       root: str = ARCHIVE_DIR) -> pd.DataFrame:
+    """
+    Load several variables for a time interval from the local archive.
+
+    Parameters
+    ----------
+    var_ids : list of int
+        Variable IDs to load.
+    names : dict
+        Mapping from variable ID to human-readable label.
+    start_ts, end_ts : str
+        Interval bounds in format 'YYYY-MM-DD HH:MM:SS' (end inclusive).
+    root : str, optional
+        Archive directory.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Combined dataframe indexed by real_date (datetime, local time
+        zone), containing:
+        - value (float)
+        - id_var
+        - name
+    """
+    archive = Archive(root)
+    start_ms, end_ms = _to_epoch_ms(start_ts), _to_epoch_ms(end_ts) + 1000
+    local_tz = datetime.now().astimezone().tzinfo
+
+    dfs = []
+    for vid in var_ids:
+        ts, values = archive.read(vid, start_ms, end_ms)
+        if not len(ts):
+            print(f"No archived data for {names.get(vid, vid)}")
+            continue
+        dfs.append(pd.DataFrame({
+            "real_date": pd.to_datetime(ts, unit="ms", utc=True).tz_convert(local_tz),
+            "value": values.astype(float),
+            "id_var": vid,
+            "name": names.get(vid, str(vid)),
+        }).set_index("real_date"))
+
+    return pd.concat(dfs) if dfs else pd.DataFrame()
+
+
+if __name__ == "__main__":
+    date_day = "2021-01-12"
+    temp_ids = [449, 453, 456, 448, 454]
+    names = {
+        449: "TEMPERATURA_MOTOR_8",
+        453: "TEMPERATURA_MOTOR_7",
+        456: "TEMPERATURA_MOTOR_6",
+        448: "TEMPERATURA_MOTOR_5",
+        454: "TEMPERATURA_MOTOR_4",
+    }
+
+    start_ts, end_ts = f"{date_day} 00:00:00", f"{date_day} 23:59:59"
+    if not archive_covers(temp_ids, start_ts, end_ts):
+        print("Interval not fully archived; run `python -m backend.archive sync` first.")
+    df = fetch_archive_data(temp_ids, names, start_ts, end_ts)
+    print(df.groupby("name")["value"].describe() if not df.empty else "No data.")
@@ -0,0 +1,439 @@
+"""
+Daily Machine Reports
+=====================
+
+This module renders one static HTML report per day with the machine state
+timeline, the motor temperatures, the spindle energy and the alarms, built
+from the functions of the extraction scripts.
+
+A date range is processed in three steps:
+
+1. One grouped query returns, per day, the number of logged rows and the
+   newest timestamp of every report input. Hashed together with
+   REPORT_VERSION this is the day's fingerprint; days whose fingerprint
+   matches the one stored in `manifest.json` of the output folder are
+   already up to date and are skipped.
+2. The inputs of the remaining days are fetched with one query per table
+   (variable_log_float and variable_log_string) per batch of at most
+   BATCH_DAYS consecutive days, instead of one query per variable and day,
+   and split by day.
+3. The days are rendered in a process pool. The next batch is fetched
+   while the previous one renders, so at most two batches are held in
+   memory. Figures are embedded as PNG images, so every report is a
+   single self-contained file.
+
+Usage (from the Extraction folder)
+----------------------------------
+python daily_report.py 2021-01-01 2021-01-31 --out reports --jobs 4
+
+Functions
+---------
+day_fingerprints :
+    Fingerprint of the report inputs of every day of a range.
+fetch_report_inputs :
+    Load the inputs of several consecutive days with one query per table.
+render_report :
+    Render the HTML report of one day.
+generate_reports :
+    Render the out-of-date reports of a date range.
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+from extract import HERE, day_range, get_engine, load_script
+
+REPORT_VERSION = 2  # bump when the report layout changes to re-render all days
+BATCH_DAYS = 7      # days fetched per query; a day of inputs is ~0.5M rows
+
+STATE_ID = 597
+SPINDLE_ID = 630
+ALARM_ID = 447
+TEMP_IDS = [449, 453, 456, 448, 454]
+FLOAT_IDS = [STATE_ID, SPINDLE_ID] + TEMP_IDS
+
+MANIFEST = "manifest.json"
+
+
+def _consecutive_runs(days: list, max_days: int = BATCH_DAYS) -> list:
+    """Split sorted YYYY-MM-DD days into lists of at most max_days consecutive days."""
+    runs = []
+    for day in days:
+        current = datetime.strptime(day, "%Y-%m-%d")
+        if (runs and len(runs[-1]) < max_days
+                and datetime.strptime(runs[-1][-1], "%Y-%m-%d") + timedelta(days=1) == current):
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    return runs
+
+
+def _day_starts(engine, days: list) -> list:
+    """
+    Epoch ms of the start of every day and of the day after the last.
+
+    Computed by the database in one query, with the same conversion as
+    `convert_timestamp_to_epoch_ms` of the extraction scripts. Day i spans
+    [starts[i], starts[i + 1]); rows are filed under days, and fingerprinted,
+    by these bounds only.
+    """
+    from sqlalchemy import text
+
+    after = (datetime.strptime(days[-1], "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    query = text("""
+        SELECT extract(epoch FROM CAST(t AS timestamp)) AS s
+        FROM unnest(CAST(:days AS text[])) WITH ORDINALITY AS d(t, i)
+        ORDER BY i;
+    """)
+    with engine.connect() as conn:
+        rows = conn.execute(query, {"days": [f"{day} 00:00:00" for day in days + [after]]}).fetchall()
+    return [int(row[0] * 1000) for row in rows]
+
+
+def day_fingerprints(engine, date_start: str, date_end: str) -> dict:
+    """
+    Fingerprint of the report inputs of every day of a range.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        Database connection engine.
+    date_start, date_end : str
+        First and last day (inclusive), YYYY-MM-DD.
+
+    Returns
+    -------
+    dict
+        Mapping day -> hex digest. Days without any input are included, so
+        their report changes once data arrives.
+    """
+    from sqlalchemy import text
+
+    # width_bucket files every row under the day whose bounds contain it.
+    query = text("""
+        SELECT width_bucket(date, CAST(:starts AS bigint[])) AS i,
+               'float' AS source, COUNT(*) AS n, MAX(date) AS last
+        FROM public.variable_log_float
+        WHERE id_var = ANY(:float_ids)
+          AND date >= :start_ms
+          AND date < :end_ms
+        GROUP BY 1
+        UNION ALL
+        SELECT width_bucket(date, CAST(:starts AS bigint[])) AS i,
+               'string' AS source, COUNT(*) AS n, MAX(date) AS last
+        FROM public.variable_log_string
+        WHERE id_var = :alarm_id
+          AND date >= :start_ms
+          AND date < :end_ms
+        GROUP BY 1;
+    """)
+    days = day_range(date_start, date_end)
+    starts = _day_starts(engine, days)
+    with engine.connect() as conn:
+        rows = conn.execute(query, {"float_ids": FLOAT_IDS, "alarm_id": ALARM_ID, "starts": starts,
+                                    "start_ms": starts[0], "end_ms": starts[-1]}).fetchall()
+
+    parts = {day: [f"v{REPORT_VERSION}"] for day in days}
+    for i, source, n, last in sorted(rows):
+        parts[days[i - 1]].append(f"{source}:{n}:{last}")
+    return {day: hashlib.sha1("|".join(p).encode()).hexdigest() for day, p in parts.items()}
+
+
+def fetch_report_inputs(engine, days: list) -> dict:
+    """
+    Load the inputs of consecutive days with one query per table.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        Database connection engine.
+    days : list of str
+        Consecutive days, YYYY-MM-DD.
+
+    Returns
+    -------
+    dict
+        Mapping day -> (float logs, alarm logs, end of the day in epoch
+        ms). The float dataframe has columns real_date, value and id_var;
+        the alarm dataframe has real_date and value, as returned by
+        `fetch_alarm_raw`. Rows are split by the bounds of `_day_starts`.
+    """
+    import numpy as np
+    import pandas as pd
+    from sqlalchemy import text
+
+    float_query = text("""
+        SELECT date, to_timestamp(date/1000) AS real_date, value, id_var
+        FROM public.variable_log_float
+        WHERE id_var = ANY(:float_ids)
+          AND date >= :start_ms
+          AND date < :end_ms
+        ORDER BY date;
+    """)
+    alarm_query = text("""
+        SELECT date, to_timestamp(date/1000) AS real_date, value
+        FROM public.variable_log_string
+        WHERE id_var = :alarm_id
+          AND date >= :start_ms
+          AND date < :end_ms
+        ORDER BY date;
+    """)
+    starts = _day_starts(engine, days)
+    params = {"float_ids": FLOAT_IDS, "alarm_id": ALARM_ID, "start_ms": starts[0], "end_ms": starts[-1]}
+    with engine.connect() as conn:
+        df_float = pd.read_sql(float_query, conn, params=params)
+        df_alarm = pd.read_sql(alarm_query, conn, params=params)
+    df_float["value"] = pd.to_numeric(df_float["value"], errors="coerce")
+
+    def split(df):
+        # Rows are ordered by date: day i is the slice between its bounds.
+        cuts = np.searchsorted(df["date"].to_numpy(), starts)
+        df = df.drop(columns="date")
+        return [df.iloc[lo:hi].reset_index(drop=True) for lo, hi in zip(cuts[:-1], cuts[1:])]
+
+    floats, alarms = split(df_float), split(df_alarm)
+    return {day: (floats[i], alarms[i], starts[i + 1]) for i, day in enumerate(days)}
+
+
+# --- Rendering ----------------------------------------------------------------
+
+def _figure_html(fig) -> str:
+    import matplotlib.pyplot as plt
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=80)
+    plt.close(fig)
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return f'<img src="data:image/png;base64,{encoded}">'
+
+
+def _state_section(df_float, date_day: str, day_end_ms: int) -> str:
+    import pandas as pd
+
+    script = load_script("state")
+    df = df_float[df_float["id_var"] == STATE_ID].reset_index(drop=True)
+    if df.empty:
+        return "<p>No MACHINE_IN_OPERATION data.</p>"
+    df = df.assign(state=df["value"].apply(script.classify_state))
+    day_end = pd.to_datetime(day_end_ms, unit="ms", utc=True).tz_convert(df["real_date"].dt.tz)
+    intervals = script.build_state_intervals(df, day_end)
+    table = pd.DataFrame(intervals, columns=["start", "end", "state"])
+    table["hours"] = (table["end"] - table["start"]).dt.total_seconds() / 3600
+    totals = table.groupby(table["state"].map(script.STATE_NAMES))["hours"].sum().round(2).to_frame()
+    return _figure_html(script.plot_operation_timeline(intervals, date_day)) + totals.to_html()
+
+
+def _temperature_section(df_float, date_day: str) -> str:
+    script = load_script("temperature")
+    df = df_float[df_float["id_var"].isin(TEMP_IDS)].set_index("real_date")
+    if df.empty:
+        return "<p>No temperature data.</p>"
+    resampled = script.resample_temperature_data(df, freq="30min")
+    summary = (df.groupby("id_var")["value"].agg(["mean", "max"]).round(1)
+               .rename(index=script.NAMES).rename_axis("motor"))
+    return _figure_html(script.plot_temperature_resampled(resampled, script.NAMES, date_day)) + summary.to_html()
+
+
+def _energy_section(df_float, date_day: str) -> str:
+    import matplotlib.pyplot as plt
+
+    script = load_script("energy")
+    df_load = df_float[df_float["id_var"] == SPINDLE_ID][["real_date", "value"]].reset_index(drop=True)
+    if df_load.empty:
+        return "<p>No spindle load data.</p>"
+    df_energy = script.compute_energy(df_load)
+    hourly = script.hourly_average_power(df_energy)
+
+    fig = plt.figure(figsize=(14, 4))
+    plt.bar(hourly["real_date"].dt.hour, hourly["power_kW"])
+    plt.title(f"Average Spindle Power per Hour — {date_day}")
+    plt.xlabel("Hour of Day")
+    plt.ylabel("Power (kW)")
+    plt.xticks(range(24))
+    plt.tight_layout()
+    total = df_energy["energy_kWh"].sum()
+    return f"<p>Spindle energy: <b>{total:.1f} kWh</b></p>" + _figure_html(fig)
+
+
+def _alarm_section(df_alarm) -> str:
+    script = load_script("alarms")
+    if df_alarm.empty:
+        return "<p>No alarm data.</p>"
+    details = script.parse_alarm_entries(df_alarm)
+    summary = script.summarize_alarms(details)
+    if summary.empty:
+        return "<p>No alarms.</p>"
+    fig = script.plot_alarm_timeline(details)
+    return _figure_html(fig) + summary.to_html(index=False)
+
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Machine report {day}</title>
+<style>body{{font-family:sans-serif;margin:2em}} img{{max-width:100%}}
+table{{border-collapse:collapse}} td,th{{border:1px solid #ccc;padding:2px 8px}}</style>
+</head><body>
+<h1>Machine report — {day}</h1>
+<h2>Machine state</h2>{state}
+<h2>Motor temperatures</h2>{temperature}
+<h2>Spindle energy</h2>{energy}
+<h2>Alarms</h2>{alarms}
+<p><small>Generated {generated}</small></p>
+</body></html>
+"""
+
+
+def render_report(date_day: str, df_float, df_alarm, day_end_ms: int, out_dir: str) -> str:
+    """
+    Render the HTML report of one day.
+
+    Parameters
+    ----------
+    date_day : str
+        Day of the report, YYYY-MM-DD.
+    df_float, df_alarm : pandas.DataFrame
+        The day's inputs from `fetch_report_inputs`.
+    day_end_ms : int
+        End of the day in epoch ms, from `fetch_report_inputs`.
+    out_dir : str
+        Output folder.
+
+    Returns
+    -------
+    str
+        Path of the written report.
+    """
+    html = PAGE.format(
+        day=date_day,
+        state=_state_section(df_float, date_day, day_end_ms),
+        temperature=_temperature_section(df_float, date_day),
+        energy=_energy_section(df_float, date_day),
+        alarms=_alarm_section(df_alarm),
+        generated=datetime.now().strftime("%Y-%m-%d %H:%M"),
+    )
+    path = os.path.join(out_dir, f"report_{date_day}.html")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(html)
+    os.replace(tmp, path)
+    return path
+
+
+# --- Pipeline -------------------------------------------------------------------
+
+def _load_manifest(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, MANIFEST), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(out_dir: str, manifest: dict):
+    path = os.path.join(out_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _write_index(out_dir: str, manifest: dict):
+    links = "\n".join(f'<li><a href="report_{day}.html">{day}</a></li>'
+                      for day in sorted(manifest, reverse=True))
+    with open(os.path.join(out_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Machine reports</title>"
+                f"</head><body><h1>Machine reports</h1><ul>\n{links}\n</ul></body></html>\n")
+
+
+def generate_reports(engine, date_start: str, date_end: str, out_dir: str,
+                     jobs: int = None, force: bool = False) -> dict:
+    """
+    Render the out-of-date reports of a date range.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        Database connection engine.
+    date_start, date_end : str
+        First and last day (inclusive), YYYY-MM-DD.
+    out_dir : str
+        Output folder; holds the reports, index.html and manifest.json.
+    jobs : int, optional
+        Rendering processes (default: number of CPUs).
+    force : bool, optional
+        Re-render every day regardless of the manifest.
+
+    Returns
+    -------
+    dict
+        Counts of rendered, skipped and failed days.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = _load_manifest(out_dir)
+    fingerprints = day_fingerprints(engine, date_start, date_end)
+    stale = [day for day, fp in sorted(fingerprints.items())
+             if force or manifest.get(day) != fp
+             or not os.path.exists(os.path.join(out_dir, f"report_{day}.html"))]
+    counts = {"rendered": 0, "skipped": len(fingerprints) - len(stale), "failed": 0}
+
+    def collect(futures):
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"{day}: failed ({e})", file=sys.stderr)
+                continue
+            counts["rendered"] += 1
+            manifest[day] = fingerprints[day]
+            _save_manifest(out_dir, manifest)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = {}
+        for batch in _consecutive_runs(stale):
+            # Fetched while the previous batch renders; that one is
+            # collected before the next fetch, so two batches at most are held.
+            futures = {pool.submit(render_report, day, *inputs, out_dir): day
+                       for day, inputs in fetch_report_inputs(engine, batch).items()}
+            collect(pending)
+            pending = futures
+        collect(pending)
+
+    _write_index(out_dir, manifest)
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Render daily machine reports as static HTML.")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", nargs="?", help="last day (inclusive), YYYY-MM-DD; defaults to start")
+    parser.add_argument("--out", default=os.path.join(HERE, "reports"), help="output folder")
+    parser.add_argument("--jobs", type=int, default=None, help="rendering processes")
+    parser.add_argument("--force", action="store_true", help="re-render up-to-date days too")
+    parser.add_argument("--config", default=os.path.join(HERE, "config.yaml"), help="database config file")
+    args = parser.parse_args(argv)
+
+    try:
+        if not day_range(args.start, args.end or args.start):
+            parser.error("end must not be before start")
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Headless rendering; inherited by the worker processes.
+    os.environ["MPLBACKEND"] = "Agg"
+    counts = generate_reports(get_engine(args.config), args.start, args.end or args.start,
+                              args.out, jobs=args.jobs, force=args.force)
+    print(f"{counts['rendered']} rendered, {counts['skipped']} up to date, {counts['failed']} failed"
+          f" — {os.path.join(args.out, 'index.html')}")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
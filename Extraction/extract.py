@@ -0,0 +1,303 @@
+"""
+Extraction Command Line
+=======================
+
+One entry point for the extraction scripts. Each subcommand runs one
+script over a range of days:
+
+- alarms : alarm timeline and occurrence summary (Alarm data _ extraction.py)
+- temperature : 30-minute mean and max temperature (Temperature data mean and max.py)
+- motors : motor utilization per axis (Engine utilisation data _ extraction.py)
+- state : ON / IDLE / OFF timeline of the machine (Extraction_operation_in_progress.py)
+- energy : hourly average spindle power (Energy_usage.py)
+- activity : logged rows per hour and day (System_status.py)
+
+Without --out the figures of each day are shown one day at a time. With
+--out the run is headless: matplotlib uses the Agg backend, every day's
+figures (PNG) and tables (CSV) are written to DIR, and the days are
+rendered in a pool of --jobs processes.
+
+Heavy libraries (pandas, matplotlib, SQLAlchemy) and the scripts
+themselves are only imported when a command runs, so `--help` and argument
+errors are instant.
+
+Usage (from the Extraction folder)
+----------------------------------
+python extract.py alarms 2020-12-29
+python extract.py temperature 2021-01-10 2021-01-15 --out reports --jobs 4
+python extract.py activity 2021-01-10 2021-01-15 --out reports
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = {
+    "alarms": "Alarm data _ extraction.py",
+    "temperature": "Temperature data mean and max.py",
+    "motors": "Engine utilisation data _ extraction.py",
+    "state": "Extraction_operation_in_progress.py",
+    "energy": "Energy_usage.py",
+    "activity": "System_status.py",
+}
+
+_engine = None
+
+
+def load_script(command: str):
+    """
+    Import the script of a subcommand (file names contain spaces).
+
+    Parameters
+    ----------
+    command : str
+        Key of SCRIPTS.
+
+    Returns
+    -------
+    module
+        The imported script, cached in sys.modules.
+    """
+    name = f"extraction_{command}"
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, SCRIPTS[command]))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+def get_engine(config_path: str):
+    """
+    SQLAlchemy engine of this process, created on first use.
+
+    Parameters
+    ----------
+    config_path : str
+        Path to the YAML config file with a `database` section.
+
+    Returns
+    -------
+    sqlalchemy.Engine
+        Database engine ready for querying.
+    """
+    global _engine
+    if _engine is None:
+        import yaml
+        from sqlalchemy import create_engine
+
+        with open(config_path, "r") as f:
+            db = yaml.safe_load(f)["database"]
+        _engine = create_engine(
+            f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['dbname']}"
+        )
+    return _engine
+
+
+def day_range(start: str, end: str) -> list:
+    """Days from start to end (inclusive) as YYYY-MM-DD strings."""
+    first = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    return [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((last - first).days + 1)]
+
+
+def _bounds(module, engine, date_start: str, date_end: str):
+    start_ms = module.convert_timestamp_to_epoch_ms(engine, f"{date_start} 00:00:00")
+    end_ms = module.convert_timestamp_to_epoch_ms(engine, f"{date_end} 23:59:59")
+    return start_ms, end_ms
+
+
+# --- Subcommands ------------------------------------------------------------
+# Each returns (figures, tables): dicts of name -> Figure and name -> DataFrame.
+
+def run_alarms(engine, date_day: str):
+    script = load_script("alarms")
+    df_raw = script.fetch_alarm_raw(engine, *_bounds(script, engine, date_day, date_day))
+    if df_raw.empty:
+        return {}, {}
+    details = script.parse_alarm_entries(df_raw)
+    fig = script.plot_alarm_timeline(details)
+    return ({"timeline": fig} if fig is not None else {}), {"summary": script.summarize_alarms(details)}
+
+
+def run_temperature(engine, date_day: str):
+    import pandas as pd
+
+    script = load_script("temperature")
+    df = script.fetch_temperature_data(engine, script.TEMP_IDS, script.NAMES,
+                                       *_bounds(script, engine, date_day, date_day))
+    if df.empty:
+        return {}, {}
+    resampled = script.resample_temperature_data(df, freq="30min")
+    table = pd.concat({script.NAMES[vid]: df_res for vid, df_res in resampled.items()}, names=["name"])
+    fig = script.plot_temperature_resampled(resampled, script.NAMES, date_day)
+    return {"resampled": fig}, {"resampled": table.reset_index()}
+
+
+def run_motors(engine, date_day: str):
+    script = load_script("motors")
+    df = script.fetch_motor_utilization(engine, script.MOTOR_IDS, script.NAMES,
+                                        *_bounds(script, engine, date_day, date_day))
+    if df.empty:
+        return {}, {}
+    hourly = df.set_index("real_date").groupby("name")["value"].resample("1h").mean().unstack(0)
+    fig = script.plot_motor_utilization(df, script.MOTOR_IDS, script.NAMES, date_day)
+    return {"utilization": fig}, {"hourly_mean": hourly.reset_index()}
+
+
+def run_state(engine, date_day: str):
+    import pandas as pd
+
+    script = load_script("state")
+    start_ms, end_ms = _bounds(script, engine, date_day, date_day)
+    df = script.fetch_operation_state(engine, start_ms, end_ms)
+    if df.empty:
+        return {}, {}
+    day_end = pd.to_datetime(end_ms, unit="ms", utc=True).tz_convert(df["real_date"].dt.tz)
+    intervals = script.build_state_intervals(df, day_end)
+    table = pd.DataFrame(intervals, columns=["start", "end", "state"])
+    table["state"] = table["state"].map(script.STATE_NAMES)
+    table["duration_min"] = (pd.to_datetime(table["end"]) - pd.to_datetime(table["start"])).dt.total_seconds() / 60
+    fig = script.plot_operation_timeline(intervals, date_day)
+    return {"timeline": fig}, {"intervals": table}
+
+
+def run_energy(engine, date_day: str):
+    script = load_script("energy")
+    df_load = script.fetch_spindle_load(engine, *_bounds(script, engine, date_day, date_day))
+    if df_load.empty:
+        return {}, {}
+    return {}, {"hourly_power": script.hourly_average_power(script.compute_energy(df_load))}
+
+
+def run_activity(engine, date_start: str, date_end: str):
+    script = load_script("activity")
+    df = script.fetch_activity_data(engine, *_bounds(script, engine, date_start, date_end))
+    if df.empty:
+        return {}, {}
+    pivot = script.build_pivot_table(df)
+    figures = {
+        "table": script.display_pivot_table(pivot, date_start, date_end),
+        "trends": script.plot_activity_trends(pivot, date_start, date_end),
+    }
+    return figures, {"pivot": pivot}
+
+
+DAILY = {
+    "alarms": run_alarms,
+    "temperature": run_temperature,
+    "motors": run_motors,
+    "state": run_state,
+    "energy": run_energy,
+}
+
+
+def save_outputs(figures: dict, tables: dict, out_dir: str, prefix: str) -> list:
+    """
+    Write figures as PNG and tables as CSV, closing the figures.
+
+    Returns
+    -------
+    list of str
+        Paths of the written files.
+    """
+    import matplotlib.pyplot as plt
+
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for name, fig in figures.items():
+        path = os.path.join(out_dir, f"{prefix}_{name}.png")
+        fig.savefig(path, dpi=100)
+        plt.close(fig)
+        written.append(path)
+    for name, table in tables.items():
+        path = os.path.join(out_dir, f"{prefix}_{name}.csv")
+        table.to_csv(path, index=name == "pivot")
+        written.append(path)
+    return written
+
+
+def _render_day(command: str, config_path: str, date_day: str, out_dir: str) -> list:
+    """Worker: run one day of a subcommand and save its outputs."""
+    figures, tables = DAILY[command](get_engine(config_path), date_day)
+    return save_outputs(figures, tables, out_dir, f"{command}_{date_day}")
+
+
+def run_headless(command: str, days: list, config_path: str, out_dir: str, jobs: int):
+    """Render every day in a process pool and report the written files."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(_render_day, command, config_path, day, out_dir): day for day in days}
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                written = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{day}: failed ({e})", file=sys.stderr)
+                continue
+            print(f"{day}: {len(written)} files" if written else f"{day}: no data")
+    return failed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run an extraction script over a range of days.")
+    parser.add_argument("command", choices=sorted(SCRIPTS), help="what to extract")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", nargs="?", help="last day (inclusive), YYYY-MM-DD; defaults to start")
+    parser.add_argument("--out", help="write PNG and CSV files to this folder instead of showing plots")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="processes rendering days with --out")
+    parser.add_argument("--config", default=os.path.join(HERE, "config.yaml"), help="database config file")
+    args = parser.parse_args(argv)
+
+    try:
+        days = day_range(args.start, args.end or args.start)
+    except ValueError as e:
+        parser.error(str(e))
+    if not days:
+        parser.error("end must not be before start")
+
+    if args.out:
+        # Before pyplot is imported anywhere; inherited by the worker processes.
+        os.environ["MPLBACKEND"] = "Agg"
+
+    if args.command == "activity":
+        figures, tables = run_activity(get_engine(args.config), days[0], days[-1])
+        if args.out:
+            written = save_outputs(figures, tables, args.out, f"activity_{days[0]}_{days[-1]}")
+            print(f"{len(written)} files written to {args.out}")
+        elif figures:
+            print(tables["pivot"].to_string())
+            import matplotlib.pyplot as plt
+            plt.show()
+        else:
+            print("No data found.")
+        return 0
+
+    if args.out:
+        return 1 if run_headless(args.command, days, args.config, args.out, max(1, args.jobs)) else 0
+
+    import matplotlib.pyplot as plt
+
+    engine = get_engine(args.config)
+    for day in days:
+        figures, tables = DAILY[args.command](engine, day)
+        if not figures and not tables:
+            print(f"{day}: no data")
+            continue
+        for name, table in tables.items():
+            print(f"--- {day} {name} ---")
+            print(table.to_string(index=False))
+        if figures:
+            plt.show()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
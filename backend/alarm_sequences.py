@@ -0,0 +1,260 @@
+"""Precursor patterns of critical alarms (sequential pattern mining).
+
+The ALARM_LIST variable (id 447) stores, on every change, the full list of
+active alarms. Walking the snapshots in time order gives alarm *onsets*:
+messages present in a snapshot but not in the previous one. For every
+onset of a critical alarm (services.CRITICAL_ALARMS) the non-critical
+onsets of the preceding window (30 minutes by default) form one sequence;
+PrefixSpan then finds the ordered sub-sequences shared by many of them,
+per critical alarm type.
+
+Snapshots are streamed month by month through a server-side cursor, so
+memory only holds the current window. The extracted pre-critical sequences
+of each closed month are cached as JSON under ALARM_SEQUENCE_CACHE_DIR
+(default backend/.cache/alarm_sequences); mining any range then only loads
+those small files.
+
+PrefixSpan uses pseudo-projection: a projected database is a list of
+(sequence, position) pairs pointing into the original sequences, never
+copies of suffixes. The leftmost embedding is kept per sequence, which
+also gives the lead time of a pattern (first matched onset to the critical
+alarm).
+
+Precompute months from the command line (from the project root; end day
+inclusive, as in the API):
+python -m backend.alarm_sequences 2020-12-01 2021-02-28
+"""
+
+import json
+import os
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from backend.archive import month_bounds, months_between
+from backend.catalog import id_of
+from backend.services import CRITICAL_ALARMS
+
+WINDOW_MIN = 30
+FETCH_ROWS = 10_000
+CACHE_DIR = os.getenv(
+    "ALARM_SEQUENCE_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), ".cache", "alarm_sequences"),
+)
+
+
+def parse_snapshot(value):
+    """Set of alarm messages in an ALARM_LIST value (JSON list of entries)."""
+    try:
+        entries = json.loads(value) if isinstance(value, str) else value
+    except ValueError:
+        return frozenset()
+    return frozenset(str(entry[1]) for entry in entries or () if len(entry) > 1)
+
+
+def _stream_snapshots(db_conn, start_ms, end_ms):
+    """Yield (date, active alarms) from the last snapshot before start_ms on."""
+    with db_conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT date, value
+            FROM public.variable_log_string
+            WHERE id_var = %s
+              AND date < %s
+            ORDER BY date DESC
+            LIMIT 1;
+        """, (id_of("alarms"), start_ms))
+        row = cursor.fetchone()
+    if row:
+        yield row["date"], parse_snapshot(row["value"])
+
+    with db_conn.cursor(name=f"alarm_sequences_{start_ms}") as cursor:
+        cursor.itersize = FETCH_ROWS
+        cursor.execute("""
+            SELECT date, value
+            FROM public.variable_log_string
+            WHERE id_var = %s
+              AND date >= %s
+              AND date < %s
+            ORDER BY date;
+        """, (id_of("alarms"), start_ms, end_ms))
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            for row in rows:
+                yield row["date"], parse_snapshot(row["value"])
+
+
+def extract_sequences(snapshots, start_ms, end_ms, window_ms, critical=CRITICAL_ALARMS):
+    """Pre-critical onset sequences from a time-ordered snapshot stream.
+
+    Args:
+        snapshots: Iterable of (epoch ms, set of active messages).
+        start_ms, end_ms: Only critical onsets in [start_ms, end_ms) count.
+        window_ms: Length of the window before each critical onset.
+        critical: Messages treated as critical.
+
+    Returns:
+        List of dicts with critical (message), time (epoch ms) and onsets
+        ([epoch ms, message] pairs of the window, oldest first).
+    """
+    critical = set(critical)
+    previous = None
+    recent = deque()  # non-critical onsets of the last window_ms
+    sequences = []
+    for date, active in snapshots:
+        date = int(date)
+        onsets = active - previous if previous is not None else frozenset()
+        previous = active
+        while recent and recent[0][0] < date - window_ms:
+            recent.popleft()
+        if start_ms <= date < end_ms:
+            for message in sorted(onsets & critical):
+                sequences.append({"critical": message, "time": date, "onsets": [list(o) for o in recent]})
+        for message in sorted(onsets - critical):
+            recent.append((date, message))
+    return sequences
+
+
+def _cache_path(key, window_ms):
+    return os.path.join(CACHE_DIR, f"{window_ms // 60000}min", f"{key}.json")
+
+
+def month_sequences(db_conn, key, window_ms):
+    """Pre-critical sequences of one month ('YYYY-MM'), cached once closed."""
+    path = _cache_path(key, window_ms)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    start_ms, end_ms = month_bounds(key)
+    snapshots = _stream_snapshots(db_conn, start_ms - window_ms, end_ms)
+    sequences = extract_sequences(snapshots, start_ms, end_ms, window_ms)
+
+    if end_ms <= datetime.now().timestamp() * 1000:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(sequences, f)
+        os.replace(tmp, path)
+    return sequences
+
+
+def prefixspan(sequences, min_count, max_len=3):
+    """Frequent ordered sub-sequences (PrefixSpan with pseudo-projection).
+
+    Args:
+        sequences: List of item lists.
+        min_count: Minimum number of sequences containing a pattern.
+        max_len: Maximum pattern length.
+
+    Returns:
+        List of (pattern, embeddings) where embeddings maps sequence index
+        to the position of the pattern's first item in its leftmost match.
+    """
+    found = []
+
+    def grow(pattern, projected):
+        # First position of every item after the current match, per sequence.
+        extensions = {}
+        for index, (position, first) in projected.items():
+            seen = set()
+            for offset in range(position, len(sequences[index])):
+                item = sequences[index][offset]
+                if item in seen:
+                    continue
+                seen.add(item)
+                extensions.setdefault(item, {})[index] = (offset + 1, first if pattern else offset)
+        for item, embedding in sorted(extensions.items()):
+            if len(embedding) < min_count:
+                continue
+            grown = pattern + [item]
+            found.append((grown, {index: first for index, (_, first) in embedding.items()}))
+            if len(grown) < max_len:
+                grow(grown, embedding)
+
+    grow([], {index: (0, 0) for index in range(len(sequences))})
+    return found
+
+
+def get_alarm_precursors(db_conn, start, end, critical=None, window_min=WINDOW_MIN,
+                         min_support=0.1, max_len=3, top=20):
+    """Frequent alarm sequences preceding each critical alarm type.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        critical: Only this critical message; all types by default.
+        window_min: Minutes before a critical alarm searched for precursors.
+        min_support: Minimum fraction of critical events preceded by a
+            pattern.
+        max_len: Maximum pattern length.
+        top: Patterns returned per critical type.
+
+    Returns:
+        List of dicts, one per critical type, with critical, events and
+        patterns (sequence, count, support and median_lead_s), longest and
+        most supported first.
+    """
+    try:
+        if critical is not None and critical not in CRITICAL_ALARMS:
+            raise ValueError(f"critical must be one of {list(CRITICAL_ALARMS)}")
+        if not 0 < min_support <= 1:
+            raise ValueError("min_support must be in (0, 1]")
+        start_ms = int(datetime.strptime(start, "%Y-%m-%d").timestamp() * 1000)
+        end_ms = int((datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1)).timestamp() * 1000)
+        if end_ms <= start_ms:
+            raise ValueError("end must not be before start")
+        window_ms = int(window_min) * 60_000
+
+        events = {}
+        for key in months_between(start_ms, end_ms):
+            for sequence in month_sequences(db_conn, key, window_ms):
+                if start_ms <= sequence["time"] < end_ms:
+                    events.setdefault(sequence["critical"], []).append(sequence)
+
+        results = []
+        for message in (CRITICAL_ALARMS if critical is None else (critical,)):
+            occurrences = events.get(message, [])
+            items = [[onset[1] for onset in seq["onsets"]] for seq in occurrences]
+            min_count = max(1, int(np.ceil(min_support * len(occurrences))))
+            patterns = []
+            for pattern, embeddings in prefixspan(items, min_count, max_len) if occurrences else []:
+                leads = [(occurrences[i]["time"] - occurrences[i]["onsets"][first][0]) / 1000
+                         for i, first in embeddings.items()]
+                patterns.append({
+                    "sequence": pattern,
+                    "count": len(embeddings),
+                    "support": round(len(embeddings) / len(occurrences), 3),
+                    "median_lead_s": float(np.median(leads)),
+                })
+            patterns.sort(key=lambda p: (-len(p["sequence"]), -p["count"], p["sequence"]))
+            results.append({"critical": message, "events": len(occurrences), "patterns": patterns[:top]})
+        return results
+    except Exception as e:
+        raise e
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from backend.database import get_connection
+
+    parser = argparse.ArgumentParser(description="Extract pre-critical alarm sequences per month.")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", help="last day (inclusive), YYYY-MM-DD")
+    parser.add_argument("--window-min", type=int, default=WINDOW_MIN, help="precursor window in minutes")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        start_ms = int(datetime.strptime(args.start, "%Y-%m-%d").timestamp() * 1000)
+        end_ms = int((datetime.strptime(args.end, "%Y-%m-%d") + timedelta(days=1)).timestamp() * 1000)
+        for key in months_between(start_ms, end_ms):
+            sequences = month_sequences(conn, key, args.window_min * 60_000)
+            conn.rollback()
+            print(f"{key}: {len(sequences)} critical alarms")
+    finally:
+        conn.close()
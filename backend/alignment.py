@@ -0,0 +1,175 @@
+"""As-of alignment of many irregularly sampled signals onto one time grid.
+
+Signals are logged on change, each with its own timestamps. `align_asof`
+puts N of them on a regular grid in a single pass: all observations are
+sorted by time once, merged with the grid through `searchsorted`, and the
+last observation at or before each grid point is carried forward
+(LOCF) with a cumulative maximum over row indexes. The result is a dense
+float32 matrix (grid points x variables) plus the grid timestamps, ready
+for vectorized analysis.
+
+An optional tolerance turns the LOCF into a bounded as-of join: values
+older than the tolerance at a grid point become NaN.
+"""
+
+import numpy as np
+import psycopg2.extensions
+
+from backend.archive import archive
+
+LOOKBACK_MS = 24 * 3600 * 1000  # how far before the range to look for carry-in values
+
+
+def make_grid(start_ms, end_ms, step_ms):
+    """Regular int64 grid of epoch ms timestamps in [start_ms, end_ms)."""
+    return np.arange(start_ms, end_ms, step_ms, dtype=np.int64)
+
+
+def align_asof(id_vars, timestamps, values, grid, ids=None, tolerance_ms=None):
+    """Align observations of several variables onto a grid (as-of / LOCF).
+
+    Args:
+        id_vars: int array with the variable id of every observation.
+        timestamps: int64 array of observation times in epoch ms.
+        values: float array of observed values.
+        grid: Sorted int64 array of grid timestamps in epoch ms.
+        ids: Variable ids giving the column order; defaults to the sorted
+            unique ids of the observations.
+        tolerance_ms: Maximum age of a carried value, for all columns or
+            per column (array aligned with ids, inf for no limit); None for
+            no limit.
+
+    Returns:
+        Tuple (ids, matrix): the column ids and a float32 matrix of shape
+        (len(grid), len(ids)). Cell (t, c) holds the latest value of
+        variable ids[c] observed at or before grid[t], NaN if none.
+    """
+    id_vars = np.asarray(id_vars, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float32)
+    if ids is None:
+        ids = np.unique(id_vars).tolist()
+    ids = list(ids)
+    n_rows, n_cols = len(grid), len(ids)
+    matrix = np.full((n_rows, n_cols), np.nan, dtype=np.float32)
+    if not len(timestamps) or not n_rows or not n_cols:
+        return ids, matrix
+
+    # Column of every observation; observations of other variables drop out.
+    sorted_ids = np.array(sorted(ids), dtype=np.int64)
+    order_of_sorted = np.array([ids.index(i) for i in sorted_ids])
+    pos = np.searchsorted(sorted_ids, id_vars)
+    known = (pos < n_cols) & (sorted_ids[np.minimum(pos, n_cols - 1)] == id_vars)
+    cols = order_of_sorted[pos[known]]
+    timestamps, values = timestamps[known], values[known]
+
+    # Sort-merge with the grid: an observation at ts first counts at the
+    # first grid point >= ts. Later observations must win within a slot, so
+    # sort by time (stable, cheap when the input is already ordered).
+    order = np.argsort(timestamps, kind="stable")
+    timestamps, values, cols = timestamps[order], values[order], cols[order]
+    slots = np.searchsorted(grid, timestamps, side="left")
+    inside = slots < n_rows
+    slots, cols, timestamps, values = slots[inside], cols[inside], timestamps[inside], values[inside]
+
+    # Keep the last observation per (slot, column).
+    keys = slots * n_cols + cols
+    _, last_from_end = np.unique(keys[::-1], return_index=True)
+    last = len(keys) - 1 - last_from_end
+    slots, cols = slots[last], cols[last]
+
+    matrix[slots, cols] = values[last]
+    observed_at = np.full((n_rows, n_cols), -1, dtype=np.int64)
+    observed_at[slots, cols] = np.arange(len(last))
+
+    # Carry forward: index of the last filled row at or above each row.
+    rows = np.where(observed_at >= 0, np.arange(n_rows)[:, None], -1)
+    source = np.maximum.accumulate(rows, axis=0)
+    column_index = np.arange(n_cols)
+    filled = matrix[np.maximum(source, 0), column_index]
+    filled[source < 0] = np.nan
+
+    if tolerance_ms is not None:
+        obs_ts = timestamps[last][observed_at[np.maximum(source, 0), column_index]]
+        filled[(source >= 0) & (grid[:, None] - obs_ts > np.asarray(tolerance_ms))] = np.nan
+
+    return ids, filled
+
+
+def fetch_observations(db_conn, ids, start_ms, end_ms, lookback_ms=LOOKBACK_MS):
+    """Fetch raw observations of several variables, plus carry-in values.
+
+    Besides the samples in [start_ms, end_ms), the last sample of each
+    variable within `lookback_ms` before `start_ms` is returned so that
+    the grid starts with a value instead of NaN. Ranges that are fully
+    mirrored in the local archive are read from it instead of the DB.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        ids: Variable ids.
+        start_ms: Inclusive start in epoch ms.
+        end_ms: Exclusive end in epoch ms.
+        lookback_ms: How far back to search for carry-in values.
+
+    Returns:
+        Tuple (id_vars, timestamps, values) of numpy arrays.
+    """
+    if all(archive.covers(id_var, start_ms - lookback_ms, end_ms) for id_var in ids):
+        return _observations_from_archive(ids, start_ms, end_ms, lookback_ms)
+
+    # Plain tuples are much cheaper than dict rows for large result sets.
+    with db_conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.execute("""
+            (SELECT DISTINCT ON (id_var) id_var, date, value
+             FROM public.variable_log_float
+             WHERE id_var = ANY(%s)
+               AND date >= %s
+               AND date < %s
+             ORDER BY id_var, date DESC)
+            UNION ALL
+            (SELECT id_var, date, value
+             FROM public.variable_log_float
+             WHERE id_var = ANY(%s)
+               AND date >= %s
+               AND date < %s
+             ORDER BY date);
+        """, (list(ids), start_ms - lookback_ms, start_ms, list(ids), start_ms, end_ms))
+        rows = cursor.fetchall()
+
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    data = np.array(rows, dtype=np.float64)
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2]
+
+
+def _observations_from_archive(ids, start_ms, end_ms, lookback_ms):
+    parts = []
+    for id_var in ids:
+        before_ts, before_values = archive.read(id_var, start_ms - lookback_ms, start_ms)
+        ts, values = archive.read(id_var, start_ms, end_ms)
+        if len(before_ts):
+            ts = np.concatenate([before_ts[-1:], ts])
+            values = np.concatenate([before_values[-1:], values])
+        parts.append((np.full(len(ts), id_var, dtype=np.int64), ts, values))
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def fetch_aligned(db_conn, ids, start_ms, end_ms, step_ms, tolerance_ms=None):
+    """Fetch several variables and align them onto a regular grid.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        ids: Variable ids, one matrix column each (in this order).
+        start_ms: Inclusive start in epoch ms.
+        end_ms: Exclusive end in epoch ms.
+        step_ms: Grid step in ms.
+        tolerance_ms: Maximum age of a carried value; None for no limit.
+
+    Returns:
+        Tuple (grid, matrix): int64 epoch ms timestamps and a float32
+        matrix of shape (len(grid), len(ids)).
+    """
+    grid = make_grid(start_ms, end_ms, step_ms)
+    id_vars, timestamps, values = fetch_observations(db_conn, ids, start_ms, end_ms)
+    _, matrix = align_asof(id_vars, timestamps, values, grid, ids=ids, tolerance_ms=tolerance_ms)
+    return grid, matrix
@@ -0,0 +1,409 @@
+"""Anomaly detection for motor temperatures and axis utilization.
+
+All monitored variables are averaged onto a common one-minute grid with a
+single grouped query, so that every scoring step works on a time x variable
+matrix and scores all signals at once. Three scores are computed per cell:
+
+- rolling z-score against the trailing window,
+- EWMA z-score against an exponentially weighted mean and variance,
+- robust score against the trailing median and MAD.
+
+The same `AnomalyDetector` is used for batch backfills over months (fed
+chunk by chunk) and for incremental scoring of newly arrived data, so both
+paths produce identical scores.
+
+Run a backfill (end day inclusive, as in the API) with:
+python -m backend.anomalies 2020-12-01 2021-02-28 --out anomalies.csv
+
+With --follow, the detector primed by the backfill then keeps scoring
+newly closed buckets (`score_new_data`) every given number of seconds and
+appends their anomalies to the same file:
+python -m backend.anomalies 2021-02-01 2021-02-28 --follow 60
+"""
+
+import time
+import warnings
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from backend.catalog import name_of
+
+MOTOR_TEMPERATURE_IDS = [449, 453, 456, 448, 454]
+AXIS_UTILIZATION_IDS = [584, 593, 598, 565, 514]
+ANOMALY_IDS = MOTOR_TEMPERATURE_IDS + AXIS_UTILIZATION_IDS
+
+BUCKET_MS = 60_000          # scoring grid resolution (1 minute)
+ROLLING_WINDOW = 60         # trailing window in buckets
+MIN_PERIODS = 30            # minimum valid buckets in the window to score
+EWMA_ALPHA = 0.05
+Z_THRESHOLD = 4.0
+MAD_THRESHOLD = 6.0
+MAD_SCALE = 1.4826          # makes the MAD consistent with the std of a normal
+WARMUP = timedelta(days=1)  # history prepended to a request so scores are primed
+BLOCK_ROWS = 4096           # rows per block for the rolling median
+
+
+def fetch_bucketed(db_conn, ids, start_ms, end_ms, bucket_ms=BUCKET_MS):
+    """Fetch bucket averages of several variables as a dense matrix.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        ids: List of variable ids, one matrix column each.
+        start_ms: Inclusive start in epoch ms (aligned down to the bucket).
+        end_ms: Exclusive end in epoch ms.
+        bucket_ms: Bucket width in ms.
+
+    Returns:
+        Tuple (timestamps, matrix) with int64 bucket starts in epoch ms and a
+        float64 matrix of shape (len(timestamps), len(ids)); empty buckets
+        are NaN.
+    """
+    first = start_ms - start_ms % bucket_ms
+    timestamps = np.arange(first, end_ms, bucket_ms, dtype=np.int64)
+    matrix = np.full((len(timestamps), len(ids)), np.nan)
+
+    with db_conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id_var,
+                   (date / %s) * %s AS bucket,
+                   AVG(value) AS avg_value
+            FROM public.variable_log_float
+            WHERE id_var = ANY(%s)
+              AND date >= %s
+              AND date < %s
+            GROUP BY id_var, bucket;
+        """, (bucket_ms, bucket_ms, list(ids), first, end_ms))
+        rows = cursor.fetchall()
+
+    if rows:
+        column = {vid: i for i, vid in enumerate(ids)}
+        cols = np.array([column[row["id_var"]] for row in rows])
+        buckets = np.array([row["bucket"] for row in rows], dtype=np.int64)
+        values = np.array([row["avg_value"] for row in rows], dtype=np.float64)
+        matrix[(buckets - first) // bucket_ms, cols] = values
+
+    return timestamps, matrix
+
+
+def rolling_zscore(matrix, window=ROLLING_WINDOW, min_periods=MIN_PERIODS):
+    """Z-score of every cell against the trailing window before it.
+
+    The window excludes the current row, so a spike does not inflate its
+    own baseline. Sums are taken with cumulative sums along the time axis,
+    which keeps the cost linear in the number of rows for any window size.
+
+    Args:
+        matrix: Float array (time x variables), NaN for missing.
+        window: Number of previous rows forming the baseline.
+        min_periods: Minimum valid rows in the window to produce a score.
+
+    Returns:
+        Array with the same shape as `matrix`; NaN where not scorable.
+    """
+    valid = ~np.isnan(matrix)
+    filled = np.where(valid, matrix, 0.0)
+    zeros = np.zeros((1, matrix.shape[1]))
+    s1 = np.vstack([zeros, np.cumsum(filled, axis=0)])
+    s2 = np.vstack([zeros, np.cumsum(filled * filled, axis=0)])
+    n = np.vstack([zeros, np.cumsum(valid, axis=0)])
+
+    # Window for row t covers rows [t - window, t): cumulative index t minus
+    # cumulative index max(t - window, 0).
+    rows = np.arange(matrix.shape[0])
+    lo = np.maximum(rows - window, 0)
+    count = n[rows] - n[lo]
+    total = s1[rows] - s1[lo]
+    total_sq = s2[rows] - s2[lo]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        var = (total_sq - count * mean * mean) / (count - 1)
+        std = np.sqrt(np.maximum(var, 0.0))
+        z = (matrix - mean) / std
+    z[(count < min_periods) | (std == 0) | ~valid] = np.nan
+    return z
+
+
+def mad_score(matrix, window=ROLLING_WINDOW, min_periods=MIN_PERIODS):
+    """Robust score of every cell against the trailing median and MAD.
+
+    Args:
+        matrix: Float array (time x variables), NaN for missing.
+        window: Number of previous rows forming the baseline.
+        min_periods: Minimum valid rows in the window to produce a score.
+
+    Returns:
+        Array with the same shape as `matrix`; NaN where not scorable.
+    """
+    n_rows, n_cols = matrix.shape
+    padded = np.vstack([np.full((window, n_cols), np.nan), matrix])
+    scores = np.full(matrix.shape, np.nan)
+
+    # The (rows, cols, window) view is materialized by nanmedian, so work in
+    # row blocks to bound memory on month-long backfills.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for start in range(0, n_rows, BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, n_rows)
+            windows = np.lib.stride_tricks.sliding_window_view(
+                padded[start:stop + window - 1], window, axis=0
+            )
+            count = np.sum(~np.isnan(windows), axis=-1)
+            median = np.nanmedian(windows, axis=-1)
+            mad = MAD_SCALE * np.nanmedian(
+                np.abs(windows - median[..., None]), axis=-1
+            )
+            with np.errstate(invalid="ignore", divide="ignore"):
+                block = (matrix[start:stop] - median) / mad
+            block[(count < min_periods) | (mad == 0)] = np.nan
+            scores[start:stop] = block
+
+    return scores
+
+
+class AnomalyDetector:
+    """Stateful scorer that can be fed consecutive chunks of the grid.
+
+    It carries the EWMA mean/variance and the last `window` rows between
+    calls, so scoring a range in one call or in many consecutive chunks
+    gives the same result.
+    """
+
+    def __init__(self, ids=ANOMALY_IDS, window=ROLLING_WINDOW,
+                 alpha=EWMA_ALPHA, min_periods=MIN_PERIODS):
+        self.ids = list(ids)
+        self.window = window
+        self.alpha = alpha
+        self.min_periods = min_periods
+        n = len(self.ids)
+        self.ewma_mean = np.full(n, np.nan)
+        self.ewma_var = np.zeros(n)
+        self.ewma_count = np.zeros(n, dtype=np.int64)
+        self.tail = np.empty((0, n))
+        self.last_ts = None
+
+    def _ewma_zscore(self, matrix):
+        """Score rows sequentially, vectorized across variables."""
+        a = self.alpha
+        z = np.full(matrix.shape, np.nan)
+        mean, var, count = self.ewma_mean, self.ewma_var, self.ewma_count
+
+        for t, row in enumerate(matrix):
+            valid = ~np.isnan(row)
+            primed = valid & (count >= self.min_periods) & (var > 0)
+            z[t, primed] = (row[primed] - mean[primed]) / np.sqrt(var[primed])
+
+            new = valid & np.isnan(mean)
+            mean[new] = row[new]
+            seen = valid & ~new
+            diff = row[seen] - mean[seen]
+            mean[seen] += a * diff
+            var[seen] = (1 - a) * (var[seen] + a * diff * diff)
+            count[valid] += 1
+
+        return z
+
+    def update(self, timestamps, matrix):
+        """Score a new chunk of grid rows and advance the detector state.
+
+        Args:
+            timestamps: int64 epoch ms of the rows, strictly after `last_ts`.
+            matrix: Float array (rows x len(ids)), NaN for missing.
+
+        Returns:
+            Dict of score matrices keyed by 'z_rolling', 'z_ewma' and 'mad'.
+        """
+        extended = np.vstack([self.tail, matrix])
+        skip = len(self.tail)
+        scores = {
+            "z_rolling": rolling_zscore(extended, self.window, self.min_periods)[skip:],
+            "mad": mad_score(extended, self.window, self.min_periods)[skip:],
+            "z_ewma": self._ewma_zscore(matrix),
+        }
+        self.tail = extended[-self.window:]
+        if len(timestamps):
+            self.last_ts = int(timestamps[-1])
+        return scores
+
+
+def find_anomalies(ids, timestamps, matrix, scores,
+                   z_threshold=Z_THRESHOLD, mad_threshold=MAD_THRESHOLD):
+    """Turn score matrices into a list of flagged samples.
+
+    A cell is flagged when its EWMA or rolling z-score exceeds
+    `z_threshold`, or its robust score exceeds `mad_threshold`.
+
+    Args:
+        ids: Variable ids of the matrix columns.
+        timestamps: int64 epoch ms of the matrix rows.
+        matrix: Bucket averages (time x variables).
+        scores: Dict returned by `AnomalyDetector.update`.
+        z_threshold: Absolute z-score limit.
+        mad_threshold: Absolute robust score limit.
+
+    Returns:
+        List of dicts with id_var, name, log_time, value and the three scores.
+    """
+    with np.errstate(invalid="ignore"):
+        flagged = (
+            (np.abs(scores["z_ewma"]) > z_threshold)
+            | (np.abs(scores["z_rolling"]) > z_threshold)
+            | (np.abs(scores["mad"]) > mad_threshold)
+        )
+
+    def score(name, t, c):
+        value = scores[name][t, c]
+        return None if np.isnan(value) else round(float(value), 2)
+
+    anomalies = []
+    for t, c in zip(*np.nonzero(flagged)):
+        anomalies.append({
+            "id_var": ids[c],
+            "name": name_of(ids[c]),
+            "log_time": datetime.fromtimestamp(timestamps[t] / 1000).astimezone(),
+            "value": round(float(matrix[t, c]), 2),
+            "z_rolling": score("z_rolling", t, c),
+            "z_ewma": score("z_ewma", t, c),
+            "mad_score": score("mad", t, c),
+        })
+    return anomalies
+
+
+def score_range(db_conn, detector, start_ms, end_ms, chunk=timedelta(days=30)):
+    """Feed a time range to a detector in chunks and yield anomalies.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        detector: AnomalyDetector whose state is advanced.
+        start_ms: Inclusive start in epoch ms.
+        end_ms: Exclusive end in epoch ms.
+        chunk: Size of each fetched chunk.
+
+    Yields:
+        Tuples (chunk_start_ms, anomalies) per chunk.
+    """
+    chunk_ms = int(chunk.total_seconds() * 1000)
+    chunk_start = start_ms
+    while chunk_start < end_ms:
+        chunk_end = min(chunk_start + chunk_ms, end_ms)
+        timestamps, matrix = fetch_bucketed(db_conn, detector.ids, chunk_start, chunk_end)
+        scores = detector.update(timestamps, matrix)
+        yield chunk_start, find_anomalies(detector.ids, timestamps, matrix, scores)
+        chunk_start = chunk_end
+
+
+def score_new_data(db_conn, detector, now_ms=None):
+    """Incrementally score all complete buckets since the detector's last row.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        detector: AnomalyDetector primed by a previous backfill or call.
+        now_ms: Current time in epoch ms (defaults to the wall clock).
+
+    Returns:
+        List of anomalies in the newly scored buckets.
+    """
+    if now_ms is None:
+        now_ms = int(datetime.now().timestamp() * 1000)
+    end_ms = now_ms - now_ms % BUCKET_MS  # only closed buckets
+    if detector.last_ts is not None:
+        start_ms = detector.last_ts + BUCKET_MS
+    else:
+        start_ms = end_ms - int(WARMUP.total_seconds() * 1000)
+
+    anomalies = []
+    for _, found in score_range(db_conn, detector, start_ms, end_ms):
+        anomalies.extend(found)
+    return anomalies
+
+
+def get_anomalies(db_conn, start, end):
+    """Detect anomalies on motor temperatures and axis utilization.
+
+    One day of history before `start` is scored first so the baselines are
+    primed; only anomalies inside the requested range are returned.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+
+    Returns:
+        List of dicts with id_var, name, log_time, value and scores,
+        ordered by time.
+    """
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d")
+        end_date = datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1)
+        if end_date <= start_date:
+            raise ValueError("end must not be before start")
+
+        start_ms = int(start_date.timestamp() * 1000)
+        end_ms = int(end_date.timestamp() * 1000)
+        warmup_ms = int((start_date - WARMUP).timestamp() * 1000)
+
+        detector = AnomalyDetector()
+        anomalies = []
+        for _, found in score_range(db_conn, detector, warmup_ms, end_ms):
+            anomalies.extend(a for a in found if a["log_time"].timestamp() * 1000 >= start_ms)
+
+        anomalies.sort(key=lambda a: (a["log_time"], a["id_var"]))
+        return anomalies
+    except Exception as e:
+        raise e
+
+
+if __name__ == "__main__":
+    import argparse
+    import csv
+
+    from backend.database import get_connection
+
+    parser = argparse.ArgumentParser(description="Backfill anomalies over a date range.")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", help="last day (inclusive), YYYY-MM-DD")
+    parser.add_argument("--out", default="anomalies.csv", help="output CSV file")
+    parser.add_argument("--follow", type=float, metavar="SECONDS",
+                        help="then score new data every SECONDS until interrupted")
+    args = parser.parse_args()
+
+    start_ms = int(datetime.strptime(args.start, "%Y-%m-%d").timestamp() * 1000)
+    end_ms = int((datetime.strptime(args.end, "%Y-%m-%d") + timedelta(days=1)).timestamp() * 1000)
+    if end_ms <= start_ms:
+        parser.error("end must not be before start")
+
+    conn = get_connection()
+    try:
+        detector = AnomalyDetector()
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            writer = None
+            total = 0
+
+            def write(found):
+                global writer
+                if found and writer is None:
+                    writer = csv.DictWriter(f, fieldnames=found[0].keys())
+                    writer.writeheader()
+                if found:
+                    writer.writerows(found)
+                    f.flush()
+
+            for chunk_start, found in score_range(conn, detector, start_ms, end_ms):
+                write(found)
+                total += len(found)
+                print(f"{datetime.fromtimestamp(chunk_start / 1000):%Y-%m-%d}: {len(found)} anomalies")
+            conn.rollback()
+            try:
+                while args.follow:
+                    time.sleep(args.follow)
+                    found = score_new_data(conn, detector)
+                    conn.rollback()
+                    write(found)
+                    total += len(found)
+                    print(f"{datetime.now():%Y-%m-%d %H:%M}: {len(found)} anomalies")
+            except KeyboardInterrupt:
+                pass
+        print(f"Saved {total} anomalies to '{args.out}'")
+    finally:
+        conn.close()
@@ -0,0 +1,426 @@
+"""Memory-mapped columnar archive of historical signals.
+
+Selected variables are mirrored from the remote `variable_log_float` into
+local, append-only column files, one pair per variable and month:
+
+    <root>/<id_var>/<YYYY-MM>.ts    int64 epoch ms, sorted
+    <root>/<id_var>/<YYYY-MM>.val   float32 values
+    <root>/<id_var>/index.json      rows and synced-until time per month
+
+Months are UTC calendar months. A month is always synced from its first
+millisecond, and later syncs only append rows after the month's
+`synced_until`, so files are never rewritten. The index is the source of
+truth: it is replaced atomically after the data files are flushed, and
+bytes beyond the indexed row count (from an interrupted sync) are
+truncated before the next append. Syncs stop ARCHIVE_SYNC_LAG_S (default
+300) behind the present, so a month is never marked synced past rows the
+database has not received yet.
+
+Reads map the files with `numpy.memmap` and slice them with binary
+searches, so a range inside one month is a zero-copy view.
+
+Months synced with `compress=True` store only the points kept by the
+variable's dead-band or swinging-door compression (`compression` in the
+catalog, see backend.compression); their index entry records the method,
+tolerance and number of source rows. Reads rebuild such months on the
+variable's nominal sampling grid, within the tolerance; `points` returns
+the stored points for scans that can work on them directly.
+
+Sync or export from the command line (from the project root; end day
+inclusive, as in the API):
+python -m backend.archive sync --ids 618,630 --start 2020-12-01 --end 2021-02-28
+python -m backend.archive sync --ids 449,453 --start 2020-12-01 --end 2021-02-28 --compress
+python -m backend.archive export --id 449 --start 2021-01-01 --end 2021-01-31 --out motor8.csv --compress
+python -m backend.archive info
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from backend import compression
+from backend.catalog import get_catalog
+
+ARCHIVE_DIR = os.getenv(
+    "ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "archive")
+)
+TS_DTYPE = np.int64
+VALUE_DTYPE = np.float32
+FETCH_ROWS = 100_000
+SYNC_LAG_S = int(os.getenv("ARCHIVE_SYNC_LAG_S", "300"))  # late rows are still arriving
+
+
+def month_key(ms):
+    """UTC month ('YYYY-MM') of an epoch ms timestamp."""
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y-%m")
+
+
+def month_bounds(key):
+    """Epoch ms [start, end) of a 'YYYY-MM' month."""
+    year, month = (int(part) for part in key.split("-"))
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+def months_between(start_ms, end_ms):
+    """Month keys overlapping [start_ms, end_ms), in order."""
+    keys = []
+    key = month_key(start_ms)
+    while True:
+        keys.append(key)
+        _, month_end = month_bounds(key)
+        if month_end >= end_ms:
+            return keys
+        key = month_key(month_end)
+
+
+class Archive:
+    """Per-variable, per-month column files under one root directory."""
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+        self._indexes = {}
+
+    def _dir(self, id_var):
+        return os.path.join(self.root, str(id_var))
+
+    def _paths(self, id_var, key):
+        base = os.path.join(self._dir(id_var), key)
+        return base + ".ts", base + ".val"
+
+    def index(self, id_var):
+        """Index of a variable: {'months': {key: {'rows', 'synced_until'}}}."""
+        # Re-read when another process (e.g. the sync CLI) replaced the file.
+        path = os.path.join(self._dir(id_var), "index.json")
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        cached = self._indexes.get(id_var)
+        if cached is None or (mtime is not None and cached[0] != mtime):
+            if mtime is not None:
+                with open(path, "r", encoding="utf-8") as f:
+                    cached = (mtime, json.load(f))
+            else:
+                cached = (None, {"months": {}})
+            self._indexes[id_var] = cached
+        return cached[1]
+
+    def _save_index(self, id_var):
+        path = os.path.join(self._dir(id_var), "index.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index(id_var), f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self._indexes[id_var] = (os.path.getmtime(path), self._indexes[id_var][1])
+
+    def variables(self):
+        """Ids present in the archive."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(int(name) for name in os.listdir(self.root) if name.isdigit())
+
+    def append(self, id_var, key, timestamps, values, synced_until, compressed=None, source_rows=None):
+        """Append sorted rows to a month and advance its synced-until time.
+
+        Args:
+            id_var: Variable id.
+            key: Month key 'YYYY-MM'; all timestamps must fall inside it.
+            timestamps: Sorted epoch ms, after the month's last row.
+            values: Values aligned with `timestamps`.
+            synced_until: Exclusive end of the range now fully archived.
+            compressed: Compression settings ({'method', 'tolerance'}) of
+                the rows; recorded when the month is created.
+            source_rows: Rows the compressed points stand for.
+        """
+        os.makedirs(self._dir(id_var), exist_ok=True)
+        month = self.index(id_var)["months"].setdefault(key, {"rows": 0, "synced_until": None})
+        if compressed and "compression" not in month and not month["rows"]:
+            month["compression"] = dict(compressed)
+            month["source_rows"] = 0
+        ts_path, val_path = self._paths(id_var, key)
+
+        for path, data, dtype in ((ts_path, timestamps, TS_DTYPE), (val_path, values, VALUE_DTYPE)):
+            with open(path, "ab") as f:
+                # Drop bytes of an interrupted append that never reached the index.
+                f.truncate(month["rows"] * np.dtype(dtype).itemsize)
+                np.asarray(data, dtype=dtype).tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+
+        month["rows"] += len(timestamps)
+        if "compression" in month:
+            month["source_rows"] += len(timestamps) if source_rows is None else source_rows
+        month["synced_until"] = synced_until
+        self._save_index(id_var)
+
+    def covers(self, id_var, start_ms, end_ms):
+        """Whether [start_ms, end_ms) is fully archived for a variable."""
+        months = self.index(id_var)["months"]
+        for key in months_between(start_ms, end_ms):
+            month = months.get(key)
+            _, month_end = month_bounds(key)
+            if month is None or month["synced_until"] is None:
+                return False
+            if month["synced_until"] < min(end_ms, month_end):
+                return False
+        return True
+
+    def _memmaps(self, id_var, key):
+        rows = self.index(id_var)["months"].get(key, {}).get("rows", 0)
+        if not rows:
+            return None
+        ts_path, val_path = self._paths(id_var, key)
+        return (
+            np.memmap(ts_path, dtype=TS_DTYPE, mode="r", shape=(rows,)),
+            np.memmap(val_path, dtype=VALUE_DTYPE, mode="r", shape=(rows,)),
+        )
+
+    def compressed(self, id_var, start_ms, end_ms):
+        """Whether any month of [start_ms, end_ms) holds compressed points."""
+        months = self.index(id_var)["months"]
+        return any("compression" in months.get(key, {}) for key in months_between(start_ms, end_ms))
+
+    def points(self, id_var, start_ms, end_ms):
+        """Yield (timestamps, values, compression) of the stored rows per month.
+
+        `compression` is None for raw months. For compressed months the
+        points bracketing the range are included, so the range can be
+        rebuilt or integrated without the neighbouring months.
+        """
+        for key in months_between(start_ms, end_ms):
+            maps = self._memmaps(id_var, key)
+            if maps is None:
+                continue
+            ts, values = maps
+            settings = self.index(id_var)["months"][key].get("compression")
+            lo = np.searchsorted(ts, start_ms, side="left")
+            hi = np.searchsorted(ts, end_ms, side="left")
+            if settings:
+                lo, hi = max(lo - 1, 0), min(hi + 1, len(ts))
+            if hi > lo:
+                yield ts[lo:hi], values[lo:hi], settings
+
+    def segments(self, id_var, start_ms, end_ms):
+        """Yield (timestamps, values) per month of a range.
+
+        Raw months are zero-copy views. Compressed months are rebuilt on the
+        variable's nominal sampling grid (at the stored points for variables
+        logged on change), without the gap markers.
+        """
+        step_ms = None
+        for ts, values, settings in self.points(id_var, start_ms, end_ms):
+            if settings is None:
+                yield ts, values
+                continue
+            if step_ms is None:
+                entry = get_catalog().get(id_var)
+                step_ms = int(1000 / entry.sample_rate_hz) if entry and entry.sample_rate_hz else 0
+            points_values = values.astype(np.float64)
+            times = compression.grid(ts, points_values, step_ms) if step_ms else ts[np.isfinite(points_values)]
+            times = times[(times >= start_ms) & (times < end_ms)]
+            rebuilt = compression.reconstruct(ts, points_values, settings["method"], times)
+            keep = np.isfinite(rebuilt)
+            if keep.any():
+                yield times[keep], rebuilt[keep].astype(VALUE_DTYPE)
+
+    def read(self, id_var, start_ms, end_ms):
+        """Samples of [start_ms, end_ms) as (timestamps, values).
+
+        A range inside one month returns memmap views without copying;
+        longer ranges are concatenated.
+        """
+        parts = list(self.segments(id_var, start_ms, end_ms))
+        if not parts:
+            return np.empty(0, dtype=TS_DTYPE), np.empty(0, dtype=VALUE_DTYPE)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def sync(self, db_conn, id_var, start_ms, end_ms, log=print, compress=False):
+        """Mirror [start_ms, end_ms) of a variable from the database.
+
+        Months are synced from their first millisecond (or resumed from
+        their synced-until time), so `start_ms` is effectively rounded down
+        to the start of its month. `end_ms` is capped at SYNC_LAG_S before
+        the present. Rows sharing the last timestamp of a fetched batch are
+        held back to the next one, so progress recorded per batch never
+        splits a timestamp.
+
+        Args:
+            compress: Store new months compressed with the variable's
+                catalog settings. Months keep the mode they were created in.
+
+        Returns:
+            Number of rows appended.
+        """
+        added = 0
+        months = self.index(id_var)["months"]
+        settings, gap_ms = (compression_settings(id_var) if compress else (None, None))
+        end_ms = min(end_ms, int((time.time() - SYNC_LAG_S) * 1000))
+        for key in months_between(start_ms, end_ms):
+            month_start, month_end = month_bounds(key)
+            fetch_from = (months.get(key) or {}).get("synced_until") or month_start
+            fetch_to = min(end_ms, month_end)
+            if fetch_from >= fetch_to:
+                continue
+            month = months.get(key)
+            mode = month.get("compression") if month and month["rows"] else settings
+
+            # Server-side cursor so a month of 1 Hz data is streamed in batches.
+            with db_conn.cursor(name=f"archive_{id_var}_{key.replace('-', '_')}") as cursor:
+                cursor.itersize = FETCH_ROWS
+                cursor.execute("""
+                    SELECT date, value
+                    FROM public.variable_log_float
+                    WHERE id_var = %s
+                      AND date >= %s
+                      AND date < %s
+                    ORDER BY date;
+                """, (id_var, fetch_from, fetch_to))
+                month_rows = 0
+                held_ts = np.empty(0, dtype=TS_DTYPE)
+                held_values = np.empty(0, dtype=np.float64)
+                while True:
+                    rows = cursor.fetchmany(FETCH_ROWS)
+                    ts = np.r_[held_ts, np.array([row["date"] for row in rows], dtype=TS_DTYPE)]
+                    values = np.r_[held_values, np.array([row["value"] for row in rows], dtype=np.float64)]
+                    if rows:
+                        # Progress is recorded per batch, up to (excluding) the
+                        # batch's last timestamp, whose rows may continue in
+                        # the next batch.
+                        synced_until = int(ts[-1])
+                        cut = int(np.searchsorted(ts, synced_until, side="left"))
+                        ts, held_ts = ts[:cut], ts[cut:]
+                        values, held_values = values[:cut], values[cut:]
+                    else:
+                        synced_until = fetch_to
+                    if len(ts):
+                        source_rows = len(ts)
+                        if mode:
+                            ts, values = compression.compress(
+                                ts, values, mode["method"], mode["tolerance"], gap_ms,
+                                self._last_point(id_var, key)
+                            )
+                        self.append(id_var, key, ts, values, synced_until, mode, source_rows=source_rows)
+                        month_rows += source_rows
+                    if not rows:
+                        break
+            db_conn.commit()
+
+            if months.get(key, {}).get("synced_until") != fetch_to:
+                self.append(id_var, key, [], [], fetch_to, mode, source_rows=0)
+            added += month_rows
+            log(f"{id_var} {key}: +{month_rows} rows")
+        return added
+
+
+    def _last_point(self, id_var, key):
+        """Timestamp of a month's last stored point, None if none or a gap marker."""
+        maps = self._memmaps(id_var, key)
+        if maps is None or not np.isfinite(maps[1][-1]):
+            return None
+        return int(maps[0][-1])
+
+
+def compression_settings(id_var):
+    """Catalog compression settings of a variable and its gap threshold.
+
+    Returns:
+        Tuple ({'method', 'tolerance'} or None, gap in ms or None).
+    """
+    entry = get_catalog().get(id_var)
+    if entry is None or not entry.compression:
+        return None, None
+    gap_ms = int(compression.GAP_FACTOR * 1000 / entry.sample_rate_hz) if entry.sample_rate_hz else None
+    return {"method": entry.compression["method"], "tolerance": entry.compression["tolerance"]}, gap_ms
+
+
+archive = Archive()
+
+
+def export_csv(store, id_var, start_ms, end_ms, path, method=None, tolerance=None):
+    """Write a variable's archived samples to CSV (date,value), optionally compressed.
+
+    With a method, only the kept points are written; gap markers have an
+    empty value.
+
+    Returns:
+        Tuple (samples read, rows written).
+    """
+    ts, values = store.read(id_var, start_ms, end_ms)
+    samples = len(ts)
+    if method:
+        settings, gap_ms = compression_settings(id_var)
+        if tolerance is None:
+            if settings is None:
+                raise ValueError(f"no compression tolerance configured for variable {id_var}")
+            tolerance = settings["tolerance"]
+        ts, values = compression.compress(ts, values, method, tolerance, gap_ms)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("date,value\n")
+        for t, v in zip(ts.tolist(), np.asarray(values, dtype=np.float64).tolist()):
+            f.write(f"{t},{'' if v != v else repr(v)}\n")
+    return samples, len(ts)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from backend.database import get_connection
+
+    parser = argparse.ArgumentParser(description="Manage the local signal archive.")
+    parser.add_argument("--root", default=ARCHIVE_DIR, help="archive directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sync_cmd = commands.add_parser("sync", help="mirror variables from the database")
+    sync_cmd.add_argument("--ids", required=True, help="comma-separated variable ids")
+    sync_cmd.add_argument("--start", required=True, help="first day, YYYY-MM-DD")
+    sync_cmd.add_argument("--end", required=True, help="last day (inclusive), YYYY-MM-DD")
+    sync_cmd.add_argument("--compress", action="store_true",
+                          help="store new months compressed with the catalog settings")
+    export_cmd = commands.add_parser("export", help="write archived samples to CSV")
+    export_cmd.add_argument("--id", type=int, required=True, help="variable id")
+    export_cmd.add_argument("--start", required=True, help="first day, YYYY-MM-DD")
+    export_cmd.add_argument("--end", required=True, help="last day (inclusive), YYYY-MM-DD")
+    export_cmd.add_argument("--out", required=True, help="CSV file")
+    export_cmd.add_argument("--compress", choices=compression.METHODS, nargs="?", const="catalog",
+                            help="write compressed points (method from the catalog by default)")
+    export_cmd.add_argument("--tolerance", type=float, help="override the catalog tolerance")
+    commands.add_parser("info", help="show archived variables and months")
+    args = parser.parse_args()
+
+    store = Archive(args.root)
+    if args.command == "sync":
+        start_ms = int(datetime.strptime(args.start, "%Y-%m-%d").timestamp() * 1000)
+        end_ms = int((datetime.strptime(args.end, "%Y-%m-%d") + timedelta(days=1)).timestamp() * 1000)
+        conn = get_connection()
+        try:
+            for id_var in (int(i) for i in args.ids.split(",") if i.strip()):
+                store.sync(conn, id_var, start_ms, end_ms, compress=args.compress)
+        finally:
+            conn.close()
+    elif args.command == "export":
+        start_ms = int(datetime.strptime(args.start, "%Y-%m-%d").timestamp() * 1000)
+        end_ms = int((datetime.strptime(args.end, "%Y-%m-%d") + timedelta(days=1)).timestamp() * 1000)
+        method = args.compress
+        if method == "catalog":
+            settings, _ = compression_settings(args.id)
+            if settings is None:
+                parser.error(f"no compression configured for variable {args.id}; pass a method")
+            method = settings["method"]
+        samples, written = export_csv(store, args.id, start_ms, end_ms, args.out, method, args.tolerance)
+        print(f"{samples} samples read, {written} rows written to {args.out}")
+    else:
+        for id_var in store.variables():
+            for key, month in sorted(store.index(id_var)["months"].items()):
+                until = month["synced_until"]
+                until = datetime.fromtimestamp(until / 1000).isoformat() if until else "-"
+                packed = ""
+                if "compression" in month:
+                    ratio = month["source_rows"] / month["rows"] if month["rows"] else 0
+                    packed = (f"  {month['compression']['method']} ±{month['compression']['tolerance']}"
+                              f" ({month['source_rows']} source rows, {ratio:.1f}x)")
+                print(f"{id_var:>6} {key}  {month['rows']:>10} rows  synced until {until}{packed}")
@@ -0,0 +1,394 @@
+"""Resumable map-reduce backfills of KPIs over the whole machine history.
+
+The dashboard and the extraction scripts work one day at a time. KPIs over
+the full history (operating hours, energy, distributions) would mean
+scanning every sample of every month, which only fits in memory and in a
+reasonable time when the work is partitioned:
+
+- Partitions: one (variable, UTC month) pair each, matching the month
+  files of the local archive. Samples come from the archive when it covers
+  the month, otherwise from the database through a server-side cursor.
+- Map: every partition is mapped to a small partial result in a pool of
+  worker processes (one database connection per worker).
+- Checkpoints: the partial of every closed month is written to
+  BACKFILL_DIR/<job>_v<version>/ as soon as it is computed, so a crashed
+  or interrupted run resumes where it stopped. The current month is always
+  recomputed. Bumping a job's version invalidates its checkpoints.
+- Reduce: partials are merged per variable with the job's reducer. All
+  reducers are associative (and commutative), so months can be mapped in
+  any order and merged in any grouping: sums and moments add, t-digests
+  merge (`backend.sketches`), interval lists are unioned, joining
+  intervals that touch across month boundaries.
+
+Jobs (JOBS) pair a map function with a reducer: 'stats' (count, mean,
+std, min, max), 'percentiles', 'running' (time with the value above
+zero, e.g. spindle load) and 'energy' (spindle kWh at MAX_POWER_KW).
+
+Configuration (environment variables):
+- BACKFILL_DIR: checkpoint folder (default backend/.cache/backfill).
+
+Usage (from the project root):
+python -m backend.backfill energy --ids 630 --start 2020-12 --end 2021-03 --workers 4
+python -m backend.backfill percentiles --ids 618,449 --start 2020-12 --end 2021-03 --by-month
+python -m backend.backfill running --ids 630 --start 2020-12 --end 2021-03 --restart
+"""
+
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import reduce
+from typing import Callable, NamedTuple
+
+import numpy as np
+import psycopg2.extensions
+
+from backend.archive import archive, month_bounds, month_key
+from backend.catalog import get_catalog
+from backend.sketches import QUANTILES, TDigest
+
+BACKFILL_DIR = os.getenv(
+    "BACKFILL_DIR", os.path.join(os.path.dirname(__file__), ".cache", "backfill")
+)
+FETCH_ROWS = 100_000
+GAP_FACTOR = 10          # nominal intervals without a sample that end a run
+ON_CHANGE_GAP_MS = 3600 * 1000
+MAX_POWER_KW = 37.0
+HOUR_MS = 3600 * 1000
+
+
+# --- Reducers --------------------------------------------------------------------
+# zero() is the identity of merge(a, b); finalize turns the merged partial
+# into the reported KPI.
+
+class Sums:
+    """Dicts of numbers, added key by key."""
+
+    @staticmethod
+    def zero():
+        return {}
+
+    @staticmethod
+    def merge(a, b):
+        return {key: a.get(key, 0) + b.get(key, 0) for key in a.keys() | b.keys()}
+
+    @staticmethod
+    def finalize(a):
+        return {key: round(value, 4) for key, value in sorted(a.items())}
+
+
+class Moments:
+    """Count, sum, sum of squares, min and max."""
+
+    @staticmethod
+    def zero():
+        return {"count": 0, "sum": 0.0, "sumsq": 0.0, "min": np.inf, "max": -np.inf}
+
+    @staticmethod
+    def merge(a, b):
+        return {"count": a["count"] + b["count"], "sum": a["sum"] + b["sum"],
+                "sumsq": a["sumsq"] + b["sumsq"], "min": min(a["min"], b["min"]),
+                "max": max(a["max"], b["max"])}
+
+    @staticmethod
+    def finalize(a):
+        if not a["count"]:
+            return {"count": 0, "mean": None, "std": None, "min": None, "max": None}
+        mean = a["sum"] / a["count"]
+        var = max(a["sumsq"] / a["count"] - mean * mean, 0.0)
+        return {"count": a["count"], "mean": round(mean, 4), "std": round(var ** 0.5, 4),
+                "min": round(a["min"], 4), "max": round(a["max"], 4)}
+
+
+class Sketch:
+    """t-digests, merged into one."""
+
+    @staticmethod
+    def zero():
+        return TDigest()
+
+    @staticmethod
+    def merge(a, b):
+        return TDigest.merge([a, b])
+
+    @staticmethod
+    def finalize(a):
+        if not a.count:
+            return {"count": 0}
+        return {"count": int(a.count), **{name: round(float(a.quantile(q)), 4)
+                                          for name, q in QUANTILES.items()}}
+
+
+class IntervalUnion:
+    """Sorted lists of (start, end) epoch ms intervals, unioned.
+
+    Intervals that overlap or touch are joined, so a run cut at a month
+    boundary by the partitioning becomes one interval again (map_running
+    extends each partition's last sample past its end for this).
+    """
+
+    @staticmethod
+    def zero():
+        return []
+
+    @staticmethod
+    def merge(a, b):
+        merged = []
+        for start, end in sorted(a + b):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    @staticmethod
+    def finalize(a):
+        durations = [end - start for start, end in a]
+        return {"intervals": len(a), "hours": round(sum(durations) / HOUR_MS, 3),
+                "longest_h": round(max(durations, default=0) / HOUR_MS, 3),
+                "first": a[0][0] if a else None, "last": a[-1][1] if a else None}
+
+
+# --- Map functions -----------------------------------------------------------------
+# Each maps the samples of one partition, (ts, values, entry, start_ms,
+# end_ms), to a partial of its job's reducer.
+
+def _gap_ms(entry):
+    return int(GAP_FACTOR * 1000 / entry.sample_rate_hz) if entry.sample_rate_hz else ON_CHANGE_GAP_MS
+
+
+def _durations(ts, entry, end_ms):
+    """Time each sample stands for: until the next sample, capped at the gap threshold."""
+    return np.minimum(np.diff(np.r_[ts, end_ms]), _gap_ms(entry))
+
+
+def map_stats(ts, values, entry, start_ms, end_ms):
+    values = values[np.isfinite(values)].astype(np.float64)
+    if not len(values):
+        return Moments.zero()
+    return {"count": int(len(values)), "sum": float(values.sum()),
+            "sumsq": float(np.dot(values, values)), "min": float(values.min()),
+            "max": float(values.max())}
+
+
+def map_percentiles(ts, values, entry, start_ms, end_ms):
+    values = values[np.isfinite(values)].astype(np.float64)
+    return TDigest.from_values(values) if len(values) else TDigest()
+
+
+def map_running(ts, values, entry, start_ms, end_ms):
+    if not len(ts):
+        return []
+    ends = ts + _durations(ts, entry, end_ms)
+    # The next sample is in the next partition: let the last one stand for
+    # the full gap threshold, so a run crossing end_ms overlaps the next
+    # partition's first run and is joined with it.
+    ends[-1] = ts[-1] + _gap_ms(entry)
+    on = np.nan_to_num(values) > 0
+    # Runs start and end at on/off edges and at logging gaps.
+    gap = np.diff(ts) > _gap_ms(entry)
+    starts = np.flatnonzero(on & ~np.r_[False, on[:-1] & ~gap])
+    lasts = np.flatnonzero(on & ~np.r_[on[1:] & ~gap, False])
+    return IntervalUnion.merge([], [(int(ts[a]), int(ends[b])) for a, b in zip(starts, lasts)])
+
+
+def map_energy(ts, values, entry, start_ms, end_ms):
+    if not len(ts):
+        return {}
+    hours = _durations(ts, entry, end_ms) / HOUR_MS
+    power = np.nan_to_num(values).astype(np.float64) / 100.0 * MAX_POWER_KW
+    return {"kwh": float(np.dot(power, hours)), "hours": float(hours.sum()),
+            "running_hours": float(hours[power > 0].sum())}
+
+
+class Job(NamedTuple):
+    """A map function and the reducer of its partials."""
+
+    map: Callable
+    reducer: type
+    version: int = 1
+
+
+JOBS = {
+    "stats": Job(map_stats, Moments),
+    "percentiles": Job(map_percentiles, Sketch),
+    "running": Job(map_running, IntervalUnion),
+    "energy": Job(map_energy, Sums),
+}
+
+
+# --- Engine ------------------------------------------------------------------------
+
+_conn = None
+
+
+def _worker_connection():
+    """Database connection of this worker process, opened on first use."""
+    global _conn
+    if _conn is None or _conn.closed:
+        from backend.database import get_connection
+
+        _conn = get_connection()
+    return _conn
+
+
+def month_samples(entry, key):
+    """Samples of a variable in one month as (ts, values) arrays."""
+    start_ms, end_ms = month_bounds(key)
+    if archive.covers(entry.id, start_ms, end_ms):
+        ts, values = archive.read(entry.id, start_ms, end_ms)
+        return np.asarray(ts), np.asarray(values, dtype=np.float64)
+    conn = _worker_connection()
+    parts_ts, parts_values = [], []
+    try:
+        with conn.cursor(f"backfill_{entry.id}_{key}",
+                         cursor_factory=psycopg2.extensions.cursor) as cursor:
+            cursor.itersize = FETCH_ROWS
+            cursor.execute("""
+                SELECT date, value
+                FROM public.variable_log_float
+                WHERE id_var = %s
+                  AND date >= %s
+                  AND date < %s
+                ORDER BY date;
+            """, (entry.id, start_ms, end_ms))
+            while True:
+                rows = cursor.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                data = np.array(rows, dtype=np.float64)
+                parts_ts.append(data[:, 0].astype(np.int64))
+                parts_values.append(data[:, 1])
+    finally:
+        conn.rollback()
+    if not parts_ts:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate(parts_ts), np.concatenate(parts_values)
+
+
+def map_partition(job_name, id_var, key):
+    """Worker: map the samples of one (variable, month) partition."""
+    entry = get_catalog()[id_var]
+    ts, values = month_samples(entry, key)
+    return JOBS[job_name].map(ts, values, entry, *month_bounds(key))
+
+
+def _checkpoint_path(job_name, id_var, key):
+    job = JOBS[job_name]
+    return os.path.join(BACKFILL_DIR, f"{job_name}_v{job.version}", f"{id_var}_{key}.pkl")
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def _save_checkpoint(path, partial):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(partial, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def run_job(job_name, ids, first_month, last_month, workers=None, restart=False, by_month=False,
+            log=print):
+    """Map every (variable, month) partition and reduce per variable.
+
+    Args:
+        job_name: Key of JOBS.
+        ids: Float variable ids.
+        first_month, last_month: Inclusive range of 'YYYY-MM' months.
+        workers: Worker processes (default: CPU count).
+        restart: Ignore and overwrite existing checkpoints.
+        by_month: Also report the KPI of every month.
+        log: Progress callback taking one string.
+
+    Returns:
+        Dict with job, months, computed, resumed, failed (partition ->
+        error), per_variable and, with by_month, by_month.
+    """
+    if job_name not in JOBS:
+        raise ValueError(f"job must be one of {sorted(JOBS)}")
+    catalog = get_catalog()
+    for id_var in ids:
+        if id_var not in catalog or catalog[id_var].table != "float":
+            raise ValueError(f"variable {id_var} is not a catalogued float variable")
+    months = [first_month]
+    while months[-1] < last_month:
+        months.append(month_key(month_bounds(months[-1])[1]))
+    if months[-1] != last_month:
+        raise ValueError("last_month must not be before first_month")
+
+    job = JOBS[job_name]
+    now_ms = time.time() * 1000
+    partials, failed = {}, {}
+    todo = []
+    for id_var in ids:
+        for key in months:
+            if month_bounds(key)[0] > now_ms:
+                continue
+            saved = None if restart else _load_checkpoint(_checkpoint_path(job_name, id_var, key))
+            if saved is None:
+                todo.append((id_var, key))
+            else:
+                partials[id_var, key] = saved
+    resumed = len(partials)
+    log(f"{job_name}: {len(todo)} partitions to map, {resumed} resumed from checkpoints")
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(map_partition, job_name, id_var, key): (id_var, key)
+                       for id_var, key in todo}
+            for done, future in enumerate(as_completed(futures), 1):
+                id_var, key = futures[future]
+                try:
+                    partial = future.result()
+                except Exception as e:
+                    failed[f"{id_var}_{key}"] = str(e)
+                    log(f"{id_var} {key}: failed ({e})")
+                    continue
+                partials[id_var, key] = partial
+                if month_bounds(key)[1] <= now_ms:
+                    _save_checkpoint(_checkpoint_path(job_name, id_var, key), partial)
+                log(f"{id_var} {key}: mapped ({done}/{len(todo)})")
+
+    result = {"job": job_name, "months": [months[0], months[-1]], "computed": len(todo) - len(failed),
+              "resumed": resumed, "failed": failed, "per_variable": {}}
+    if by_month:
+        result["by_month"] = {}
+    for id_var in ids:
+        keyed = [(key, partials[id_var, key]) for key in months if (id_var, key) in partials]
+        merged = reduce(job.reducer.merge, (partial for _, partial in keyed), job.reducer.zero())
+        result["per_variable"][id_var] = job.reducer.finalize(merged)
+        if by_month:
+            result["by_month"][id_var] = {key: job.reducer.finalize(partial) for key, partial in keyed}
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Backfill a KPI over whole months of history.")
+    parser.add_argument("job", choices=sorted(JOBS))
+    parser.add_argument("--ids", required=True, help="comma-separated float variable ids")
+    parser.add_argument("--start", required=True, help="first month, YYYY-MM")
+    parser.add_argument("--end", required=True, help="last month (inclusive), YYYY-MM")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--restart", action="store_true", help="ignore existing checkpoints")
+    parser.add_argument("--by-month", action="store_true", help="also report every month")
+    args = parser.parse_args()
+
+    try:
+        report = run_job(args.job, [int(i) for i in args.ids.split(",") if i.strip()],
+                         args.start, args.end, max(1, args.workers), args.restart, args.by_month,
+                         log=lambda line: print(line, file=sys.stderr))
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(report, indent=2, default=str))
+    sys.exit(1 if report["failed"] else 0)
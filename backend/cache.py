@@ -0,0 +1,83 @@
+"""In-process result cache for service calls.
+
+Results are keyed like the single-flight calls (function name plus
+arguments). Days that are over never change, so results whose date
+arguments all lie before today are kept until evicted by the LRU bound;
+anything touching today (or with no date) expires after a short TTL.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+MISSING = object()
+OPEN_TTL_S = float(os.getenv("CACHE_OPEN_TTL_S", "60"))
+
+
+def _closed_day(value):
+    """True if `value` is an ISO date string of a day before today."""
+    if not isinstance(value, str) or len(value) != 10:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date() < date.today()
+    except ValueError:
+        return None
+
+
+def is_closed(args):
+    """True if a call has date arguments and all of them are past days."""
+    days = [_closed_day(a) for a in args]
+    days = [d for d in days if d is not None]
+    return bool(days) and all(days)
+
+
+def ttl_for(args):
+    """TTL in seconds for a call's arguments; None means no expiry."""
+    return None if is_closed(args) else OPEN_TTL_S
+
+
+class ResultCache:
+    """Thread-safe LRU cache with optional per-entry expiry."""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value or MISSING."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[1] is None or entry[1] >= time.monotonic())
+
+    def put(self, key, value, ttl=None):
+        """Store a value; `ttl` in seconds, None for no expiry."""
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+result_cache = ResultCache(max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "2048")))
@@ -0,0 +1,194 @@
+"""Variable catalog and generic multi-variable aggregation.
+
+The catalog lists the machine variables used by the project (id, name,
+unit, source table and nominal sample rate) so that ids are not repeated
+as literals across modules. It is read from `variables.json` (or the file
+named by the VARIABLE_CATALOG environment variable) once, at startup, and
+cached for the lifetime of the process.
+
+`aggregate` computes any combination of whitelisted aggregates for many
+variables in a single grouped scan of `variable_log_float`.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+CATALOG_PATH = os.getenv(
+    "VARIABLE_CATALOG", os.path.join(os.path.dirname(__file__), "variables.json")
+)
+
+
+class Variable(NamedTuple):
+    """One entry of the variable catalog."""
+
+    id: int
+    name: str
+    label: str
+    unit: str
+    table: str                      # 'float' or 'string' (variable_log_<table>)
+    sample_rate_hz: Optional[float]  # None for variables logged on change
+    key: Optional[str] = None       # stable alias used in code, e.g. 'spindle_load'
+    compression: Optional[dict] = None  # archive compression: {'method', 'tolerance'}
+
+
+@lru_cache(maxsize=1)
+def get_catalog():
+    """Load and cache the catalog.
+
+    Returns:
+        Dict mapping variable id to Variable.
+    """
+    with open(CATALOG_PATH, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    return {entry["id"]: Variable(**entry) for entry in entries}
+
+
+def variable(id_var):
+    """Return the catalog entry of a variable id (KeyError if unknown)."""
+    return get_catalog()[id_var]
+
+
+def name_of(id_var):
+    """Return the variable name, or the id as text if it is not catalogued."""
+    entry = get_catalog().get(id_var)
+    return entry.name if entry else str(id_var)
+
+
+@lru_cache(maxsize=None)
+def id_of(key):
+    """Return the id of the variable with the given alias key.
+
+    Args:
+        key: Alias such as 'temperature', 'spindle_load' or 'alarms'.
+
+    Returns:
+        The variable id.
+    """
+    for entry in get_catalog().values():
+        if entry.key == key:
+            return entry.id
+    raise KeyError(f"no variable with key '{key}' in the catalog")
+
+
+def list_variables():
+    """Return the catalog as a list of dicts, ordered by id."""
+    return [entry._asdict() for _, entry in sorted(get_catalog().items())]
+
+
+# SQL expression per aggregate name. Only names listed here can be requested.
+AGGREGATES = {
+    "avg": "AVG(value)",
+    "min": "MIN(value)",
+    "max": "MAX(value)",
+    "sum": "SUM(value)",
+    "count": "COUNT(*)",
+    "stddev": "STDDEV_SAMP(value)",
+    "p50": "PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY value)",
+    "p95": "PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY value)",
+    "p99": "PERCENTILE_CONT(0.99) WITHIN GROUP (ORDER BY value)",
+}
+
+# Bucket widths in ms; 'day' follows the session time zone like the other
+# services, 'none' aggregates the whole range.
+BUCKETS = {
+    "1m": 60_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "30m": 1_800_000,
+    "hour": 3_600_000,
+    "day": None,
+    "none": None,
+}
+
+
+def parse_ids(ids):
+    """Parse a comma-separated id list and check it against the catalog.
+
+    Args:
+        ids: String like '618,630' or an iterable of ints.
+
+    Returns:
+        List of unique ids in the given order.
+    """
+    if isinstance(ids, str):
+        ids = [part for part in ids.split(",") if part.strip()]
+    parsed = list(dict.fromkeys(int(i) for i in ids))
+    if not parsed:
+        raise ValueError("at least one id is required")
+
+    catalog = get_catalog()
+    for id_var in parsed:
+        if id_var not in catalog:
+            raise ValueError(f"unknown variable id {id_var}")
+        if catalog[id_var].table != "float":
+            raise ValueError(f"variable {id_var} is not numeric")
+    return parsed
+
+
+def aggregate(db_conn, ids, start, end, bucket="hour", aggs="avg"):
+    """Compute several aggregates for several variables in one grouped scan.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        ids: Variable ids, as a comma-separated string or list.
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        bucket: One of the keys of BUCKETS.
+        aggs: Aggregate names from AGGREGATES, comma-separated or a list.
+
+    Returns:
+        List of dicts with id_var, bucket (start time, or the range start
+        for bucket 'none') and one key per requested aggregate.
+    """
+    try:
+        ids = parse_ids(ids)
+        if isinstance(aggs, str):
+            aggs = [a.strip() for a in aggs.split(",") if a.strip()]
+        aggs = list(dict.fromkeys(aggs))
+        unknown = [a for a in aggs if a not in AGGREGATES]
+        if unknown or not aggs:
+            raise ValueError(f"aggs must be chosen from {sorted(AGGREGATES)}")
+        if bucket not in BUCKETS:
+            raise ValueError(f"bucket must be one of {list(BUCKETS)}")
+
+        start_date = datetime.strptime(start, "%Y-%m-%d")
+        end_date = datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1)
+        if end_date <= start_date:
+            raise ValueError("end must not be before start")
+        start_ts = int(start_date.timestamp() * 1000)
+        end_ts = int(end_date.timestamp() * 1000)
+
+        params = []
+        if bucket == "none":
+            bucket_expr = "to_timestamp(%s / 1000.0)"
+            params.append(start_ts)
+        elif bucket == "day":
+            bucket_expr = "date_trunc('day', to_timestamp(date / 1000.0))"
+        else:
+            bucket_expr = "to_timestamp(((date / %s) * %s) / 1000.0)"
+            params += [BUCKETS[bucket], BUCKETS[bucket]]
+
+        select_aggs = ",\n                   ".join(
+            f"{AGGREGATES[a]} AS {a}" for a in aggs
+        )
+        query = f"""
+            SELECT id_var,
+                   {bucket_expr} AS bucket,
+                   {select_aggs}
+            FROM public.variable_log_float
+            WHERE id_var = ANY(%s)
+              AND date >= %s
+              AND date < %s
+            GROUP BY id_var, 2
+            ORDER BY id_var, 2;
+        """
+        params += [ids, start_ts, end_ts]
+
+        with db_conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+    except Exception as e:
+        raise e
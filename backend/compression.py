@@ -0,0 +1,198 @@
+"""Dead-band and swinging-door compression of sampled signals.
+
+Slowly changing signals such as motor temperatures are logged at 1 Hz but
+move by a fraction of a degree per minute. Both methods keep a subset of
+the samples (points) from which every original sample can be rebuilt
+within a tolerance:
+
+- deadband: a sample is kept when it differs from the last kept value by
+  more than the tolerance. Reads hold the last kept value (step).
+- swinging_door: a segment is extended while one straight line from its
+  first point passes within the tolerance of every sample; the "doors"
+  are the running max of the lower and min of the upper slopes. When they
+  cross, the segment ends at the previous sample. Reads interpolate
+  linearly. The end point is stored on the feasible line (not the raw
+  sample), which keeps the error of every sample within the tolerance;
+  classic SDT, which stores the raw sample, can exceed it.
+
+Runs are split at NaN values and at intervals longer than `gap_ms`; a
+point with a NaN value is stored right after the end of each run, so
+reads do not bridge gaps or hold values across them.
+
+Both methods are sequential by nature. The per-point loop searches for the
+next kept sample with vectorized scans over doubling chunks, so the Python
+work grows with the number of kept points, not of samples.
+
+The tolerance is configured per variable in the catalog (`compression`:
+{"method", "tolerance"}) and applied by `backend.archive` when syncing or
+exporting with compression.
+"""
+
+import numpy as np
+
+METHODS = ("deadband", "swinging_door")
+GAP_FACTOR = 10      # nominal intervals without a sample that split a run
+FIRST_CHUNK = 64     # samples scanned before the chunk starts doubling
+
+
+def _deadband_run(values, tolerance):
+    """Indices of the kept samples of one run."""
+    n = len(values)
+    kept = [0]
+    i = 0
+    while True:
+        ref, lo, size, found = values[i], i + 1, FIRST_CHUNK, None
+        while lo < n:
+            hi = min(lo + size, n)
+            hit = np.flatnonzero(np.abs(values[lo:hi] - ref) > tolerance)
+            if hit.size:
+                found = lo + int(hit[0])
+                break
+            lo, size = hi, size * 2
+        if found is None:
+            break
+        kept.append(found)
+        i = found
+    if kept[-1] != n - 1:
+        kept.append(n - 1)
+    return np.array(kept), values[kept]
+
+
+def _swinging_door_run(ts, values, tolerance):
+    """Indices and (adjusted) values of the kept samples of one run."""
+    n = len(values)
+    tolerance *= 1 - 1e-9  # keep rounding of the slopes from overshooting the tolerance
+    kept, kept_values = [0], [float(values[0])]
+    origin, t0, v0 = 0, ts[0], float(values[0])
+    while origin < n - 1:
+        size = FIRST_CHUNK
+        while True:
+            hi = min(origin + 1 + size, n)
+            dt = (ts[origin + 1:hi] - t0).astype(np.float64)
+            window = values[origin + 1:hi]
+            lower = np.maximum.accumulate((window - tolerance - v0) / dt)
+            upper = np.minimum.accumulate((window + tolerance - v0) / dt)
+            closed = np.flatnonzero(lower > upper)
+            if closed.size or hi == n:
+                break
+            size *= 2
+        end = max(int(closed[0]) - 1, 0) if closed.size else hi - origin - 2
+        slope = min(max((window[end] - v0) / dt[end], lower[end]), upper[end])
+        origin = origin + 1 + end
+        t0, v0 = ts[origin], v0 + slope * dt[end]
+        kept.append(origin)
+        kept_values.append(v0)
+    return np.array(kept), np.array(kept_values)
+
+
+def compress(ts, values, method, tolerance, gap_ms=None, prev_ts=None):
+    """Compress a sorted series.
+
+    Args:
+        ts: Sorted int64 epoch ms timestamps.
+        values: Float values aligned with ts; NaN marks missing samples.
+        method: 'deadband' or 'swinging_door'.
+        tolerance: Largest allowed reconstruction error, in signal units.
+        gap_ms: Intervals longer than this split runs; None never splits.
+        prev_ts: Timestamp of the last stored point before `ts`, when the
+            series continues an earlier one; a gap marker is stored if the
+            series does not continue it directly.
+
+    Returns:
+        Tuple (timestamps, values) of the kept points, NaN for gap markers.
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {list(METHODS)}")
+    ts = np.asarray(ts, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(ts):
+        last = np.r_[ts[1:] != ts[:-1], True]  # keep the last of repeated timestamps
+        ts, values = ts[last], values[last]
+
+    finite = np.flatnonzero(np.isfinite(values))
+    if not len(finite):
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    split = np.diff(finite) > 1
+    if gap_ms is not None:
+        split |= np.diff(ts[finite]) > gap_ms
+    starts = np.r_[0, np.flatnonzero(split) + 1]
+    stops = np.r_[starts[1:], len(finite)]
+
+    out_ts, out_values = [], []
+    leading = prev_ts is not None and (finite[0] > 0 or (gap_ms is not None and ts[finite[0]] - prev_ts > gap_ms))
+    if leading:
+        out_ts.append([prev_ts + 1])
+        out_values.append([np.nan])
+    for run, (a, b) in enumerate(zip(finite[starts], finite[stops - 1] + 1)):
+        if method == "deadband":
+            index, kept = _deadband_run(values[a:b], tolerance)
+        else:
+            index, kept = _swinging_door_run(ts[a:b], values[a:b], tolerance)
+        out_ts.append(ts[a:b][index])
+        out_values.append(kept)
+        if run < len(starts) - 1 or b < len(values):
+            out_ts.append([ts[b - 1] + 1])  # gap marker
+            out_values.append([np.nan])
+    return np.concatenate(out_ts).astype(np.int64), np.concatenate(out_values)
+
+
+def reconstruct(points_ts, points_values, method, ts):
+    """Values of a compressed series at arbitrary times (NaN in gaps).
+
+    Args:
+        points_ts, points_values: Kept points from `compress`.
+        method: Method used to compress.
+        ts: Query times in epoch ms.
+
+    Returns:
+        Float array aligned with ts.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    if not len(points_ts):
+        return np.full(len(ts), np.nan)
+    if method == "deadband":
+        index = np.searchsorted(points_ts, ts, side="right") - 1
+        values = points_values[np.maximum(index, 0)].astype(np.float64)
+        values[index < 0] = np.nan
+        return values
+    return np.interp(ts, points_ts, points_values, left=np.nan, right=np.nan)
+
+
+def grid(points_ts, points_values, step_ms):
+    """Sample times of a regular grid over every run of kept points."""
+    finite = np.isfinite(points_values)
+    first = finite & ~np.r_[False, finite[:-1]]
+    last = finite & ~np.r_[finite[1:], False]
+    starts, ends = points_ts[first], points_ts[last]
+    counts = (ends - starts) // step_ms + 1
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets * step_ms
+
+
+def bucket_means(points_ts, points_values, method, start_ms, end_ms, bucket_ms):
+    """Time-weighted mean per bucket computed directly from kept points.
+
+    The reconstruction is piecewise constant or linear, so its integral
+    over every piece between kept points and bucket edges is exact; no
+    samples are rebuilt.
+
+    Returns:
+        Tuple (bucket starts, means); NaN for buckets without data.
+    """
+    edges = np.arange(start_ms, end_ms + bucket_ms, bucket_ms, dtype=np.int64)
+    edges[-1] = end_ms
+    inside = points_ts[(points_ts > start_ms) & (points_ts < end_ms)]
+    breaks = np.union1d(edges, inside)
+    values = reconstruct(points_ts, points_values, method, breaks)
+    widths = np.diff(breaks).astype(np.float64)
+    if method == "deadband":
+        area = values[:-1] * widths
+    else:
+        area = (values[:-1] + values[1:]) / 2 * widths
+    valid = np.isfinite(area)
+    bucket = (breaks[:-1] - start_ms) // bucket_ms
+    n = len(edges) - 1
+    total = np.bincount(bucket[valid], area[valid], minlength=n)
+    duration = np.bincount(bucket[valid], widths[valid], minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return edges[:-1], total / duration
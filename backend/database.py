@@ -8,8 +8,9 @@ env_path = "backend/" + ".env"
 
 load_dotenv(dotenv_path=env_path)
 
-def get_connection():
-    conn = psycopg2.connect(
+def connection_params():
+    """Connection keyword arguments for the configured database."""
+    return dict(
         host=os.getenv("DB_HOST"),      
         port=os.getenv("DB_PORT"),
         database=os.getenv("DB_NAME"),      
@@ -17,4 +18,7 @@ def get_connection():
         password=os.getenv("DB_PASSWORD"), 
         cursor_factory=RealDictCursor  
     )
+
+def get_connection():
+    conn = psycopg2.connect(**connection_params())
     return conn
\ No newline at end of file
@@ -0,0 +1,285 @@
+"""Machine registry, per-machine connection pools and fleet fan-out.
+
+Each machine logs into its own database (the extraction config points at
+`dbname: "2207"`). The registry lists the machines and their DSNs; it is
+read from `machines.json` (or the file named by the MACHINES_FILE
+environment variable). `${VAR}` references in a DSN are expanded from the
+environment, so credentials stay in `backend/.env`:
+
+    [{"id": "2207", "label": "Machine 2207",
+      "dsn": "host=${DB_HOST} port=${DB_PORT} dbname=2207 user=${DB_USER} password=${DB_PASSWORD}"}]
+
+Every machine gets a lazily created, thread-safe connection pool.
+`fan_out` runs the same query function on all machines concurrently and
+returns whatever finished before the deadline; machines that failed or
+were too slow are reported with their status instead of failing the
+whole request. All machines are assumed to share the variable catalog.
+
+Configuration (environment variables):
+- MACHINES_FILE: registry path (default backend/machines.json).
+- MACHINE_POOL_SIZE: connections per machine (default 4).
+- FLEET_DEADLINE_S: default fan-out deadline in seconds (default 5).
+- FLEET_WORKERS: fan-out threads shared by all requests (default 16).
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import NamedTuple
+
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+
+import backend.database  # noqa: F401  (loads backend/.env for the DSNs)
+import backend.services as services
+from backend.catalog import id_of
+
+MACHINES_PATH = os.getenv(
+    "MACHINES_FILE", os.path.join(os.path.dirname(__file__), "machines.json")
+)
+POOL_SIZE = int(os.getenv("MACHINE_POOL_SIZE", "4"))
+DEADLINE_S = float(os.getenv("FLEET_DEADLINE_S", "5"))
+CONNECT_TIMEOUT_S = 5
+MAX_POWER_KW = 37.0
+
+
+class Machine(NamedTuple):
+    """One entry of the machine registry."""
+
+    id: str
+    label: str
+    dsn: str
+
+
+@lru_cache(maxsize=1)
+def get_machines():
+    """Load and cache the registry.
+
+    Returns:
+        Dict mapping machine id to Machine, in file order.
+    """
+    with open(MACHINES_PATH, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    return {
+        str(entry["id"]): Machine(str(entry["id"]), entry.get("label", str(entry["id"])),
+                                  os.path.expandvars(entry["dsn"]))
+        for entry in entries
+    }
+
+
+def list_machines():
+    """Return the registry without DSNs, as a list of dicts."""
+    return [{"id": m.id, "label": m.label} for m in get_machines().values()]
+
+
+class _Pool:
+    """A connection pool plus a semaphore, so callers wait instead of failing
+    with PoolError when all connections are in use."""
+
+    def __init__(self, machine, size):
+        self.pool = ThreadedConnectionPool(
+            0, size, dsn=machine.dsn, cursor_factory=RealDictCursor,
+            connect_timeout=CONNECT_TIMEOUT_S,
+        )
+        self.slots = threading.BoundedSemaphore(size)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_executor = ThreadPoolExecutor(int(os.getenv("FLEET_WORKERS", "16")), thread_name_prefix="fleet")
+
+
+def _pool(machine_id):
+    with _pools_lock:
+        pool = _pools.get(machine_id)
+        if pool is None:
+            machine = get_machines().get(machine_id)
+            if machine is None:
+                raise ValueError(f"unknown machine '{machine_id}'")
+            pool = _pools[machine_id] = _Pool(machine, POOL_SIZE)
+        return pool
+
+
+@contextmanager
+def connection(machine_id, timeout_s=None):
+    """Borrow a connection of a machine's pool.
+
+    The transaction is rolled back when the block exits (the services only
+    read). With `timeout_s`, waiting for a free connection and every
+    statement are limited to that many seconds.
+    """
+    pool = _pool(machine_id)
+    if not pool.slots.acquire(timeout=timeout_s):
+        raise TimeoutError(f"no free connection for machine '{machine_id}'")
+    conn = None
+    try:
+        conn = pool.pool.getconn()
+        if timeout_s is not None:
+            with conn.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = %s;", (int(timeout_s * 1000),))
+        yield conn
+    finally:
+        if conn is not None:
+            broken = bool(conn.closed)
+            if not broken:
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            pool.pool.putconn(conn, close=broken)
+        pool.slots.release()
+
+
+def run_on(machine_id, fn, *args, timeout_s=None, **kwargs):
+    """Run `fn(conn, *args, **kwargs)` on one machine."""
+    with connection(machine_id, timeout_s) as conn:
+        return fn(conn, *args, **kwargs)
+
+
+def fan_out(fn, *args, machines=None, deadline_s=None, **kwargs):
+    """Run the same query function on many machines concurrently.
+
+    Args:
+        fn: Function called as `fn(conn, *args, **kwargs)`.
+        machines: Machine ids; all registered machines by default.
+        deadline_s: Seconds to wait for results (FLEET_DEADLINE_S by default).
+            Statements still running at the deadline are cancelled by the
+            server through `statement_timeout`.
+
+    Returns:
+        List of dicts, one per machine in registry order, with machine,
+        status ('ok', 'error' or 'timeout'), elapsed_ms, and result or error.
+    """
+    if machines is None:
+        machines = list(get_machines())
+    if deadline_s is None:
+        deadline_s = DEADLINE_S
+
+    def call(machine_id):
+        start = time.perf_counter()
+        result = run_on(machine_id, fn, *args, timeout_s=deadline_s, **kwargs)
+        return result, round((time.perf_counter() - start) * 1000, 1)
+
+    futures = {machine_id: _executor.submit(call, machine_id) for machine_id in machines}
+    wait(futures.values(), timeout=deadline_s)
+
+    outcomes = []
+    for machine_id, future in futures.items():
+        outcome = {"machine": machine_id}
+        if not future.done():
+            future.cancel()
+            outcome.update(status="timeout", elapsed_ms=round(deadline_s * 1000, 1))
+        elif future.exception() is not None:
+            outcome.update(status="error", error=str(future.exception()))
+        else:
+            result, elapsed_ms = future.result()
+            outcome.update(status="ok", elapsed_ms=elapsed_ms, result=result)
+        outcomes.append(outcome)
+    return outcomes
+
+
+def machine_kpis(db_conn, date):
+    """Daily KPIs of one machine, with the sample counts needed to merge them.
+
+    Args:
+        db_conn: Connection to the machine's database.
+        date: ISO date string YYYY-MM-DD.
+
+    Returns:
+        Dict with avg_temp, avg_spindle, avg_power_kW, their sample counts,
+        num_alarms and num_critical_alarms.
+    """
+    day = datetime.strptime(date, "%Y-%m-%d")
+    start_ts = int(day.timestamp() * 1000)
+    end_ts = int((day + timedelta(days=1)).timestamp() * 1000)
+    temp_id, spindle_id = id_of("temperature"), id_of("spindle_load")
+
+    with db_conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id_var, COUNT(value) AS n, AVG(value) AS avg
+            FROM public.variable_log_float
+            WHERE id_var IN (%s, %s)
+              AND date >= %s
+              AND date < %s
+            GROUP BY id_var;
+        """, (temp_id, spindle_id, start_ts, end_ts))
+        stats = {row["id_var"]: row for row in cursor.fetchall()}
+
+    def avg(id_var):
+        row = stats.get(id_var)
+        return (float(row["avg"]) if row and row["avg"] is not None else None,
+                int(row["n"]) if row else 0)
+
+    avg_temp, n_temp = avg(temp_id)
+    avg_spindle, n_spindle = avg(spindle_id)
+    return {
+        "avg_temp": avg_temp,
+        "n_temp": n_temp,
+        "avg_spindle": avg_spindle,
+        "n_spindle": n_spindle,
+        "avg_power_kW": avg_spindle / 100.0 * MAX_POWER_KW if avg_spindle is not None else None,
+        "num_alarms": services.get_number_daily_alerts(db_conn, date)["num_alarms"],
+        "num_critical_alarms": len(services.get_critical_alerts(db_conn, date)),
+    }
+
+
+def _weighted_mean(results, value_key, count_key):
+    pairs = [(r[value_key], r[count_key]) for r in results if r[value_key] is not None]
+    total = sum(n for _, n in pairs)
+    return sum(v * n for v, n in pairs) / total if total else None
+
+
+def merge_kpis(results):
+    """Merge per-machine KPIs into fleet KPIs.
+
+    Averages are weighted by sample counts, so they equal the average over
+    all samples of the fleet; power is summed since machines draw power at
+    the same time; alarm counts are summed.
+    """
+    powers = [r["avg_power_kW"] for r in results if r["avg_power_kW"] is not None]
+    avg_temp = _weighted_mean(results, "avg_temp", "n_temp")
+    avg_spindle = _weighted_mean(results, "avg_spindle", "n_spindle")
+    return {
+        "avg_temp": round(avg_temp, 1) if avg_temp is not None else None,
+        "avg_spindle": round(avg_spindle, 1) if avg_spindle is not None else None,
+        "total_avg_power_kW": round(sum(powers), 2) if powers else None,
+        "num_alarms": sum(r["num_alarms"] for r in results),
+        "num_critical_alarms": sum(r["num_critical_alarms"] for r in results),
+        "machines_reporting": len(results),
+    }
+
+
+def get_fleet_kpis(date, deadline_s=None):
+    """Daily KPIs of every machine and of the whole fleet.
+
+    Args:
+        date: ISO date string YYYY-MM-DD.
+        deadline_s: Seconds to wait for the machines.
+
+    Returns:
+        Dict with date, 'fleet' (merged KPIs of the machines that answered),
+        'machines' (per-machine outcomes) and 'complete' (all answered).
+    """
+    datetime.strptime(date, "%Y-%m-%d")  # ValueError before fanning out
+    outcomes = fan_out(machine_kpis, date, deadline_s=deadline_s)
+    answered = [o["result"] for o in outcomes if o["status"] == "ok"]
+    return {
+        "date": date,
+        "fleet": merge_kpis(answered),
+        "machines": outcomes,
+        "complete": len(answered) == len(outcomes),
+    }
+
+
+def close_pools():
+    """Close all pools (at application shutdown)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.pool.closeall()
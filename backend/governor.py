@@ -0,0 +1,316 @@
+"""Query governor: timeouts, range and row limits, concurrency caps, cost checks.
+
+Every service call made by the API goes through `governor.run`, which
+applies the call's Policy:
+
+- Range limit: calls whose start/end (or date) arguments span more than
+  `max_days` days are rejected before touching the database.
+- Concurrency: each policy belongs to a query class with its own
+  semaphore, so a burst of heavy analytics cannot take the connections the
+  dashboard needs. A call waiting longer than QUEUE_TIMEOUT_S for a slot
+  is rejected as overloaded.
+- Connections: calls run on a pooled connection of their own instead of
+  one connection shared by all requests, so a slow query only holds up
+  its own request.
+- statement_timeout: set per call (SET LOCAL), so the server cancels
+  statements running past the policy's budget.
+- EXPLAIN: with `max_cost` or `max_rows` set, each SELECT is first
+  explained and rejected when the planner's total cost or row estimate is
+  above the limit. Calls with a `downgrade` function are retried with
+  cheaper arguments (e.g. a coarser aggregation bucket) instead; their
+  result comes back wrapped in `Downgraded`, naming the arguments used.
+
+Rejections raise `Rejected` subclasses carrying an HTTP status code.
+"""
+
+import inspect
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, NamedTuple, Optional
+
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+from backend.profiling import TimedCursorMixin
+
+QUEUE_TIMEOUT_S = float(os.getenv("GOVERNOR_QUEUE_TIMEOUT_S", "10"))
+
+# Concurrent calls per query class.
+CLASS_SLOTS = {
+    "dashboard": int(os.getenv("GOVERNOR_DASHBOARD_SLOTS", "8")),
+    "aggregate": int(os.getenv("GOVERNOR_AGGREGATE_SLOTS", "4")),
+    "analytics": int(os.getenv("GOVERNOR_ANALYTICS_SLOTS", "2")),
+}
+
+
+class Rejected(Exception):
+    """A call refused by the governor."""
+
+    status_code = 400
+
+
+class TooExpensive(Rejected):
+    """The planner's estimate is above the policy's cost or row limit."""
+
+
+class Overloaded(Rejected):
+    """No slot of the query class became free in time."""
+
+    status_code = 503
+
+
+class TimedOut(Rejected):
+    """A statement ran past the policy's statement_timeout."""
+
+    status_code = 503
+
+
+class Policy(NamedTuple):
+    """Limits applied to one service function."""
+
+    query_class: str
+    timeout_ms: int
+    max_days: Optional[int] = None
+    max_rows: Optional[int] = None
+    max_cost: Optional[float] = None
+    downgrade: Optional[Callable] = None  # (arguments dict) -> cheaper dict or None
+
+
+class Downgraded(NamedTuple):
+    """Result of a call retried with cheaper arguments than requested."""
+
+    result: object
+    changes: dict  # argument name -> value actually used
+
+
+def coarser_bucket(arguments):
+    """Downgrade of catalog.aggregate: the next wider bucket, if any."""
+    ladder = ["1m", "5m", "15m", "30m", "hour", "day"]
+    bucket = arguments.get("bucket", "hour")
+    if bucket not in ladder or bucket == ladder[-1]:
+        return None
+    return dict(arguments, bucket=ladder[ladder.index(bucket) + 1])
+
+
+# No cost or row limits: dashboard calls are bounded to one day, and an
+# EXPLAIN before each of their SELECTs would cost more than it saves.
+DASHBOARD = Policy("dashboard", timeout_ms=5_000, max_days=1)
+
+POLICIES = {
+    "backend.catalog.aggregate": Policy(
+        "aggregate", timeout_ms=15_000, max_days=366, max_rows=200_000,
+        max_cost=5_000_000, downgrade=coarser_bucket,
+    ),
+    "backend.sketches.get_percentiles": Policy(
+        "aggregate", timeout_ms=15_000, max_days=366,
+    ),
+    "backend.anomalies.get_anomalies": Policy(
+        "analytics", timeout_ms=60_000, max_days=92, max_cost=20_000_000,
+    ),
+    "backend.motifs.get_motifs": Policy(
+        "analytics", timeout_ms=60_000, max_days=31, max_cost=10_000_000,
+    ),
+    "backend.alarm_sequences.get_alarm_precursors": Policy(
+        "analytics", timeout_ms=120_000, max_days=366,
+    ),
+    "backend.quality.get_data_quality": Policy(
+        "analytics", timeout_ms=60_000, max_days=366,
+    ),
+    "backend.programs.get_program_stats": Policy(
+        "aggregate", timeout_ms=15_000, max_days=3660,
+    ),
+    "backend.influence.get_influence": Policy(
+        "analytics", timeout_ms=30_000, max_days=1, max_cost=5_000_000,
+    ),
+}
+
+
+def policy_for(fn):
+    """Policy of a service function; the dashboard policy by default."""
+    return POLICIES.get(f"{fn.__module__}.{fn.__name__}", DASHBOARD)
+
+
+# --- EXPLAIN checks --------------------------------------------------------
+
+class _ExplainMixin:
+    """Cursor mixin explaining SELECTs before running them when the
+    connection carries a policy with cost or row limits."""
+
+    def execute(self, query, vars=None):
+        policy = getattr(self.connection, "policy", None)
+        if policy is not None and (policy.max_cost or policy.max_rows) and _is_select(query):
+            super().execute("EXPLAIN (FORMAT JSON) " + query, vars)
+            row = self.fetchone()
+            plan = (row["QUERY PLAN"] if isinstance(row, dict) else row[0])[0]["Plan"]
+            if policy.max_cost and plan["Total Cost"] > policy.max_cost:
+                raise TooExpensive(
+                    f"estimated query cost {plan['Total Cost']:.0f} exceeds {policy.max_cost:.0f};"
+                    " narrow the date range or the variables"
+                )
+            if policy.max_rows and plan["Plan Rows"] > policy.max_rows:
+                raise TooExpensive(
+                    f"estimated {plan['Plan Rows']} result rows exceed {policy.max_rows};"
+                    " use a coarser bucket or a shorter range"
+                )
+        return super().execute(query, vars)
+
+
+def _is_select(query):
+    head = query.lstrip().lstrip("(").lstrip()[:6].upper()
+    return head.startswith("SELECT") or head.startswith("WITH")
+
+
+@lru_cache(maxsize=None)
+def _governed(factory):
+    return type(f"Governed{factory.__name__}", (_ExplainMixin, TimedCursorMixin, factory), {})
+
+
+class GovernedConnection(psycopg2.extensions.connection):
+    """Connection whose unnamed cursors run the EXPLAIN checks of `policy`
+    and are timed for request profiles."""
+
+    policy = None
+
+    def cursor(self, *args, **kwargs):
+        if args or kwargs.get("name"):
+            # Server-side cursors cannot be explained; leave them alone.
+            return super().cursor(*args, **kwargs)
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _governed(factory)
+        return super().cursor(**kwargs)
+
+
+# --- Governor ----------------------------------------------------------------
+
+def _requested_days(fn, args, kwargs):
+    """Days spanned by a call's date arguments, None if it has none."""
+    try:
+        arguments = inspect.signature(fn).bind_partial(None, *args, **kwargs).arguments
+    except TypeError:
+        return None
+    try:
+        if "start" in arguments and "end" in arguments:
+            start = datetime.strptime(arguments["start"], "%Y-%m-%d")
+            end = datetime.strptime(arguments["end"], "%Y-%m-%d")
+            return (end - start).days + 1
+    except (TypeError, ValueError):
+        return None  # invalid dates are reported by the service itself
+    return 1 if "date" in arguments or "date_str" in arguments else None
+
+
+class Governor:
+    """Applies policies to service calls and runs them on pooled connections."""
+
+    def __init__(self, class_slots=CLASS_SLOTS, queue_timeout_s=QUEUE_TIMEOUT_S):
+        self.queue_timeout_s = queue_timeout_s
+        self._slots = {name: threading.BoundedSemaphore(n) for name, n in class_slots.items()}
+        self._pool_size = sum(class_slots.values())
+        self._pool = None
+        self._lock = threading.Lock()
+        self.counters = {name: {"running": 0, "completed": 0, "rejected": 0, "timed_out": 0,
+                                "downgraded": 0} for name in class_slots}
+
+    def _count(self, query_class, counter, delta=1):
+        with self._lock:
+            self.counters[query_class][counter] += delta
+
+    @contextmanager
+    def _connection(self):
+        from backend.database import connection_params
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(
+                    0, self._pool_size, connection_factory=GovernedConnection, **connection_params()
+                )
+            pool = self._pool
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+
+    def run(self, conn, fn, *args, **kwargs):
+        """Run `fn(conn, *args, **kwargs)` under its policy.
+
+        Args:
+            conn: Connection to use, or None to borrow one from the pool.
+            fn: Service function.
+
+        Returns:
+            The function's result, wrapped in `Downgraded` when it was
+            computed with cheaper arguments than requested.
+
+        Raises:
+            Rejected: The call exceeds a limit or could not get a slot.
+        """
+        policy = policy_for(fn)
+        days = _requested_days(fn, args, kwargs)
+        if policy.max_days is not None and days is not None and days > policy.max_days:
+            self._count(policy.query_class, "rejected")
+            raise TooExpensive(f"range of {days} days exceeds the limit of {policy.max_days}")
+
+        slots = self._slots[policy.query_class]
+        if not slots.acquire(timeout=self.queue_timeout_s):
+            self._count(policy.query_class, "rejected")
+            raise Overloaded(f"too many concurrent {policy.query_class} queries, retry later")
+        self._count(policy.query_class, "running")
+        try:
+            if conn is None:
+                with self._connection() as pooled:
+                    return self._execute(pooled, policy, fn, args, kwargs)
+            return self._execute(conn, policy, fn, args, kwargs)
+        finally:
+            self._count(policy.query_class, "running", -1)
+            slots.release()
+
+    def _execute(self, conn, policy, fn, args, kwargs):
+        arguments = requested = inspect.signature(fn).bind(conn, *args, **kwargs).arguments
+        governed = isinstance(conn, GovernedConnection)
+        try:
+            while True:
+                with conn.cursor() as cursor:
+                    cursor.execute("SET LOCAL statement_timeout = %s;", (policy.timeout_ms,))
+                if governed:
+                    conn.policy = policy
+                try:
+                    result = fn(**arguments)
+                    self._count(policy.query_class, "completed")
+                    if arguments is requested:
+                        return result
+                    return Downgraded(result, {name: value for name, value in arguments.items()
+                                               if requested.get(name) != value})
+                except TooExpensive:
+                    cheaper = policy.downgrade(arguments) if policy.downgrade else None
+                    if cheaper is None:
+                        self._count(policy.query_class, "rejected")
+                        raise
+                    conn.rollback()
+                    arguments = cheaper
+                    self._count(policy.query_class, "downgraded")
+                except psycopg2.errors.QueryCanceled:
+                    self._count(policy.query_class, "timed_out")
+                    raise TimedOut(f"query exceeded {policy.timeout_ms} ms")
+                finally:
+                    if governed:
+                        conn.policy = None
+        finally:
+            if not conn.closed:
+                conn.rollback()
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(counters) for name, counters in self.counters.items()}
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.closeall()
+
+
+governor = Governor()
@@ -0,0 +1,303 @@
+"""In-process hot store for the most recent days of a few variables.
+
+The dashboard mostly looks at the last few days of a handful of variables.
+The hot store keeps those days in memory, per id_var, as two sorted
+columns: int64 epoch-ms timestamps and float32 values (12 bytes per
+sample). Range lookups are two binary searches returning views, so a
+daily or hourly aggregate costs a few microseconds instead of a round trip
+to PostgreSQL.
+
+"Recent" is relative to the newest sample of each variable, so the store
+also works on historical databases. A series covers
+[newest - HOTSTORE_DAYS, last refresh - HOTSTORE_LAG_S); services only
+answer from the store when the requested range lies inside that interval,
+and fall back to SQL otherwise. Rows can be stored after newer ones (the
+batched ingestion commits whole batches), so each refresh fetches again
+from HOTSTORE_LAG_S before the covered end and replaces that tail.
+
+Configuration (environment variables):
+- HOTSTORE_DAYS: days kept per variable (default 3).
+- HOTSTORE_MAX_MB: memory budget; least recently used series are evicted
+  beyond it (default 256).
+- HOTSTORE_IDS: comma-separated ids to load (default temperature and
+  spindle load from the catalog).
+- HOTSTORE_REFRESH_S: seconds between refreshes of newly arrived rows
+  (default 60). Each refresh also loads configured ids missing from the
+  store, e.g. after an eviction or a failed load.
+- HOTSTORE_LAG_S: how long rows may take to be stored (default 120).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import psycopg2.extensions
+
+DAY_MS = 24 * 3600 * 1000
+HOUR_MS = 3600 * 1000
+
+
+class _Series:
+    """Sorted timestamp/value columns of one variable and their coverage."""
+
+    __slots__ = ("ts", "values", "covered_start", "covered_end")
+
+    def __init__(self, ts, values, covered_start, covered_end):
+        self.ts = ts
+        self.values = values
+        self.covered_start = covered_start
+        self.covered_end = covered_end
+
+    @property
+    def nbytes(self):
+        return self.ts.nbytes + self.values.nbytes
+
+
+class HotStore:
+    """Memory-bounded store of recent samples per variable."""
+
+    def __init__(self, days=3, max_bytes=256 * 1024 * 1024, lag_s=120):
+        self.days = days
+        self.max_bytes = max_bytes
+        self.lag_ms = int(lag_s * 1000)
+        self._series = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(series.nbytes for series in self._series.values())
+
+    def __contains__(self, id_var):
+        with self._lock:
+            return id_var in self._series
+
+    def _fetch(self, db_conn, id_var, start_ms, end_ms):
+        with db_conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+            cursor.execute("""
+                SELECT date, value
+                FROM public.variable_log_float
+                WHERE id_var = %s
+                  AND date >= %s
+                  AND date < %s
+                ORDER BY date;
+            """, (id_var, start_ms, end_ms))
+            rows = cursor.fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        data = np.array(rows, dtype=np.float64)
+        return data[:, 0].astype(np.int64), data[:, 1].astype(np.float32)
+
+    def load(self, db_conn, ids, now_ms=None):
+        """Load the most recent days of each variable into the store.
+
+        Args:
+            db_conn: PostgreSQL connection.
+            ids: Variable ids to load.
+            now_ms: Upper bound of the fetch (defaults to the wall clock);
+                the coverage ends `lag_s` earlier.
+        """
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        for id_var in ids:
+            with db_conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT MAX(date) AS newest
+                    FROM public.variable_log_float
+                    WHERE id_var = %s;
+                """, (id_var,))
+                row = cursor.fetchone()
+            db_conn.rollback()
+            if not row or row["newest"] is None:
+                continue
+
+            start_ms = int(row["newest"]) + 1 - self.days * DAY_MS
+            ts, values = self._fetch(db_conn, id_var, start_ms, now_ms)
+            db_conn.rollback()
+            with self._lock:
+                self._series[id_var] = _Series(ts, values, start_ms, max(start_ms, now_ms - self.lag_ms))
+                self._series.move_to_end(id_var)
+                self._evict()
+
+    def refresh(self, db_conn, now_ms=None):
+        """Append rows that arrived since the last load or refresh.
+
+        The rows from `lag_s` before the covered end on are fetched again
+        and replace the stored ones, so rows stored late are picked up
+        without duplicating the others. Samples older than the retention
+        window are dropped at the same time, so each series keeps a
+        sliding window of `days` days.
+        """
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        with self._lock:
+            current = list(self._series.items())
+
+        for id_var, series in current:
+            fetch_from = series.covered_end - self.lag_ms
+            ts, values = self._fetch(db_conn, id_var, fetch_from, now_ms)
+            db_conn.rollback()
+            stored = np.searchsorted(series.ts, fetch_from, side="left")
+            ts = np.concatenate([series.ts[:stored], ts])
+            values = np.concatenate([series.values[:stored], values])
+            covered_start = series.covered_start
+            if len(ts):
+                covered_start = max(covered_start, int(ts[-1]) + 1 - self.days * DAY_MS)
+                keep = np.searchsorted(ts, covered_start)
+                ts, values = ts[keep:], values[keep:]
+            covered_end = max(series.covered_end, now_ms - self.lag_ms)
+            with self._lock:
+                if id_var in self._series:
+                    # Replace rather than mutate: readers may hold views.
+                    self._series[id_var] = _Series(ts, values, covered_start, covered_end)
+                    self._evict()
+
+    def _evict(self):
+        total = sum(series.nbytes for series in self._series.values())
+        while self._series and total > self.max_bytes:
+            _, series = self._series.popitem(last=False)
+            total -= series.nbytes
+            self.evictions += 1
+
+    def range(self, id_var, start_ms, end_ms):
+        """Return the samples of [start_ms, end_ms) if the store covers it.
+
+        Args:
+            id_var: Variable id.
+            start_ms: Inclusive start in epoch ms.
+            end_ms: Exclusive end in epoch ms.
+
+        Returns:
+            Tuple (timestamps, values) of array views, or None when the
+            range is not fully covered and the caller must query the DB.
+        """
+        with self._lock:
+            series = self._series.get(id_var)
+            if series is None or start_ms < series.covered_start or end_ms > series.covered_end:
+                self.misses += 1
+                return None
+            self._series.move_to_end(id_var)
+            self.hits += 1
+        lo = np.searchsorted(series.ts, start_ms, side="left")
+        hi = np.searchsorted(series.ts, end_ms, side="left")
+        return series.ts[lo:hi], series.values[lo:hi]
+
+    def stats(self):
+        """Return counters and per-variable coverage for monitoring."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "series": {
+                    id_var: {
+                        "samples": len(series.ts),
+                        "covered_start": _iso(series.covered_start),
+                        "covered_end": _iso(series.covered_end),
+                    }
+                    for id_var, series in self._series.items()
+                },
+            }
+
+
+def _iso(ms):
+    return datetime.fromtimestamp(ms / 1000).isoformat()
+
+
+def mean_or_none(values):
+    """Mean of a float32 column as a Python float, None when empty."""
+    return float(values.mean(dtype=np.float64)) if len(values) else None
+
+
+def hourly_means(ts, values):
+    """Average samples per hour.
+
+    Args:
+        ts: Sorted int64 epoch ms timestamps.
+        values: Values aligned with `ts`.
+
+    Returns:
+        Dict mapping hour start (epoch ms) to the mean of that hour.
+    """
+    if not len(ts):
+        return {}
+    hours = ts - ts % HOUR_MS
+    starts, index = np.unique(hours, return_inverse=True)
+    sums = np.bincount(index, weights=values.astype(np.float64))
+    counts = np.bincount(index)
+    return dict(zip(starts.tolist(), (sums / counts).tolist()))
+
+
+def hour_to_datetime(hour_ms):
+    """Hour start in epoch ms as a local, timezone-aware datetime."""
+    return datetime.fromtimestamp(hour_ms / 1000).astimezone()
+
+
+hot_store = HotStore(
+    days=int(os.getenv("HOTSTORE_DAYS", "3")),
+    max_bytes=int(float(os.getenv("HOTSTORE_MAX_MB", "256")) * 1024 * 1024),
+    lag_s=float(os.getenv("HOTSTORE_LAG_S", "120")),
+)
+
+
+def configured_ids():
+    """Ids to keep hot: HOTSTORE_IDS or temperature and spindle load."""
+    from backend.catalog import id_of
+
+    ids = os.getenv("HOTSTORE_IDS")
+    if ids:
+        return [int(i) for i in ids.split(",") if i.strip()]
+    return [id_of("temperature"), id_of("spindle_load")]
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def run_loader(stop_event, refresh_s=None):
+    """Load the store, then refresh it until `stop_event` is set.
+
+    Meant to run in a daemon thread started from the app lifespan. It uses
+    its own connection so that it never takes one from the request
+    handlers' pool. Each round refreshes the stored series and loads the
+    configured ids that are missing. A failed round drops the connection;
+    the next one reconnects after a delay that starts at one second and
+    doubles up to `refresh_s`.
+    """
+    from backend.database import get_connection
+
+    if refresh_s is None:
+        refresh_s = float(os.getenv("HOTSTORE_REFRESH_S", "60"))
+    conn = None
+    delay, backoff = 0, 1.0
+    try:
+        while not stop_event.wait(delay):
+            try:
+                if conn is None:
+                    conn = get_connection()
+                hot_store.refresh(conn)
+                missing = [id_var for id_var in configured_ids() if id_var not in hot_store]
+                if missing:
+                    hot_store.load(conn, missing)
+                    print(f"Hot store loaded {missing} ({hot_store.nbytes / 1e6:.1f} MB)")
+                delay, backoff = refresh_s, 1.0
+            except Exception as e:
+                print(f"Hot store refresh failed, retrying in {backoff:.0f} s: {e}")
+                if conn is not None:
+                    _close_quietly(conn)
+                    conn = None
+                delay, backoff = backoff, min(backoff * 2, refresh_s)
+    finally:
+        if conn is not None:
+            _close_quietly(conn)
@@ -0,0 +1,278 @@
+"""Cross-variable influence: lagged correlation matrices per operation state.
+
+For one day, every numeric variable is averaged onto a 10-second grid with
+a single grouped scan and carried forward between samples. Sampled
+variables are carried for at most GAP_FACTOR nominal intervals, so logging
+outages become NaN instead of stale constants; variables logged on change
+are carried while the spindle load is still being logged. Rows are then
+split by machine state (MACHINE_IN_OPERATION: ON > 0, IDLE = 0, OFF = no
+signal) and, for each state and lag, the pairwise-complete Pearson
+correlation between every variable at time t and every variable at t + lag
+is computed.
+
+All sums are float32 matrix products accumulated over row chunks, so the
+working set is a few (chunk x variables) blocks plus the (variables x
+variables) accumulators, whatever the number of rows.
+
+Results of closed days are cached as .npz files, one per day.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from backend.alignment import align_asof, make_grid
+from backend.catalog import get_catalog, id_of, name_of
+from backend.compression import GAP_FACTOR
+
+STEP_MS = 10_000
+LAGS = (0, 1, 3, 6, 30)     # in grid steps: 0 s, 10 s, 30 s, 1 min, 5 min
+STATES = ("ON", "IDLE", "OFF")
+ROW_CHUNK = 4096
+MIN_PAIRS = 30              # minimum overlapping rows for a correlation
+CACHE_VERSION = 2           # bump when the grid changes to recompute cached days
+CACHE_DIR = os.getenv(
+    "INFLUENCE_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".cache", "influence")
+)
+
+
+def fetch_day_grid(db_conn, start_ms, end_ms, step_ms=STEP_MS):
+    """Average all numeric variables of a range onto a regular grid.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        start_ms: Inclusive start in epoch ms.
+        end_ms: Exclusive end in epoch ms.
+        step_ms: Grid step in ms.
+
+    Returns:
+        Tuple (ids, matrix): sorted variable ids and a float32 matrix
+        (rows x ids) with the last observation carried forward; NaN before
+        a variable's first sample and where it is no longer being logged.
+    """
+    with db_conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id_var,
+                   (date - %s) / %s AS slot,
+                   AVG(value) AS avg_value
+            FROM public.variable_log_float
+            WHERE date >= %s
+              AND date < %s
+            GROUP BY id_var, slot;
+        """, (start_ms, step_ms, start_ms, end_ms))
+        rows = cursor.fetchall()
+
+    grid = make_grid(start_ms, end_ms, step_ms)
+    if not rows:
+        return [], np.empty((len(grid), 0), dtype=np.float32)
+
+    slots = np.array([row["slot"] for row in rows], dtype=np.int64)
+    id_vars = [row["id_var"] for row in rows]
+    ids = sorted(set(id_vars))
+    catalog = get_catalog()
+    rates = [getattr(catalog.get(i), "sample_rate_hz", None) for i in ids]
+    tolerance = np.array([max(GAP_FACTOR * 1000 / rate, step_ms) if rate else np.inf for rate in rates])
+    ids, matrix = align_asof(id_vars, start_ms + slots * step_ms, [row["avg_value"] for row in rows],
+                             grid, ids=ids, tolerance_ms=tolerance)
+
+    # On-change variables have no gaps to detect; end them where the spindle
+    # load, logged at a fixed rate while the machine is on, stops.
+    spindle = id_of("spindle_load")
+    logging = ~np.isnan(matrix[:, ids.index(spindle)]) if spindle in ids else np.zeros(len(grid), bool)
+    matrix[np.ix_(~logging, [c for c, rate in enumerate(rates) if not rate])] = np.nan
+    return ids, matrix
+
+
+def operation_states(state_column):
+    """Map MACHINE_IN_OPERATION values to indexes into STATES."""
+    states = np.full(len(state_column), STATES.index("OFF"), dtype=np.int8)
+    states[state_column == 0] = STATES.index("IDLE")
+    states[state_column > 0] = STATES.index("ON")
+    return states
+
+
+def lagged_correlations(matrix, row_mask, lags=LAGS, chunk=ROW_CHUNK):
+    """Pairwise-complete lagged correlations between all columns.
+
+    Args:
+        matrix: Float array (rows x variables), NaN for missing.
+        row_mask: Boolean array; a pair (t, t + lag) is used only when both
+            rows are selected.
+        lags: Lags in rows.
+        chunk: Rows processed per matrix product.
+
+    Returns:
+        Tuple (corr, counts): float32 arrays of shape (len(lags), V, V)
+        where corr[l, i, j] correlates column i at t with column j at
+        t + lags[l], and counts holds the number of overlapping rows.
+    """
+    n_rows, n_vars = matrix.shape
+    centred = (matrix - np.nanmean(matrix, axis=0)).astype(np.float32)
+    present = ~np.isnan(centred)
+    values = np.where(present, centred, np.float32(0))
+    squares = values * values
+    weights = present.astype(np.float32)
+
+    corr = np.full((len(lags), n_vars, n_vars), np.nan, dtype=np.float32)
+    counts = np.zeros((len(lags), n_vars, n_vars), dtype=np.int32)
+
+    for li, lag in enumerate(lags):
+        sums = {k: np.zeros((n_vars, n_vars), dtype=np.float32)
+                for k in ("n", "x", "y", "xx", "yy", "xy")}
+        pair_rows = np.flatnonzero(row_mask[:n_rows - lag] & row_mask[lag:])
+
+        for start in range(0, len(pair_rows), chunk):
+            t = pair_rows[start:start + chunk]
+            mx, my = weights[t], weights[t + lag]
+            x, y = values[t], values[t + lag]
+            sums["n"] += mx.T @ my
+            sums["x"] += x.T @ my
+            sums["y"] += mx.T @ y
+            sums["xx"] += squares[t].T @ my
+            sums["yy"] += mx.T @ squares[t + lag]
+            sums["xy"] += x.T @ y
+
+        n = sums["n"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cov = n * sums["xy"] - sums["x"] * sums["y"]
+            var_x = n * sums["xx"] - sums["x"] ** 2
+            var_y = n * sums["yy"] - sums["y"] ** 2
+            r = cov / np.sqrt(var_x * var_y)
+        r[(n < MIN_PAIRS) | (var_x <= 0) | (var_y <= 0)] = np.nan
+        corr[li] = np.clip(r, -1, 1)
+        counts[li] = n.astype(np.int32)
+
+    return corr, counts
+
+
+def _cache_path(day):
+    return os.path.join(CACHE_DIR, f"{day:%Y-%m-%d}.v{CACHE_VERSION}.npz")
+
+
+def compute_day(db_conn, day):
+    """Compute (or load from cache) the influence matrices of one day.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        day: datetime at local midnight of the day.
+
+    Returns:
+        Dict with ids, lags (in seconds), states, corr of shape
+        (states, lags, V, V) and counts of the same shape.
+    """
+    path = _cache_path(day)
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            return {key: cached[key] for key in cached.files}
+
+    start_ms = int(day.timestamp() * 1000)
+    end_ms = int((day + timedelta(days=1)).timestamp() * 1000)
+    ids, matrix = fetch_day_grid(db_conn, start_ms, end_ms)
+
+    n_vars = len(ids)
+    shape = (len(STATES), len(LAGS), n_vars, n_vars)
+    result = {
+        "ids": np.array(ids, dtype=np.int64),
+        "lags": np.array(LAGS, dtype=np.int64) * STEP_MS // 1000,
+        "states": np.array(STATES),
+        "corr": np.full(shape, np.nan, dtype=np.float32),
+        "counts": np.zeros(shape, dtype=np.int32),
+    }
+    if n_vars:
+        state_id = id_of("machine_in_operation")
+        if state_id in ids:
+            state_column = matrix[:, ids.index(state_id)]
+        else:
+            state_column = np.full(len(matrix), np.nan)
+        states = operation_states(state_column)
+        for si in range(len(STATES)):
+            result["corr"][si], result["counts"][si] = lagged_correlations(matrix, states == si)
+
+    if day + timedelta(days=1) <= datetime.now():
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        np.savez_compressed(path, **result)
+    return result
+
+
+def get_influence(db_conn, date, state="ON", id_var=None, top=20):
+    """Return the strongest lagged correlations of a day for one state.
+
+    For each pair the lag with the largest absolute correlation is kept;
+    self-correlations are skipped.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        date: ISO date string YYYY-MM-DD.
+        state: Operation state: ON, IDLE or OFF.
+        id_var: If given, only pairs where this variable is the leader.
+        top: Number of pairs to return.
+
+    Returns:
+        List of dicts with source, target (id and name), lag_s, corr and
+        n (overlapping samples), strongest first.
+    """
+    try:
+        if state not in STATES:
+            raise ValueError(f"state must be one of {STATES}")
+        day = datetime.strptime(date, "%Y-%m-%d")
+        result = compute_day(db_conn, day)
+
+        ids = [int(i) for i in result["ids"]]
+        corr = result["corr"][STATES.index(state)]
+        counts = result["counts"][STATES.index(state)]
+        if not ids:
+            return []
+
+        strength = np.where(np.isnan(corr), -1, np.abs(corr))
+        best_lag = strength.argmax(axis=0)
+        best = np.take_along_axis(strength, best_lag[None], axis=0)[0]
+        np.fill_diagonal(best, -1)
+        if id_var is not None:
+            if id_var not in ids:
+                return []
+            keep = np.full(best.shape, False)
+            keep[ids.index(id_var)] = True
+            best = np.where(keep, best, -1)
+
+        order = np.argsort(best, axis=None)[::-1][:top]
+        pairs = []
+        for flat in order:
+            i, j = np.unravel_index(flat, best.shape)
+            if best[i, j] < 0:
+                break
+            lag = best_lag[i, j]
+            pairs.append({
+                "source_id": ids[i],
+                "source": name_of(ids[i]),
+                "target_id": ids[j],
+                "target": name_of(ids[j]),
+                "lag_s": int(result["lags"][lag]),
+                "corr": round(float(corr[lag, i, j]), 3),
+                "n": int(counts[lag, i, j]),
+            })
+        return pairs
+    except Exception as e:
+        raise e
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from backend.database import get_connection
+
+    parser = argparse.ArgumentParser(description="Precompute influence matrices for a range of days.")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", help="last day (inclusive), YYYY-MM-DD")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        day = datetime.strptime(args.start, "%Y-%m-%d")
+        last = datetime.strptime(args.end, "%Y-%m-%d")
+        while day <= last:
+            result = compute_day(conn, day)
+            print(f"{day:%Y-%m-%d}: {len(result['ids'])} variables")
+            day += timedelta(days=1)
+    finally:
+        conn.close()
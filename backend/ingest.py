@@ -0,0 +1,497 @@
+"""Batched ingestion of machine samples with COPY.
+
+Samples arrive over HTTP (`POST /api/ingest`), from the in-process
+`Ingestor.submit` (the stand-in for a message-queue consumer, used by the
+replay tool) or as JSON lines on stdin (`python -m backend.ingest pipe`).
+Inserting them row by row costs one round trip and one commit per sample;
+the ingestor instead buffers them per table and writes whole batches with
+`COPY ... FROM STDIN`, one transaction per batch:
+
+- Batching: a batch is written as soon as INGEST_BATCH_ROWS rows of one
+  table are buffered, or when the oldest buffered row is INGEST_FLUSH_MS
+  old, whichever comes first. Large bursts go out in full batches, a
+  trickle still reaches the database within the flush interval.
+- Backpressure: the rows accepted but not yet written are bounded by
+  INGEST_QUEUE_ROWS. `submit` waits up to INGEST_SUBMIT_TIMEOUT_S for room
+  and then raises `Backpressure` (HTTP 503 with Retry-After), so a slow
+  database slows the producers down instead of growing memory.
+- Retries: connection errors reconnect and retry the batch with
+  exponential backoff up to INGEST_RETRIES times. Batches that still fail,
+  or that the database rejects (e.g. a malformed value), are written as
+  COPY text to INGEST_FAILED_DIR for inspection and replay, and counted.
+
+Rows are routed by the catalog (`variable_log_float` or
+`variable_log_string`); uncatalogued ids go to the float table when the
+value is numeric. The writer uses its own connection (INGEST_DSN, `${VAR}`
+references expanded from the environment), because the dashboard's
+database user is read-only; without INGEST_DSN the endpoint is disabled.
+Values of string variables are stored as given when they are strings and
+JSON-encoded otherwise, so a list sent for the alarm snapshot is stored
+as the JSON text the services cast to jsonb. The HTTP endpoint writes to
+the database, so it also needs INGEST_TOKEN, sent by the caller in the
+`X-Ingest-Token` header.
+
+The load test never writes to the log tables: it creates a scratch copy
+of `variable_log_float` (`--table`, default ingest_loadtest, with the same
+columns and indexes so COPY costs the same), fills it with samples of a
+synthetic id and drops it afterwards unless `--keep` is given.
+
+Configuration (environment variables):
+- INGEST_DSN: libpq DSN of the writing connection (unset disables ingestion).
+- INGEST_TOKEN: secret required by `POST /api/ingest` (unset disables it).
+- INGEST_QUEUE_ROWS: rows accepted but not yet written (default 200000).
+- INGEST_BATCH_ROWS: rows per COPY batch (default 5000).
+- INGEST_FLUSH_MS: longest time a row waits in the buffer (default 500).
+- INGEST_RETRIES: retries of a batch after connection errors (default 5).
+- INGEST_SUBMIT_TIMEOUT_S: wait for room in the queue (default 1).
+- INGEST_FAILED_DIR: folder of failed batches (default backend/.cache/ingest_failed).
+
+Usage (from the project root):
+python -m backend.ingest loadtest --rows 2000000 --producers 4
+python -m backend.ingest loadtest --rows 2000000 --dry-run
+python -m backend.ingest pipe < samples.jsonl
+"""
+
+import argparse
+import hmac
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+import psycopg2
+
+import backend.database  # noqa: F401  (loads backend/.env for INGEST_DSN)
+from backend.catalog import get_catalog
+
+INGEST_DSN = os.path.expandvars(os.getenv("INGEST_DSN", ""))
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")
+QUEUE_ROWS = int(os.getenv("INGEST_QUEUE_ROWS", "200000"))
+BATCH_ROWS = int(os.getenv("INGEST_BATCH_ROWS", "5000"))
+FLUSH_MS = int(os.getenv("INGEST_FLUSH_MS", "500"))
+RETRIES = int(os.getenv("INGEST_RETRIES", "5"))
+SUBMIT_TIMEOUT_S = float(os.getenv("INGEST_SUBMIT_TIMEOUT_S", "1"))
+FAILED_DIR = os.getenv(
+    "INGEST_FAILED_DIR", os.path.join(os.path.dirname(__file__), ".cache", "ingest_failed")
+)
+
+TABLES = ("float", "string")
+COPY_SQL = {
+    table: f"COPY public.variable_log_{table} (id_var, date, value) FROM STDIN"
+    for table in TABLES
+}
+LOADTEST_TABLE = "ingest_loadtest"
+LOADTEST_ID = 999_999    # synthetic id, not in the catalog
+_TABLE_NAME = re.compile(r"^[a-z_][a-z0-9_]*$")
+# Errors after which the connection is reopened and the batch retried.
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+RATE_WINDOW_S = 10
+_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+class Backpressure(Exception):
+    """The queue had no room for the rows within the submit timeout."""
+
+    status_code = 503
+
+
+def authorized(headers):
+    """Whether a request carries the ingest token."""
+    if not INGEST_TOKEN:
+        return False
+    token = headers.get("x-ingest-token") or ""
+    return hmac.compare_digest(token.encode(), INGEST_TOKEN.encode())
+
+
+def parse_samples(items):
+    """Validate samples and route them to their table.
+
+    Args:
+        items: Iterable of {"id_var", "date", "value"} dicts or
+            [id_var, date, value] lists; date in epoch ms.
+
+    Returns:
+        List of (table, id_var, date, value) tuples. Non-string values of
+        string variables are JSON-encoded.
+    """
+    catalog = get_catalog()
+    rows = []
+    for item in items:
+        try:
+            if isinstance(item, dict):
+                id_var, date, value = item["id_var"], item["date"], item.get("value")
+            else:
+                id_var, date, value = item
+            id_var, date = int(id_var), int(date)
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"invalid sample {item!r}: expected id_var, date (epoch ms) and value")
+        entry = catalog.get(id_var)
+        if entry is not None:
+            table = entry.table
+        else:
+            numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+            table = "float" if numeric or value is None else "string"
+        if value is None or (table == "string" and isinstance(value, str)):
+            pass
+        elif table == "string":
+            value = json.dumps(value)
+        else:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"variable {id_var} expects a numeric value, got {value!r}")
+        rows.append((table, id_var, date, value))
+    return rows
+
+
+def copy_text(rows):
+    """COPY text format of (id_var, date, value) rows; NULL as \\N."""
+    lines = []
+    for id_var, date, value in rows:
+        if value is None:
+            text = "\\N"
+        elif isinstance(value, str):
+            text = value.translate(_ESCAPES)
+        else:
+            text = repr(value)
+        lines.append(f"{id_var}\t{date}\t{text}\n")
+    return "".join(lines)
+
+
+class CopyWriter:
+    """Writes batches with COPY on one connection, reopened after errors.
+
+    Args:
+        dsn: libpq DSN; INGEST_DSN by default.
+        copy_sql: COPY statement per table; COPY_SQL by default.
+    """
+
+    def __init__(self, dsn=None, copy_sql=None):
+        self.dsn = dsn or INGEST_DSN
+        self.copy_sql = copy_sql or COPY_SQL
+        self._conn = None
+
+    def write(self, table, rows):
+        """COPY one batch of (id_var, date, value) rows in one transaction."""
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(self.dsn)
+        try:
+            with self._conn.cursor() as cursor:
+                cursor.copy_expert(self.copy_sql[table], io.StringIO(copy_text(rows)))
+            self._conn.commit()
+        except TRANSIENT_ERRORS:
+            self.close()
+            raise
+        except Exception:
+            self._conn.rollback()
+            raise
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+            self._conn = None
+
+
+class NullWriter:
+    """Discards batches; measures the ingestion path without a database."""
+
+    def write(self, table, rows):
+        pass
+
+    def close(self):
+        pass
+
+
+class Ingestor:
+    """Bounded buffer of samples drained by a background COPY writer."""
+
+    def __init__(self, writer, queue_rows=QUEUE_ROWS, batch_rows=BATCH_ROWS,
+                 flush_ms=FLUSH_MS, retries=RETRIES):
+        """
+        Args:
+            writer: Object with `write(table, rows)` and `close()`, e.g.
+                CopyWriter or NullWriter.
+            queue_rows: Rows accepted but not yet written.
+            batch_rows: Rows per batch.
+            flush_ms: Longest time a row waits before its batch is written.
+            retries: Retries of a batch after connection errors.
+        """
+        self.writer = writer
+        self.queue_rows = queue_rows
+        self.batch_rows = batch_rows
+        self.flush_s = flush_ms / 1000
+        self.retries = retries
+        self._cond = threading.Condition()
+        self._buffers = {table: [] for table in TABLES}
+        self._oldest = {table: None for table in TABLES}
+        self._pending = 0
+        self._stopping = False
+        self._thread = None
+        self._recent = deque()
+        self.counters = {"accepted": 0, "written": 0, "batches": 0, "retries": 0,
+                         "rejected": 0, "waits": 0, "failed": 0}
+        self.written = {table: 0 for table in TABLES}
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        """Write what is buffered, then stop the writer thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.writer.close()
+
+    def submit(self, rows, timeout=SUBMIT_TIMEOUT_S):
+        """Queue rows from `parse_samples` for writing.
+
+        Args:
+            rows: List of (table, id_var, date, value) tuples.
+            timeout: Seconds to wait for room in the queue; None waits
+                indefinitely.
+
+        Returns:
+            Number of accepted rows.
+
+        Raises:
+            Backpressure: The queue stayed full for the whole timeout.
+        """
+        n = len(rows)
+        if n > self.queue_rows:
+            raise ValueError(f"at most {self.queue_rows} samples per request")
+        with self._cond:
+            if self._stopping:
+                raise Backpressure("ingestion is shutting down")
+            if self._pending + n > self.queue_rows:
+                self.counters["waits"] += 1
+                if not self._cond.wait_for(
+                        lambda: self._pending + n <= self.queue_rows or self._stopping, timeout):
+                    self.counters["rejected"] += n
+                    raise Backpressure(f"ingest queue full ({self._pending} rows pending)")
+                if self._stopping:
+                    raise Backpressure("ingestion is shutting down")
+            now = time.monotonic()
+            for table, id_var, date, value in rows:
+                self._buffers[table].append((id_var, date, value))
+                if self._oldest[table] is None:
+                    self._oldest[table] = now
+            self._pending += n
+            self.counters["accepted"] += n
+            self._cond.notify_all()
+        return n
+
+    def flush(self, timeout=None):
+        """Wait until every accepted row is written (or failed)."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def _ready(self, now):
+        return [table for table in TABLES if self._buffers[table] and (
+            self._stopping or len(self._buffers[table]) >= self.batch_rows
+            or now - self._oldest[table] >= self.flush_s)]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    ready = self._ready(now)
+                    if ready or (self._stopping and not self._pending):
+                        break
+                    waits = [self._oldest[t] + self.flush_s - now for t in TABLES if self._buffers[t]]
+                    self._cond.wait(min(waits) if waits else None)
+                if not ready:
+                    return
+                batches = []
+                for table in ready:
+                    buffer = self._buffers[table]
+                    batches.append((table, buffer[:self.batch_rows]))
+                    del buffer[:self.batch_rows]
+                    if not buffer:
+                        self._oldest[table] = None
+            for table, rows in batches:
+                self._write(table, rows)
+                with self._cond:
+                    self._pending -= len(rows)
+                    self._cond.notify_all()
+
+    def _write(self, table, rows):
+        for attempt in range(self.retries + 1):
+            try:
+                self.writer.write(table, rows)
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.retries:
+                    self._dead_letter(table, rows, e)
+                    return
+                with self._cond:
+                    self.counters["retries"] += 1
+                time.sleep(min(0.1 * 2 ** attempt, 5))
+            except Exception as e:
+                self._dead_letter(table, rows, e)
+                return
+            else:
+                with self._cond:
+                    self.counters["written"] += len(rows)
+                    self.counters["batches"] += 1
+                    self.written[table] += len(rows)
+                    self._recent.append((time.monotonic(), len(rows)))
+                return
+
+    def _dead_letter(self, table, rows, error):
+        with self._cond:
+            self.counters["failed"] += len(rows)
+        print(f"ingest: {len(rows)} {table} rows failed ({error})", file=sys.stderr)
+        try:
+            os.makedirs(FAILED_DIR, exist_ok=True)
+            path = os.path.join(FAILED_DIR, f"{table}_{time.time_ns()}.tsv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(copy_text(rows))
+        except OSError as e:
+            print(f"ingest: could not save failed batch ({e})", file=sys.stderr)
+
+    def stats(self):
+        """Counters, queue fill and rows written per second recently."""
+        with self._cond:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0][0] > RATE_WINDOW_S:
+                self._recent.popleft()
+            recent = sum(n for _, n in self._recent)
+            return {
+                **self.counters,
+                "written_per_table": dict(self.written),
+                "pending": self._pending,
+                "capacity": self.queue_rows,
+                "rows_per_s": round(recent / RATE_WINDOW_S, 1),
+            }
+
+
+# --- Command line -------------------------------------------------------------
+
+def create_scratch_table(dsn, name):
+    """Create (or empty) a scratch copy of variable_log_float; returns its COPY statements."""
+    if not _TABLE_NAME.match(name) or name.startswith("variable_log_"):
+        raise ValueError(f"invalid scratch table name {name!r}")
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS public.{name}"
+                           " (LIKE public.variable_log_float INCLUDING ALL);")
+            cursor.execute(f"TRUNCATE public.{name};")
+        conn.commit()
+    finally:
+        conn.close()
+    return {"float": f"COPY public.{name} (id_var, date, value) FROM STDIN"}
+
+
+def drop_scratch_table(dsn, name):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS public.{name};")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load_test(ingestor, rows, producers, chunk, ids):
+    """Push synthetic float samples from producer threads and measure.
+
+    Every producer submits `chunk` rows at a time and blocks while the queue
+    is full, so the measured rate is what the writer sustains.
+
+    Returns:
+        Dict with rows, elapsed_s, rows_per_s and the ingestor counters.
+    """
+    base = int(time.time() * 1000)
+    per_producer = rows // producers
+
+    def produce(p):
+        id_var = ids[p % len(ids)]
+        offset = p * per_producer
+        for first in range(0, per_producer, chunk):
+            count = min(chunk, per_producer - first)
+            batch = [("float", id_var, base + offset + first + i, 20.0 + (first + i) % 1000 / 100)
+                     for i in range(count)]
+            ingestor.submit(batch, timeout=None)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=produce, args=(p,)) for p in range(producers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ingestor.flush()
+    elapsed = time.perf_counter() - start
+    stats = ingestor.stats()
+    return {**stats, "rows": per_producer * producers, "elapsed_s": round(elapsed, 2),
+            "rows_per_s": round(stats["written"] / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched COPY ingestion of machine samples.")
+    parser.add_argument("--dsn", default=INGEST_DSN, help="writing connection (default INGEST_DSN)")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--flush-ms", type=int, default=FLUSH_MS)
+    parser.add_argument("--queue-rows", type=int, default=QUEUE_ROWS)
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("loadtest", help="measure sustained rows per second")
+    load.add_argument("--rows", type=int, default=1_000_000)
+    load.add_argument("--producers", type=int, default=4)
+    load.add_argument("--chunk", type=int, default=1000, help="rows per submit")
+    load.add_argument("--ids", default=str(LOADTEST_ID), help="comma-separated synthetic variable ids")
+    load.add_argument("--table", default=LOADTEST_TABLE, help="scratch table written to")
+    load.add_argument("--keep", action="store_true", help="keep the scratch table afterwards")
+    load.add_argument("--dry-run", action="store_true", help="discard batches instead of writing")
+    commands.add_parser("pipe", help="ingest JSON-line samples from stdin")
+    args = parser.parse_args()
+
+    dry_run = getattr(args, "dry_run", False)
+    if not dry_run and not args.dsn:
+        parser.error("set INGEST_DSN or pass --dsn (or use loadtest --dry-run)")
+    scratch = args.command == "loadtest" and not dry_run
+    if scratch:
+        try:
+            writer = CopyWriter(args.dsn, create_scratch_table(args.dsn, args.table))
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        writer = NullWriter() if dry_run else CopyWriter(args.dsn)
+    ingestor = Ingestor(writer, args.queue_rows, args.batch_rows, args.flush_ms)
+    ingestor.start()
+    try:
+        if args.command == "loadtest":
+            ids = [int(i) for i in args.ids.split(",")]
+            result = load_test(ingestor, args.rows, max(1, args.producers), args.chunk, ids)
+            print(json.dumps(result, indent=2))
+        else:
+            chunk = []
+            for line in sys.stdin:
+                if line.strip():
+                    chunk.append(json.loads(line))
+                if len(chunk) >= args.batch_rows:
+                    ingestor.submit(parse_samples(chunk), timeout=None)
+                    chunk = []
+            if chunk:
+                ingestor.submit(parse_samples(chunk), timeout=None)
+            ingestor.flush()
+            print(json.dumps(ingestor.stats(), indent=2))
+    finally:
+        ingestor.stop()
+        if scratch and not args.keep:
+            drop_scratch_table(args.dsn, args.table)
+
+
+if __name__ == "__main__":
+    main()
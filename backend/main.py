@@ -1,9 +1,29 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import Body, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
+import threading
+import uuid
 
-from backend.database import get_connection
 import backend.services as services
+import backend.anomalies as anomalies
+import backend.motifs as motifs
+import backend.catalog as catalog
+import backend.influence as influence
+import backend.sketches as sketches
+import backend.alarm_sequences as alarm_sequences
+import backend.quality as quality
+import backend.programs as programs
+import backend.hotstore as hotstore
+import backend.fleet as fleet
+import backend.warmup as warmup
+import backend.ingest as ingest
+import backend.profiling as profiling
+from backend.cache import MISSING, OPEN_TTL_S, is_closed, result_cache, ttl_for
+from backend.responses import json_response
+from backend.governor import Downgraded, Rejected, governor
+from backend.singleflight import SingleFlight
 
 # Run with:
 # uvicorn backend.main:app --reload
@@ -13,33 +33,142 @@ origins = [
     "http://localhost:5173",
     "http://127.0.0.1:5173"]
 
-db_conn = None
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global db_conn
-    db_conn = get_connection()
-    print("Database connection established")
+    catalog.get_catalog()
+
+    # Fill the hot store in the background; services fall back to SQL
+    # until the requested range is covered.
+    stop_loader = threading.Event()
+    threading.Thread(target=hotstore.run_loader, args=(stop_loader,), daemon=True).start()
+    # Extend the program run index; /api/program_stats only reads it.
+    threading.Thread(target=programs.run_indexer, args=(stop_loader,), daemon=True).start()
+    # Precompute the dashboard for recent days without delaying startup.
+    warmer.start(warmup.WARMUP_DAYS)
+    if ingestor:
+        ingestor.start()
     try: 
         yield
     finally:
-        if db_conn:
-            db_conn.close()
-            print("Database connection closed")
+        stop_loader.set()
+        warmer.stop()
+        if ingestor:
+            ingestor.stop()
+        fleet.close_pools()
+        motifs.close_pools()
+        governor.close()
 
 app = FastAPI(lifespan=lifespan)
 
+flight = SingleFlight()
+
+
+def _key(fn, args, kwargs):
+    return (f"{fn.__module__}.{fn.__name__}",) + args + tuple(sorted(kwargs.items()))
+
+
+def _incomplete(result):
+    """Whether a result says it does not cover its range yet."""
+    return isinstance(result, dict) and result.get("complete") is False
+
+
+def _cached(conn, fn, *args, **kwargs):
+    """Return a cached result or compute it once under the query governor,
+    coalescing identical concurrent calls into one query. With conn None
+    the governor borrows a pooled connection. Incomplete results expire
+    like open days; downgraded results are not cached, so the requested
+    arguments are not answered with cheaper ones for a whole TTL."""
+    key = _key(fn, args, kwargs)
+    profiled = profiling.active() is not None
+    result = MISSING if profiled else result_cache.get(key)
+    if result is MISSING:
+        if profiled:
+            # Computed on this thread, so the profile shows the actual work.
+            result = governor.run(conn, fn, *args, **kwargs)
+        else:
+            result = flight.do(key, governor.run, conn, fn, *args, **kwargs)
+        if isinstance(result, Downgraded):
+            return result
+        result_cache.put(key, result, OPEN_TTL_S if _incomplete(result) else ttl_for(args))
+    return result
+
+
+def _precompute(conn, fn, *args):
+    if _key(fn, args, {}) not in result_cache:
+        _cached(conn, fn, *args)
+
+
+warmer = warmup.Warmer(_precompute)
+
+# Writes samples posted to /api/ingest; disabled without a writing DSN.
+ingestor = ingest.Ingestor(ingest.CopyWriter()) if ingest.INGEST_DSN else None
+
+
+def _shared(fn, *args, **kwargs):
+    """Run a service call through the result cache and the query governor.
+
+    Dashboard calls also queue the neighbouring days for warm-up.
+    """
+    if fn in warmup.DASHBOARD_CALLS:
+        warmer.prefetch_adjacent(args[0])
+    return _cached(None, fn, *args, **kwargs)
+
+
+def _respond(request, fn, *args, **kwargs):
+    """Run a service call through `_shared` and return the result as a
+    compressed JSON response with an ETag; past days are cacheable.
+    Calls refused by the governor get its status code (400 or 503);
+    downgraded calls name the arguments used in X-Effective-* headers.
+    In profiled requests this thread is sampled by the profiler."""
+    try:
+        with profiling.track():
+            result = _shared(fn, *args, **kwargs)
+    except Rejected as e:
+        headers = {"Retry-After": "5"} if e.status_code == 503 else None
+        return JSONResponse({"detail": str(e)}, status_code=e.status_code, headers=headers)
+    headers = None
+    if isinstance(result, Downgraded):
+        headers = {f"X-Effective-{name.capitalize()}": str(value) for name, value in result.changes.items()}
+        result = result.result
+    return json_response(request, result, closed=is_closed(args) and not _incomplete(result) and not headers,
+                         headers=headers)
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Profile requests carrying PROFILE_TOKEN (see backend.profiling)."""
+    if not profiling.authorized(request.headers, request.query_params):
+        return await call_next(request)
+    profile = profiling.Profile(request.headers.get("x-request-id") or uuid.uuid4().hex)
+    token = profile.start()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        profile.stop(token)
+        await run_in_threadpool(profile.save, request.method, request.url.path,
+                                str(request.query_params.__class__(
+                                    [(k, v) for k, v in request.query_params.multi_items() if k != "profile"])),
+                                status_code)
+    total_ms = (profile.finished - profile.started) * 1000
+    response.headers["X-Profile-Id"] = profile.request_id
+    response.headers["Server-Timing"] = (
+        f'sql;dur={profile.sql_ms():.1f};desc="{len(profile.sql)} queries", total;dur={total_ms:.1f}'
+    )
+    return response
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Effective-Bucket"],
 )
 
 
 @app.get("/api/daily_temp_avg")
-def get_daily_temp_avg(date: str = Query(...)):
+def get_daily_temp_avg(request: Request, date: str = Query(...)):
     """Return the average daily temperature for a given date.
 
     Args:
@@ -49,14 +178,12 @@ def get_daily_temp_avg(date: str = Query(...)):
         A dict with the date and average temperature value.
     """
     try:
-        return services.get_daily_average_temp(db_conn, date)
+        return _respond(request, services.get_daily_average_temp, date)
     except Exception as e:
-        db_conn.rollback()
-
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.get("/api/number_daily_alerts")
-def get_daily_alerts_number(date: str = Query(...)):
+def get_daily_alerts_number(request: Request, date: str = Query(...)):
     """Return the number of alert snapshots recorded on the given date.
 
     Args:
@@ -66,13 +193,12 @@ def get_daily_alerts_number(date: str = Query(...)):
         Dict with key 'num_alarms'.
     """
     try:
-        return services.get_number_daily_alerts(db_conn, date)
+        return _respond(request, services.get_number_daily_alerts, date)
     except Exception as e:
-        db_conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/critical_alerts")
-def get_critical_alerts_data(date: str = Query(...)):
+def get_critical_alerts_data(request: Request, date: str = Query(...)):
     """Return all critical alert events for the given date.
 
     Args:
@@ -82,13 +208,12 @@ def get_critical_alerts_data(date: str = Query(...)):
         List of dicts with timestamp and alert description.
     """
     try:
-        return services.get_critical_alerts(db_conn, date)
+        return _respond(request, services.get_critical_alerts, date)
     except Exception as e:
-        db_conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/daily_spindle_avg")
-def get_daily_spindle_avg(date: str = Query(...)):
+def get_daily_spindle_avg(request: Request, date: str = Query(...)):
     """Return the average daily spindle load for the given date.
 
     Args:
@@ -98,15 +223,13 @@ def get_daily_spindle_avg(date: str = Query(...)):
         Dict with average spindle load.
     """
     try:
-        return services.get_daily_average_spindle_load(db_conn, date)
+        return _respond(request, services.get_daily_average_spindle_load, date)
     except Exception as e:
-        db_conn.rollback()
-
         raise HTTPException(status_code=500, detail=str(e))
     
 
 @app.get("/api/hourly_spindle_avg")
-def get_hourly_spindle_avg(date: str = Query(...)):
+def get_hourly_spindle_avg(request: Request, date: str = Query(...)):
     """Return hourly average spindle load for the given date.
 
     Args:
@@ -116,13 +239,12 @@ def get_hourly_spindle_avg(date: str = Query(...)):
         List of hourly averages.
     """
     try:
-        return services.get_hourly_average_spindle_load(db_conn, date)
+        return _respond(request, services.get_hourly_average_spindle_load, date)
     except Exception as e:
-        db_conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/hourly_temp_avg")
-def get_hourly_temp_avg(date: str = Query(...)):
+def get_hourly_temp_avg(request: Request, date: str = Query(...)):
     """Return hourly average temperature for the given date.
 
     Args:
@@ -132,13 +254,12 @@ def get_hourly_temp_avg(date: str = Query(...)):
         List of hourly averages.
     """
     try:
-        return services.get_hourly_average_temp(db_conn, date)
+        return _respond(request, services.get_hourly_average_temp, date)
     except Exception as e:
-        db_conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.get("/api/hourly_combined")
-def get_hourly_combined(date: str = Query(...)):
+def get_hourly_combined(request: Request, date: str = Query(...)):
     """Return hourly averages of both temperature and spindle load.
 
     Args:
@@ -148,13 +269,12 @@ def get_hourly_combined(date: str = Query(...)):
         List of dicts with hour, avg_temp, and avg_spindle.
     """
     try:
-        return services.get_hourly_combined_stats(db_conn, date)
+        return _respond(request, services.get_hourly_combined_stats, date)
     except Exception as e:
-        db_conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.get("/api/energy_usage")
-def get_energy_usage(date: str = Query(...)):
+def get_energy_usage(request: Request, date: str = Query(...)):
     """Return ....
 
     Args:
@@ -162,14 +282,328 @@ def get_energy_usage(date: str = Query(...)):
     Returns:
     """
     try:
-        return services.get_energy_usage(db_conn, date)
+        return _respond(request, services.get_energy_usage, date)
     except Exception as e:
-        db_conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/energy_usage/daily")
-def get_daily_energy_avg(date: str = Query(...)):
+def get_daily_energy_avg(request: Request, date: str = Query(...)):
     try:
-        return services.get_daily_average_power(db_conn, date)
+        return _respond(request, services.get_daily_average_power, date)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/anomalies")
+def get_anomalies(request: Request, start: str = Query(...), end: str = Query(...)):
+    """Return anomalies on motor temperatures and axis utilization.
+
+    Args:
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+
+    Returns:
+        List of dicts with id_var, name, log_time, value and the rolling,
+        EWMA and MAD scores.
+    """
+    try:
+        return _respond(request, anomalies.get_anomalies, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/motifs")
+def get_motifs(request: Request, start: str = Query(...), end: str = Query(...),
+               id_var: int | None = Query(None),
+               window: int = Query(motifs.DEFAULT_WINDOW, ge=4, le=2000),
+               k: int = Query(3, ge=1, le=20)):
+    """Return repeated patterns (motifs) and unusual patterns (discords).
+
+    Args:
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        id_var: Variable id, spindle load (630) by default.
+        window: Pattern length in 10-second samples.
+        k: Number of motifs and discords to return.
+
+    Returns:
+        Dict with the top motifs and discords and their start times.
+    """
+    try:
+        return _respond(request, motifs.get_motifs, start, end, id_var=id_var, window=window, k=k)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/variables")
+def get_variables(request: Request):
+    """Return the variable catalog.
+
+    Returns:
+        List of dicts with id, name, label, unit, table, sample_rate_hz and key.
+    """
+    return json_response(request, catalog.list_variables())
+
+
+@app.get("/api/aggregate")
+def get_aggregate(request: Request, ids: str = Query(...),
+                  start: str = Query(...), end: str = Query(...),
+                  bucket: str = Query("hour"), aggs: str = Query("avg")):
+    """Return any set of aggregates for many variables in one grouped scan.
+
+    Args:
+        ids: Comma-separated variable ids, e.g. 618,630.
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        bucket: 1m, 5m, 15m, 30m, hour, day or none.
+        aggs: Comma-separated aggregates: avg, min, max, sum, count, stddev,
+            p50, p95, p99.
+
+    Returns:
+        List of dicts with id_var, bucket and one key per aggregate. When
+        the requested bucket is too expensive a coarser one is used and
+        named in the X-Effective-Bucket header.
+    """
+    try:
+        return _respond(request, catalog.aggregate, ids, start, end, bucket, aggs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/percentiles")
+def get_percentiles(request: Request, id_var: int = Query(...),
+                    start: str = Query(...), end: str = Query(...),
+                    bucket: str = Query("hour"), qs: str = Query("p50,p95")):
+    """Return percentiles of a variable per hour, day or whole range.
+
+    Percentiles are merged from stored hourly t-digest sketches, so long
+    ranges do not scan raw rows.
+
+    Args:
+        id_var: Numeric variable id, e.g. 630 for spindle load.
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        bucket: hour, day or none.
+        qs: Comma-separated quantiles: p01, p05, p25, p50, p75, p90, p95, p99.
+
+    Returns:
+        List of dicts with bucket, count, min, max, mean and one key per
+        quantile.
+    """
+    try:
+        return _respond(request, sketches.get_percentiles, id_var, start, end, bucket, qs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/alarm_precursors")
+def get_alarm_precursors(request: Request, start: str = Query(...), end: str = Query(...),
+                         critical: str | None = Query(None),
+                         window_min: int = Query(alarm_sequences.WINDOW_MIN, ge=1, le=240),
+                         min_support: float = Query(0.1, gt=0, le=1),
+                         max_len: int = Query(3, ge=1, le=6),
+                         top: int = Query(20, ge=1, le=200)):
+    """Return frequent alarm sequences that precede critical alarms.
+
+    Args:
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        critical: One critical alarm message; all critical types by default.
+        window_min: Minutes before each critical alarm searched for precursors.
+        min_support: Minimum fraction of critical alarms preceded by a pattern.
+        max_len: Maximum pattern length.
+        top: Patterns returned per critical type.
+
+    Returns:
+        List of dicts with critical, events and patterns (sequence, count,
+        support, median_lead_s).
+    """
+    try:
+        return _respond(request, alarm_sequences.get_alarm_precursors, start, end, critical,
+                        window_min, min_support, max_len, top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/data_quality")
+def get_data_quality(request: Request, id_var: int = Query(...),
+                     start: str = Query(...), end: str = Query(...),
+                     mode: str = Query("raw"), gap_s: float | None = Query(None, gt=0)):
+    """Return gaps, duplicates, sampling-rate changes and stuck runs of a variable.
+
+    Args:
+        id_var: Catalogued variable id.
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        mode: raw (exact) or counts (per-hour counts, cheaper).
+        gap_s: Gap threshold in seconds; from the nominal sample rate by default.
+
+    Returns:
+        Dict with score, days (per-day coverage and quality score), gaps,
+        rate_changes and stuck.
+    """
+    try:
+        return _respond(request, quality.get_data_quality, id_var, start, end, mode, gap_s)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/program_stats")
+def get_program_stats(request: Request, start: str = Query(...), end: str = Query(...),
+                      program: str | None = Query(None)):
+    """Return runs, cycle time and spindle energy per NC program.
+
+    Args:
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        program: One program name; its individual runs are included.
+
+    Returns:
+        Dict with programs (runs, total_h, mean/min/max cycle_s, kwh,
+        kwh_per_run, spindle_h), indexed_until, complete and, with
+        program, runs.
+    """
+    try:
+        return _respond(request, programs.get_program_stats, start, end, program)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/influence")
+def get_influence(request: Request, date: str = Query(...), state: str = Query("ON"),
+                  id_var: int | None = Query(None), top: int = Query(20, ge=1, le=500)):
+    """Return the strongest lagged correlations between variables for a day.
+
+    Args:
+        date: ISO date string YYYY-MM-DD.
+        state: Operation state: ON, IDLE or OFF.
+        id_var: Optional variable id; only pairs led by this variable.
+        top: Number of pairs to return.
+
+    Returns:
+        List of dicts with source, target, lag_s, corr and n.
+    """
+    try:
+        return _respond(request, influence.get_influence, date, state, id_var, top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/machines")
+def get_machines(request: Request):
+    """Return the registered machines.
+
+    Returns:
+        List of dicts with id and label.
+    """
+    return json_response(request, fleet.list_machines())
+
+
+@app.get("/api/machines/{machine_id}/kpis")
+def get_machine_kpis(request: Request, machine_id: str, date: str = Query(...)):
+    """Return the daily KPIs of one machine, queried on its own database.
+
+    Args:
+        machine_id: Machine id from the registry.
+        date: ISO date string YYYY-MM-DD.
+
+    Returns:
+        Dict with avg_temp, avg_spindle, avg_power_kW, sample counts and
+        alarm counts.
+    """
+    if machine_id not in fleet.get_machines():
+        raise HTTPException(status_code=404, detail=f"unknown machine '{machine_id}'")
+    try:
+        result = fleet.run_on(machine_id, fleet.machine_kpis, date, timeout_s=fleet.DEADLINE_S)
+        return json_response(request, result, closed=is_closed((date,)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/fleet/kpis")
+def get_fleet_kpis(request: Request, date: str = Query(...),
+                   deadline_s: float = Query(fleet.DEADLINE_S, gt=0, le=60)):
+    """Return daily KPIs of all machines and of the whole fleet.
+
+    All machines are queried concurrently; machines that do not answer
+    within the deadline are reported as 'timeout' and left out of the
+    fleet KPIs.
+
+    Args:
+        date: ISO date string YYYY-MM-DD.
+        deadline_s: Seconds to wait for the machines.
+
+    Returns:
+        Dict with date, fleet (merged KPIs), machines (per-machine status
+        and KPIs) and complete.
+    """
+    try:
+        result = fleet.get_fleet_kpis(date, deadline_s)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return json_response(request, result, closed=result["complete"] and is_closed((date,)))
+
+
+@app.post("/api/ingest", status_code=202)
+def post_ingest(request: Request, samples: list = Body(...)):
+    """Queue samples for batched insertion into the variable log tables.
+
+    The samples are written asynchronously with COPY within
+    INGEST_FLUSH_MS. When the ingest queue stays full the request is
+    refused with 503 and a Retry-After header, and should be resent.
+    Callers must send INGEST_TOKEN in the X-Ingest-Token header.
+
+    Args:
+        samples: JSON list of {"id_var", "date", "value"} objects or
+            [id_var, date, value] lists, date in epoch ms.
+
+    Returns:
+        Dict with the number of accepted samples.
+    """
+    if ingestor is None or not ingest.INGEST_TOKEN:
+        raise HTTPException(status_code=503, detail="ingestion is disabled (INGEST_DSN or INGEST_TOKEN is not set)")
+    if not ingest.authorized(request.headers):
+        raise HTTPException(status_code=401, detail="missing or invalid X-Ingest-Token")
+    try:
+        return {"accepted": ingestor.submit(ingest.parse_samples(samples))}
+    except ingest.Backpressure as e:
+        return JSONResponse({"detail": str(e)}, status_code=e.status_code, headers={"Retry-After": "1"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    """Return runtime counters of the caches, coalescing, warm-up and governor.
+
+    Returns:
+        Dict with 'singleflight' (executed/coalesced calls per service
+        function), 'result_cache' (entries, hits, misses), 'warmup'
+        (pending and warmed days), 'governor' (running, rejected, timed-out
+        and downgraded calls per query class) and 'hot_store' (hits,
+        misses, memory use) and 'ingest' (queued, written, retried and
+        failed samples, recent rows per second; None when disabled).
+    """
+    return {
+        "singleflight": flight.stats(),
+        "governor": governor.stats(),
+        "result_cache": result_cache.stats(),
+        "warmup": warmer.stats(),
+        "hot_store": hotstore.hot_store.stats(),
+        "ingest": ingestor.stats() if ingestor else None,
+    }
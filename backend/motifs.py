@@ -0,0 +1,390 @@
+"""Motif and discord discovery with a matrix profile.
+
+The matrix profile of a series stores, for every subsequence of length `m`,
+the z-normalized Euclidean distance to its nearest non-trivial neighbour.
+Low values are repeated patterns (motifs), high values are patterns that
+occur nowhere else (discords).
+
+The computation follows STOMP: the first distance profile of each block of
+rows is computed with MASS (sliding dot products through the FFT) and the
+following rows reuse the previous dot products with an O(n) update. Blocks
+of rows are independent, so they are spread over a process pool. Pools
+are created once per size and reused by every call (API requests
+included) until `close_pools` is called at application shutdown.
+
+`StreamingMatrixProfile` keeps a profile up to date as new samples arrive
+(STAMPI): each new subsequence costs one MASS call instead of a full
+recomputation.
+
+Subsequences with a constant value (e.g. spindle load while the machine is
+idle) have no shape after z-normalization; they are excluded from the
+profile and reported as NaN.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from backend.alignment import align_asof, make_grid
+from backend.catalog import id_of
+
+STEP_MS = 10_000         # default resampling step for the API (10 s)
+DEFAULT_WINDOW = 60      # subsequence length in samples (10 min at 10 s)
+PARALLEL_MIN_ROWS = 20_000
+FLAT_STD = 1e-8          # std below which a subsequence is considered flat
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def sliding_stats(ts, m):
+    """Mean and standard deviation of every length-m subsequence.
+
+    Args:
+        ts: 1D float64 array.
+        m: Subsequence length.
+
+    Returns:
+        Tuple (means, stds), each of length len(ts) - m + 1.
+    """
+    # Centre first so the cumulative sums stay small on long series.
+    offset = ts.mean() if len(ts) else 0.0
+    centred = ts - offset
+    c1 = np.concatenate([[0.0], np.cumsum(centred)])
+    c2 = np.concatenate([[0.0], np.cumsum(centred * centred)])
+    means = (c1[m:] - c1[:-m]) / m
+    stds = np.sqrt(np.maximum((c2[m:] - c2[:-m]) / m - means * means, 0.0))
+
+    # Rounding in the cumulative sums leaves tiny non-zero stds on constant
+    # stretches; detect those exactly.
+    windows = np.lib.stride_tricks.sliding_window_view(ts, m)
+    stds[windows.max(axis=1) == windows.min(axis=1)] = 0.0
+    return means + offset, stds
+
+
+def sliding_dot_product(query, ts):
+    """Dot product of `query` with every subsequence of `ts`, via the FFT.
+
+    Args:
+        query: 1D array of length m.
+        ts: 1D array of length n >= m.
+
+    Returns:
+        Array of length n - m + 1.
+    """
+    n, m = len(ts), len(query)
+    size = 1 << (n + m - 1).bit_length()
+    product = np.fft.irfft(np.fft.rfft(ts, size) * np.fft.rfft(query[::-1], size), size)
+    return product[m - 1:n]
+
+
+def _distance_from_dot(qt, m, mean_q, std_q, means, stds):
+    """Z-normalized distances from dot products; inf against flat subsequences."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = (qt - m * mean_q * means) / (m * std_q * stds)
+    dist = np.sqrt(np.maximum(2 * m * (1 - np.clip(corr, -1.0, 1.0)), 0.0))
+    dist[stds < FLAT_STD] = np.inf
+    return dist
+
+
+def mass(query, ts, means=None, stds=None):
+    """Distance profile of `query` against every subsequence of `ts` (MASS).
+
+    Args:
+        query: 1D array of length m.
+        ts: 1D float64 array.
+        means: Optional precomputed subsequence means of `ts`.
+        stds: Optional precomputed subsequence stds of `ts`.
+
+    Returns:
+        Array of length len(ts) - m + 1 with z-normalized distances; inf
+        for flat subsequences, and all inf if `query` itself is flat.
+    """
+    m = len(query)
+    if means is None or stds is None:
+        means, stds = sliding_stats(ts, m)
+    std_q = query.std()
+    if std_q < FLAT_STD:
+        return np.full(len(ts) - m + 1, np.inf)
+    return _distance_from_dot(sliding_dot_product(query, ts), m, query.mean(), std_q, means, stds)
+
+
+def _stomp_block(args):
+    """Matrix profile rows [start, stop) of a self-join (process pool task)."""
+    ts, m, start, stop, exclusion = args
+    means, stds = sliding_stats(ts, m)
+    k = len(ts) - m + 1
+    profile = np.full(stop - start, np.inf)
+    index = np.full(stop - start, -1, dtype=np.int64)
+
+    # Dot products of the first subsequence with all others; used to seed
+    # the first column of every row's update.
+    first_row_qt = sliding_dot_product(ts[:m], ts)
+    qt = sliding_dot_product(ts[start:start + m], ts)
+
+    for i in range(start, stop):
+        if i > start:
+            qt[1:] = qt[:-1] - ts[i - 1] * ts[:k - 1] + ts[i + m - 1] * ts[m:m + k - 1]
+            qt[0] = first_row_qt[i]
+        if stds[i] < FLAT_STD:
+            continue
+        dist = _distance_from_dot(qt, m, means[i], stds[i], means, stds)
+        dist[max(0, i - exclusion):i + exclusion + 1] = np.inf
+        j = int(np.argmin(dist))
+        profile[i - start] = dist[j]
+        index[i - start] = j if np.isfinite(dist[j]) else -1
+
+    return profile, index
+
+
+def _pool(n_jobs):
+    with _pools_lock:
+        pool = _pools.get(n_jobs)
+        if pool is None:
+            pool = _pools[n_jobs] = ProcessPoolExecutor(max_workers=n_jobs)
+        return pool
+
+
+def close_pools():
+    """Shut down the worker processes (at application shutdown)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def matrix_profile(ts, m, n_jobs=None):
+    """Self-join matrix profile of a series.
+
+    Args:
+        ts: 1D array, regularly sampled, without NaN.
+        m: Subsequence length.
+        n_jobs: Worker processes; None uses all cores for long series and
+            runs in-process for short ones.
+
+    Returns:
+        Tuple (profile, index): float64 distances (NaN for flat
+        subsequences) and int64 nearest-neighbour positions (-1 if none).
+    """
+    ts = np.ascontiguousarray(ts, dtype=np.float64)
+    if len(ts) < 2 * m:
+        raise ValueError("series must be at least twice the window length")
+    k = len(ts) - m + 1
+    exclusion = int(np.ceil(m / 4))
+
+    if n_jobs is None:
+        n_jobs = (os.cpu_count() or 1) if k >= PARALLEL_MIN_ROWS else 1
+
+    bounds = np.linspace(0, k, n_jobs * 4 + 1 if n_jobs > 1 else 2).astype(int)
+    tasks = [(ts, m, a, b, exclusion) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+    if n_jobs > 1:
+        parts = list(_pool(n_jobs).map(_stomp_block, tasks))
+    else:
+        parts = [_stomp_block(task) for task in tasks]
+
+    profile = np.concatenate([p for p, _ in parts])
+    index = np.concatenate([i for _, i in parts])
+    profile[~np.isfinite(profile)] = np.nan
+    return profile, index
+
+
+class StreamingMatrixProfile:
+    """Matrix profile that is updated incrementally as samples arrive."""
+
+    def __init__(self, ts, m, n_jobs=None):
+        self.m = m
+        self.exclusion = int(np.ceil(m / 4))
+        self.ts = np.asarray(ts, dtype=np.float64).copy()
+        self.profile, self.index = matrix_profile(self.ts, m, n_jobs=n_jobs)
+
+    def append(self, values):
+        """Add new samples and update the profile.
+
+        Every new subsequence gets its own distance profile, which also
+        lowers the profile of older subsequences it is closer to.
+
+        Args:
+            values: Iterable of new samples, in time order.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        self.ts = np.concatenate([self.ts, values])
+        m = self.m
+        means, stds = sliding_stats(self.ts, m)
+        k = len(self.ts) - m + 1
+        old = len(self.profile)
+
+        profile = np.full(k, np.inf)
+        profile[:old] = np.where(np.isnan(self.profile), np.inf, self.profile)
+        index = np.full(k, -1, dtype=np.int64)
+        index[:old] = self.index
+
+        for i in range(old, k):
+            if stds[i] < FLAT_STD:
+                continue
+            dist = _distance_from_dot(
+                sliding_dot_product(self.ts[i:i + m], self.ts[:i + m]),
+                m, means[i], stds[i], means[:i + 1], stds[:i + 1],
+            )
+            dist[max(0, i - self.exclusion):] = np.inf
+            j = int(np.argmin(dist))
+            if np.isfinite(dist[j]):
+                profile[i], index[i] = dist[j], j
+            closer = dist < profile[:i + 1]
+            profile[:i + 1][closer] = dist[closer]
+            index[:i + 1][closer] = i
+
+        profile[~np.isfinite(profile)] = np.nan
+        self.profile, self.index = profile, index
+
+
+def find_motifs(profile, index, k=3, exclusion=None):
+    """Pick the top-k motif pairs from a matrix profile.
+
+    Args:
+        profile: Matrix profile distances (NaN ignored).
+        index: Nearest-neighbour positions.
+        k: Number of motifs to return.
+        exclusion: Positions around a chosen motif that cannot be chosen
+            again (defaults to 1).
+
+    Returns:
+        List of (position, neighbour, distance) tuples, best first.
+    """
+    return _top_k(profile, index, k, exclusion, largest=False)
+
+
+def find_discords(profile, index, k=3, exclusion=None):
+    """Pick the top-k discords (most isolated subsequences).
+
+    Args:
+        profile: Matrix profile distances (NaN ignored).
+        index: Nearest-neighbour positions.
+        k: Number of discords to return.
+        exclusion: Positions around a chosen discord that cannot be chosen again.
+
+    Returns:
+        List of (position, neighbour, distance) tuples, most unusual first.
+    """
+    return _top_k(profile, index, k, exclusion, largest=True)
+
+
+def _top_k(profile, index, k, exclusion, largest):
+    order = np.argsort(-profile if largest else profile, kind="stable")
+    order = order[~np.isnan(profile[order])]
+    exclusion = exclusion or 1
+    taken = np.zeros(len(profile), dtype=bool)
+    found = []
+    for pos in order:
+        if taken[pos]:
+            continue
+        nn = int(index[pos])
+        found.append((int(pos), nn, float(profile[pos])))
+        taken[max(0, pos - exclusion):pos + exclusion + 1] = True
+        if nn >= 0:
+            taken[max(0, nn - exclusion):nn + exclusion + 1] = True
+        if len(found) == k:
+            break
+    return found
+
+
+def fetch_series(db_conn, id_var, start_ms, end_ms, step_ms=STEP_MS):
+    """Fetch one variable resampled to a regular grid.
+
+    Buckets are averaged in SQL; empty buckets carry the last observation
+    forward (leading gaps take the first observed value).
+
+    Args:
+        db_conn: PostgreSQL connection.
+        id_var: Variable id.
+        start_ms: Inclusive start in epoch ms.
+        end_ms: Exclusive end in epoch ms.
+        step_ms: Grid step in ms.
+
+    Returns:
+        Tuple (timestamps, values) as int64 epoch ms and float64 arrays;
+        both empty if the variable has no data in the range.
+    """
+    first = start_ms - start_ms % step_ms
+    with db_conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT (date / %s) * %s AS bucket, AVG(value) AS avg_value
+            FROM public.variable_log_float
+            WHERE id_var = %s
+              AND date >= %s
+              AND date < %s
+            GROUP BY bucket;
+        """, (step_ms, step_ms, id_var, first, end_ms))
+        rows = cursor.fetchall()
+
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    timestamps = make_grid(first, end_ms, step_ms)
+    _, matrix = align_asof(
+        np.full(len(rows), id_var),
+        [row["bucket"] for row in rows],
+        [row["avg_value"] for row in rows],
+        timestamps,
+    )
+    values = matrix[:, 0].astype(np.float64)
+    first_valid = np.argmax(~np.isnan(values))
+    values[:first_valid] = values[first_valid]
+    return timestamps, values
+
+
+def get_motifs(db_conn, start, end, id_var=None, window=DEFAULT_WINDOW, k=3, step_ms=STEP_MS):
+    """Find the top motifs and discords of a variable over a date range.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        id_var: Variable id; None for spindle load.
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        window: Subsequence length in samples of `step_ms`.
+        k: Number of motifs and of discords to return.
+        step_ms: Resampling step in ms.
+
+    Returns:
+        Dict with id_var, window_s and lists 'motifs' and 'discords' of
+        dicts with start, neighbour_start and distance.
+    """
+    try:
+        if id_var is None:
+            id_var = id_of("spindle_load")
+        start_date = datetime.strptime(start, "%Y-%m-%d")
+        end_date = datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1)
+        if end_date <= start_date:
+            raise ValueError("end must not be before start")
+
+        timestamps, values = fetch_series(
+            db_conn, id_var,
+            int(start_date.timestamp() * 1000), int(end_date.timestamp() * 1000), step_ms,
+        )
+        result = {"id_var": id_var, "window_s": window * step_ms / 1000, "motifs": [], "discords": []}
+        if len(values) < 2 * window:
+            return result
+
+        profile, index = matrix_profile(values, window)
+        exclusion = window // 2
+
+        def as_dict(pos, nn, dist):
+            return {
+                "start": datetime.fromtimestamp(timestamps[pos] / 1000).astimezone(),
+                "neighbour_start": (
+                    datetime.fromtimestamp(timestamps[nn] / 1000).astimezone() if nn >= 0 else None
+                ),
+                "distance": round(dist, 3),
+            }
+
+        result["motifs"] = [as_dict(*hit) for hit in find_motifs(profile, index, k, exclusion)]
+        result["discords"] = [as_dict(*hit) for hit in find_discords(profile, index, k, exclusion)]
+        return result
+    except Exception as e:
+        raise e
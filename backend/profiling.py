@@ -0,0 +1,198 @@
+"""Opt-in profiling of single API requests.
+
+When one endpoint is slow in production, an authorized caller can ask for
+a profile of one request instead of redeploying with prints. This is only
+enabled when PROFILE_TOKEN is set. A request carrying that token in the
+`X-Profile` header or the `profile` query parameter is run as usual, and
+in addition:
+
+- A sampling profiler thread snapshots the stack of the threads handling
+  the request (`track` marks them; `_respond` in backend.main does this)
+  every PROFILE_INTERVAL_MS using `sys._current_frames`. Stacks are
+  counted in collapsed form ("outer;inner;leaf count"), the input format
+  of flamegraph.pl and speedscope. Sampling adds no overhead to other
+  requests and little to the profiled one.
+- Every statement executed on a governed connection during the request is
+  timed (TimedCursorMixin) and recorded with its duration and row count.
+  The active profile is found through a context variable, which FastAPI
+  copies into the worker thread of sync endpoints.
+- The result cache is bypassed so the profile shows the actual work.
+
+The profile is saved under PROFILE_DIR as `<request id>.collapsed` (the
+stacks) and `<request id>.json` (request, duration, SQL timings and the
+functions with the most samples). The request id is taken from the
+X-Request-ID header, or generated, and returned in the X-Profile-Id
+response header together with a Server-Timing header.
+
+Configuration (environment variables):
+- PROFILE_TOKEN: secret that enables profiling (unset disables it).
+- PROFILE_INTERVAL_MS: sampling interval (default 5).
+- PROFILE_DIR: output folder (default backend/.cache/profiles).
+"""
+
+import contextvars
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(os.path.dirname(__file__), ".cache", "profiles")
+)
+TOP_FUNCTIONS = 20
+SQL_TEXT_CHARS = 500
+
+_current = contextvars.ContextVar("profile", default=None)
+_SAFE_ID = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def authorized(headers, query_params):
+    """Whether a request asks for a profile with the right token."""
+    if not PROFILE_TOKEN:
+        return False
+    token = headers.get("x-profile") or query_params.get("profile") or ""
+    return hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+def active():
+    """The profile of the current request, None when not profiling."""
+    return _current.get()
+
+
+class Profile:
+    """Stack samples and SQL timings of one request."""
+
+    def __init__(self, request_id, interval_ms=INTERVAL_MS):
+        self.request_id = _SAFE_ID.sub("_", request_id)[:64] or uuid.uuid4().hex
+        self.interval_s = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self.sql = []
+        self._threads = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self.started = self.finished = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name=f"profile-{self.request_id}",
+                                         daemon=True)
+        self._sampler.start()
+        return _current.set(self)
+
+    def stop(self, token):
+        self._stop.set()
+        self._sampler.join()
+        self.finished = time.perf_counter()
+        _current.reset(token)
+
+    @contextmanager
+    def attach(self):
+        """Sample the calling thread while in the block."""
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            with self._lock:
+                threads = [ident for ident in self._threads if ident != own]
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(names))] += 1
+                self.samples += 1
+
+    def record_sql(self, query, duration_ms, rows):
+        text = query.decode(errors="replace") if isinstance(query, bytes) else str(query)
+        with self._lock:
+            self.sql.append({"sql": " ".join(text.split())[:SQL_TEXT_CHARS],
+                             "ms": round(duration_ms, 3), "rows": rows})
+
+    def sql_ms(self):
+        return sum(entry["ms"] for entry in self.sql)
+
+    def top_functions(self):
+        """Functions by samples on the stack (inclusive) and at the leaf (self)."""
+        inclusive, leaf = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            names = stack.split(";")
+            leaf[names[-1]] += count
+            for name in set(names):
+                inclusive[name] += count
+        return [{"function": name, "samples": count, "self": leaf.get(name, 0)}
+                for name, count in inclusive.most_common(TOP_FUNCTIONS)]
+
+    def save(self, method, path, query, status_code):
+        """Write `<id>.collapsed` and `<id>.json`; returns the JSON path."""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.request_id)
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+        summary = {
+            "request_id": self.request_id,
+            "method": method,
+            "path": path,
+            "query": query,
+            "status": status_code,
+            "duration_ms": round((self.finished - self.started) * 1000, 3),
+            "interval_ms": self.interval_s * 1000,
+            "samples": self.samples,
+            "sql_ms": round(self.sql_ms(), 3),
+            "sql": self.sql,
+            "top_functions": self.top_functions(),
+        }
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return base + ".json"
+
+
+@contextmanager
+def track():
+    """Have the current request's profiler sample this thread (no-op otherwise)."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    with profile.attach():
+        yield
+
+
+class TimedCursorMixin:
+    """Cursor mixin recording statement timings into the active profile."""
+
+    def execute(self, query, vars=None):
+        profile = _current.get()
+        if profile is None:
+            return super().execute(query, vars)
+        begin = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            profile.record_sql(query, (time.perf_counter() - begin) * 1000, self.rowcount)
@@ -0,0 +1,448 @@
+"""Energy and cycle time per NC program from an incremental run index.
+
+The timeline is segmented by the active program variable (PROG_ACTIVE,
+890; PROGRAM_VAR overrides it). A run is a stretch during which one program
+stays active: it starts when the variable takes a program name and ends
+when it changes to another name or to an empty value. Repeated logs of the
+same name do not split a run. Runs are also cut where the spindle load
+(630) stops being logged for more than RUN_GAP_S, since the machine is
+then off; logging resuming with the same program starts a new run.
+
+Each run is joined with the time-integrated spindle power: every load
+sample stands for the time until the next one (at most GAP_FACTOR nominal
+intervals) at load / 100 * MAX_POWER_KW, and the cumulative energy at the
+run boundaries gives its kWh exactly, without resampling. Time with a load
+above zero is reported as spindle time.
+
+Runs are kept in an index under PROGRAM_DIR that is extended forward one
+day at a time, carrying the open run and the last load sample across
+updates, so finished history is never rescanned. Only the command line
+and the app's background indexer (`run_indexer`, every PROGRAM_INDEX_S)
+extend it; requests read it as it is:
+
+- runs_<YYYY-MM>.json: runs (program, start, end, kWh, spindle seconds) by
+  UTC month of their start.
+- index.json: how far the index reaches (INDEX_LAG_S behind the present,
+  so late rows are not missed), the state carried to the next update and
+  per-month, per-program summaries (runs, time, kWh, min/max run time).
+
+Run files are written before index.json. After a crash between the two,
+the next update attributes the same day again and its runs replace the
+stored runs with the same start instead of being appended twice.
+
+Statistics over a range come from the summaries for whole months and from
+the run files for the months at its edges.
+
+Configuration (environment variables):
+- PROGRAM_VAR: id of the active program variable (default 890).
+- PROGRAM_DIR: index folder (default backend/.cache/programs).
+- PROGRAM_INDEX_S: interval of the background indexer (default 600).
+
+Build or extend the index from the command line (from the project root):
+python -m backend.programs 2021-03-31
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import psycopg2.extensions
+
+from backend.archive import archive, month_bounds, month_key
+from backend.catalog import get_catalog, id_of
+
+PROGRAM_VAR = int(os.getenv("PROGRAM_VAR", "890"))
+PROGRAM_DIR = os.getenv(
+    "PROGRAM_DIR", os.path.join(os.path.dirname(__file__), ".cache", "programs")
+)
+INDEX_VERSION = 1
+MAX_POWER_KW = 37.0
+GAP_FACTOR = 10          # nominal load intervals a sample stands for at most
+RUN_GAP_S = 600          # load logging stopped this long: the machine is off
+INDEX_LAG_S = 300        # the index stops this far behind the present
+DAY_MS = 24 * 3600 * 1000
+MS_PER_KWH = 3600 * 1000  # kW * ms -> kWh
+
+_index_lock = threading.Lock()
+
+
+def _atomic_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _runs_path(key):
+    return os.path.join(PROGRAM_DIR, f"runs_{key}.json")
+
+
+def _load_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def load_index():
+    """The index state; a fresh one if missing or built for another setup."""
+    index = _load_json(os.path.join(PROGRAM_DIR, "index.json"), None)
+    if not index or index.get("version") != INDEX_VERSION or index.get("program_var") != PROGRAM_VAR:
+        return {"version": INDEX_VERSION, "program_var": PROGRAM_VAR, "indexed_until": None,
+                "run": None, "carry": None, "months": {}}
+    return index
+
+
+def _program(value):
+    """Program name of a logged value; None when no program is active."""
+    value = (value or "").strip()
+    return value or None
+
+
+# --- Attribution ------------------------------------------------------------------
+
+def _pieces(ts, load, start_ms, end_ms, cap_ms):
+    """Constant-power pieces of [start_ms, end_ms) as (starts, ends, power kW)."""
+    following = np.r_[ts[1:], end_ms]
+    starts = np.maximum(ts, start_ms)
+    ends = np.minimum(np.minimum(following, ts + cap_ms), end_ms)
+    ends = np.maximum(ends, starts)
+    return starts, ends, np.nan_to_num(load).astype(np.float64) / 100.0 * MAX_POWER_KW
+
+
+def _cumulative(starts, ends, weights):
+    """Function t -> integral of the piecewise constant weights up to t."""
+    widths = (ends - starts).astype(np.float64)
+    before = np.r_[0.0, np.cumsum(weights * widths)]
+
+    def at(t):
+        i = np.searchsorted(starts, t, side="right") - 1
+        if i < 0:
+            return 0.0
+        return before[i] + weights[i] * min(max(t - starts[i], 0), widths[i])
+    return at
+
+
+def attribute(changes, ts, load, state, start_ms, end_ms, cap_ms, run_gap_ms=RUN_GAP_S * 1000):
+    """Advance the run state over [start_ms, end_ms) and return finished runs.
+
+    Args:
+        changes: (date, value) logs of the program variable in the range, sorted.
+        ts, load: Spindle load samples of the range, sorted; the sample
+            carried from the previous range (state['carry']) is prepended.
+        state: Dict with 'run' (open run: program, start, kwh, spindle_s,
+            paused) and 'carry' ([ts, load] of the last sample); updated in
+            place.
+        start_ms, end_ms: The range.
+        cap_ms: Longest time one load sample stands for.
+        run_gap_ms: Load logging gap that cuts runs.
+
+    Returns:
+        List of finished runs [program, start, end, kwh, spindle_s].
+    """
+    carry = state.get("carry")
+    if carry is not None:
+        ts = np.r_[np.int64(carry[0]), ts]
+        load = np.r_[np.float64(carry[1]), load]
+    ts = np.asarray(ts, dtype=np.int64)
+    starts, ends, power = _pieces(ts, load, start_ms, end_ms, cap_ms)
+    energy = _cumulative(starts, ends, power)
+    spindle = _cumulative(starts, ends, (power > 0).astype(np.float64))
+
+    # Events in time order: program changes, logging stopping and resuming.
+    events = [(int(t), 1, _program(v)) for t, v in changes]
+    if len(ts):
+        following = np.r_[ts[1:], max(end_ms, ts[-1])]
+        for i in np.flatnonzero(following - ts > run_gap_ms):
+            events.append((max(int(ts[i] + cap_ms), start_ms), 0, "pause"))
+            if i + 1 < len(ts):
+                events.append((int(ts[i + 1]), 2, "resume"))
+        first = ts[ts >= start_ms]
+        if len(first):
+            events.append((int(first[0]), 2, "resume"))
+    events.sort(key=lambda event: event[:2])
+
+    run = state.get("run") or {"program": None, "start": start_ms, "kwh": 0.0,
+                               "spindle_s": 0.0, "paused": not len(ts)}
+    finished = []
+    cursor = start_ms
+
+    def account(t):
+        if not run["paused"] and run["program"] is not None:
+            run["kwh"] += (energy(t) - energy(cursor)) / MS_PER_KWH
+            run["spindle_s"] += (spindle(t) - spindle(cursor)) / 1000
+
+    def close(t):
+        if run["program"] is not None and not run["paused"] and t > run["start"]:
+            finished.append([run["program"], run["start"], t, round(run["kwh"], 6),
+                             round(run["spindle_s"], 3)])
+        run.update(start=t, kwh=0.0, spindle_s=0.0)
+
+    for t, kind, value in events:
+        t = min(max(t, start_ms), end_ms)
+        account(t)
+        cursor = t
+        if kind == 0:
+            if not run["paused"]:
+                close(t)
+                run["paused"] = True
+        elif kind == 2:
+            if run["paused"]:
+                run.update(paused=False, start=t, kwh=0.0, spindle_s=0.0)
+        elif value != run["program"]:
+            close(t)
+            run["program"] = value
+    account(end_ms)
+    state["run"] = run
+    state["carry"] = [int(ts[-1]), float(np.nan_to_num(load[-1]))] if len(ts) else carry
+    return finished
+
+
+# --- Index -----------------------------------------------------------------------
+
+def _program_changes(db_conn, start_ms, end_ms):
+    with db_conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.execute("""
+            SELECT date, value
+            FROM public.variable_log_string
+            WHERE id_var = %s
+              AND date >= %s
+              AND date < %s
+            ORDER BY date;
+        """, (PROGRAM_VAR, start_ms, end_ms))
+        return [(int(date), value) for date, value in cursor.fetchall()]
+
+
+def _load_samples(db_conn, start_ms, end_ms):
+    id_var = id_of("spindle_load")
+    if archive.covers(id_var, start_ms, end_ms):
+        ts, values = archive.read(id_var, start_ms, end_ms)
+        return np.asarray(ts), np.asarray(values, dtype=np.float64)
+    with db_conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.execute("""
+            SELECT date, value
+            FROM public.variable_log_float
+            WHERE id_var = %s
+              AND date >= %s
+              AND date < %s
+            ORDER BY date;
+        """, (id_var, start_ms, end_ms))
+        rows = cursor.fetchall()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    data = np.array(rows, dtype=np.float64)
+    return data[:, 0].astype(np.int64), data[:, 1]
+
+
+def _first_program_log(db_conn):
+    with db_conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.execute("""
+            SELECT MIN(date)
+            FROM public.variable_log_string
+            WHERE id_var = %s;
+        """, (PROGRAM_VAR,))
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def _add_runs(index, runs):
+    """Add runs to their month files, by start, and to the month summaries."""
+    by_month = {}
+    for run in runs:
+        by_month.setdefault(month_key(run[1]), []).append(run)
+    for key, month_runs in by_month.items():
+        starts = {run[1] for run in month_runs}
+        stored = [run for run in _load_json(_runs_path(key), []) if run[1] not in starts]
+        _atomic_json(_runs_path(key), sorted(stored + month_runs, key=lambda run: run[1]))
+        summary = index["months"].setdefault(key, {})
+        for program, start, end, kwh, spindle_s in month_runs:
+            _merge_run(summary.setdefault(program, _empty_stats()), start, end, kwh, spindle_s)
+
+
+def _empty_stats():
+    return {"runs": 0, "seconds": 0.0, "kwh": 0.0, "spindle_s": 0.0, "min_s": None, "max_s": None}
+
+
+def _merge_run(stats, start, end, kwh, spindle_s):
+    seconds = (end - start) / 1000
+    stats["runs"] += 1
+    stats["seconds"] += seconds
+    stats["kwh"] += kwh
+    stats["spindle_s"] += spindle_s
+    stats["min_s"] = seconds if stats["min_s"] is None else min(stats["min_s"], seconds)
+    stats["max_s"] = seconds if stats["max_s"] is None else max(stats["max_s"], seconds)
+
+
+def _merge_stats(total, part):
+    total["runs"] += part["runs"]
+    for field in ("seconds", "kwh", "spindle_s"):
+        total[field] += part[field]
+    for field, pick in (("min_s", min), ("max_s", max)):
+        if part[field] is not None:
+            total[field] = part[field] if total[field] is None else pick(total[field], part[field])
+
+
+def update_index(db_conn, until_ms=None, log=None):
+    """Extend the run index up to until_ms (at most INDEX_LAG_S ago).
+
+    Returns:
+        The index state.
+    """
+    limit = int((time.time() - INDEX_LAG_S) * 1000)
+    until_ms = limit if until_ms is None else min(until_ms, limit)
+    with _index_lock:
+        index = load_index()
+        start_ms = index["indexed_until"]
+        if start_ms is None:
+            start_ms = _first_program_log(db_conn)
+            if start_ms is None:
+                return index
+            index["indexed_until"] = start_ms
+        entry = get_catalog()[id_of("spindle_load")]
+        cap_ms = int(GAP_FACTOR * 1000 / (entry.sample_rate_hz or 1.0))
+        while start_ms < until_ms:
+            end_ms = min(start_ms + DAY_MS, until_ms)
+            changes = _program_changes(db_conn, start_ms, end_ms)
+            ts, load = _load_samples(db_conn, start_ms, end_ms)
+            runs = attribute(changes, ts, load, index, start_ms, end_ms, cap_ms)
+            _add_runs(index, runs)
+            index["indexed_until"] = start_ms = end_ms
+            _atomic_json(os.path.join(PROGRAM_DIR, "index.json"), index)
+            if log:
+                log(f"indexed to {datetime.fromtimestamp(end_ms / 1000):%Y-%m-%d %H:%M}: {len(runs)} runs")
+        return index
+
+
+def _runs_in(start_ms, end_ms, program=None):
+    runs = []
+    for key in _months(start_ms, end_ms):
+        runs.extend(run for run in _load_json(_runs_path(key), [])
+                    if start_ms <= run[1] < end_ms and (program is None or run[0] == program))
+    return runs
+
+
+def _months(start_ms, end_ms):
+    keys, key = [], month_key(start_ms)
+    while month_bounds(key)[0] < end_ms:
+        keys.append(key)
+        key = month_key(month_bounds(key)[1])
+    return keys
+
+
+def get_program_stats(db_conn, start, end, program=None):
+    """Runs, cycle time and spindle energy per program over a range of days.
+
+    Runs are attributed to the day they start in. Only reads the index;
+    days past indexed_until are not counted yet.
+
+    Args:
+        db_conn: Database connection.
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        program: One program name; also returns its runs.
+
+    Returns:
+        Dict with start, end, indexed_until, complete (whether the index
+        reaches the end of the range), programs (program, runs, total_h,
+        mean_cycle_s, min_cycle_s, max_cycle_s, kwh, kwh_per_run,
+        spindle_h; by kWh, descending) and, with program, runs.
+    """
+    try:
+        start_ms = int(datetime.strptime(start, "%Y-%m-%d").timestamp() * 1000)
+        end_ms = int((datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1)).timestamp() * 1000)
+        if end_ms <= start_ms:
+            raise ValueError("end must not be before start")
+        index = load_index()
+
+        totals = {}
+        edges = []
+        for key in _months(start_ms, end_ms):
+            month_start, month_end = month_bounds(key)
+            if start_ms <= month_start and month_end <= end_ms:
+                for name, stats in index["months"].get(key, {}).items():
+                    if program is None or name == program:
+                        _merge_stats(totals.setdefault(name, _empty_stats()), stats)
+            else:
+                edges.append((max(start_ms, month_start), min(end_ms, month_end)))
+        for edge_start, edge_end in edges:
+            for name, run_start, run_end, kwh, spindle_s in _runs_in(edge_start, edge_end, program):
+                _merge_run(totals.setdefault(name, _empty_stats()), run_start, run_end, kwh, spindle_s)
+
+        programs = [{
+            "program": name,
+            "runs": stats["runs"],
+            "total_h": round(stats["seconds"] / 3600, 3),
+            "mean_cycle_s": round(stats["seconds"] / stats["runs"], 1),
+            "min_cycle_s": round(stats["min_s"], 1),
+            "max_cycle_s": round(stats["max_s"], 1),
+            "kwh": round(stats["kwh"], 3),
+            "kwh_per_run": round(stats["kwh"] / stats["runs"], 4),
+            "spindle_h": round(stats["spindle_s"] / 3600, 3),
+        } for name, stats in totals.items()]
+        programs.sort(key=lambda p: p["kwh"], reverse=True)
+
+        until = index["indexed_until"]
+        result = {"start": start, "end": end, "programs": programs,
+                  "indexed_until": datetime.fromtimestamp(until / 1000).isoformat() if until else None,
+                  "complete": until is not None and until >= end_ms}
+        if program is not None:
+            result["runs"] = [{
+                "start": datetime.fromtimestamp(run_start / 1000).isoformat(),
+                "end": datetime.fromtimestamp(run_end / 1000).isoformat(),
+                "cycle_s": round((run_end - run_start) / 1000, 1),
+                "kwh": round(kwh, 4),
+                "spindle_s": spindle_s,
+            } for _, run_start, run_end, kwh, spindle_s in _runs_in(start_ms, end_ms, program)]
+        return result
+    except Exception as e:
+        raise e
+
+
+def run_indexer(stop_event, interval_s=None):
+    """Extend the index until `stop_event` is set.
+
+    Meant to run in a daemon thread started from the app lifespan, with its
+    own connection.
+    """
+    from backend.database import get_connection
+
+    if interval_s is None:
+        interval_s = float(os.getenv("PROGRAM_INDEX_S", "600"))
+    conn = None
+    try:
+        conn = get_connection()
+        while True:
+            update_index(conn)
+            conn.rollback()
+            if stop_event.wait(interval_s):
+                break
+    except Exception as e:
+        print(f"Program indexer stopped: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from backend.database import get_connection
+
+    parser = argparse.ArgumentParser(description="Build or extend the per-program run index.")
+    parser.add_argument("until", nargs="?", help="index up to the end of this day, YYYY-MM-DD (default: now)")
+    args = parser.parse_args()
+
+    until = None
+    if args.until:
+        until = int((datetime.strptime(args.until, "%Y-%m-%d") + timedelta(days=1)).timestamp() * 1000)
+    conn = get_connection()
+    try:
+        index = update_index(conn, until, log=print)
+        print(f"{sum(s['runs'] for m in index['months'].values() for s in m.values())} runs indexed")
+    finally:
+        conn.close()
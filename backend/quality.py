@@ -0,0 +1,375 @@
+"""Data-quality scanning: gaps, duplicates, sampling-rate changes, stuck sensors.
+
+A NaN or a missing row is not the same as a machine that is off, so KPIs
+need to know where the data itself is unreliable. Each variable is scanned
+one day at a time, in one of two modes:
+
+- raw: every timestamp (and value) of the day, from the local archive
+  when it covers the day, otherwise from the database. Gaps are intervals
+  without samples longer than GAP_FACTOR nominal sampling intervals (at
+  least MIN_GAP_S); duplicates are repeated timestamps; a sampling-rate
+  change is an hour whose median interval differs from the previous
+  hour's by RATE_FACTOR or more; a stuck sensor is a run of identical
+  values lasting STUCK_MIN minutes or more. Stuck runs are only searched
+  for periodically sampled numeric variables; a value logged on change is
+  constant between rows by design.
+- counts: per-hour row and duplicate counts from one grouped query, no
+  raw rows transferred. Gaps are whole hours without rows and rate
+  changes are hours whose count is off from the nominal (or median) count
+  by RATE_FACTOR. Much cheaper, but blind to gaps shorter than an hour
+  and to stuck values.
+
+Every scan is a handful of numpy operations over the day's arrays. The
+score of a day is coverage x (1 - duplicate share) x (1 - stuck share),
+where coverage is the share of the day not inside a gap.
+
+Scans of closed days with the default thresholds are stored as JSON under
+QUALITY_DIR (default backend/.cache/quality)/<mode>/<id_var>/<date>.json.
+
+Precompute a range from the command line (from the project root):
+python -m backend.quality 618,630 2021-01-01 2021-03-31 --mode counts
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import psycopg2.extensions
+
+from backend.archive import archive
+from backend.catalog import get_catalog
+
+HOUR_MS = 3600 * 1000
+GAP_FACTOR = 10          # nominal intervals without a sample that make a gap
+MIN_GAP_S = 60           # shortest reported gap
+ON_CHANGE_GAP_S = 3600   # gap threshold of variables logged on change
+RATE_FACTOR = 2.0        # change of the median interval flagged as a rate change
+RATE_MIN_INTERVALS = 10  # intervals an hour needs to take part in rate checks
+STUCK_MIN = 30           # minutes of identical values that make a stuck run
+STUCK_MIN_SAMPLES = 10
+MODES = ("raw", "counts")
+QUALITY_DIR = os.getenv(
+    "QUALITY_DIR", os.path.join(os.path.dirname(__file__), ".cache", "quality")
+)
+
+
+def _gap_threshold_ms(entry, gap_s=None):
+    if gap_s is not None:
+        return int(gap_s * 1000)
+    if entry.sample_rate_hz:
+        return int(max(GAP_FACTOR * 1000 / entry.sample_rate_hz, MIN_GAP_S * 1000))
+    return ON_CHANGE_GAP_S * 1000
+
+
+def _raw_samples(db_conn, entry, start_ms, end_ms):
+    # Compressed archive months are rebuilt samples: no duplicates, smoothed values.
+    if (entry.table == "float" and archive.covers(entry.id, start_ms, end_ms)
+            and not archive.compressed(entry.id, start_ms, end_ms)):
+        return archive.read(entry.id, start_ms, end_ms)
+    with db_conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        if entry.table == "float":
+            cursor.execute("""
+                SELECT date, value
+                FROM public.variable_log_float
+                WHERE id_var = %s
+                  AND date >= %s
+                  AND date < %s
+                ORDER BY date;
+            """, (entry.id, start_ms, end_ms))
+            rows = cursor.fetchall()
+            if not rows:
+                return np.empty(0, dtype=np.int64), np.empty(0)
+            data = np.array(rows, dtype=np.float64)
+            return data[:, 0].astype(np.int64), data[:, 1]
+        cursor.execute("""
+            SELECT date
+            FROM public.variable_log_string
+            WHERE id_var = %s
+              AND date >= %s
+              AND date < %s
+            ORDER BY date;
+        """, (entry.id, start_ms, end_ms))
+        return np.array([row[0] for row in cursor.fetchall()], dtype=np.int64), None
+
+
+def _runs(mask):
+    """(start, stop) index pairs of the True runs of a boolean array."""
+    edges = np.diff(np.r_[0, mask.astype(np.int8), 0])
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def scan_samples(ts, values, start_ms, end_ms, gap_ms, check_stuck=True):
+    """Quality of one variable over [start_ms, end_ms) from its raw samples.
+
+    Args:
+        ts: Sorted int64 epoch ms timestamps.
+        values: Float values aligned with ts, or None (no stuck check).
+        start_ms, end_ms: Scanned interval; its bounds count as samples for
+            the leading and trailing gap.
+        gap_ms: Longest interval without samples that is not a gap.
+        check_stuck: Search runs of identical values.
+
+    Returns:
+        Dict with samples, duplicates, median_interval_s, gaps,
+        rate_changes and stuck (intervals as epoch ms pairs).
+    """
+    diffs = np.diff(ts)
+    positive = diffs > 0
+    edges = np.r_[start_ms, ts, end_ms]
+    steps = np.diff(edges)
+    at = np.flatnonzero(steps > gap_ms)
+    gaps = np.column_stack([edges[at], edges[at + 1]]).tolist()
+
+    # Median interval per hour: sort the intervals by (hour, length) and take
+    # the middle element of every hour group.
+    rate_changes = []
+    intervals, hours = diffs[positive], (ts[1:] - ts[1:] % HOUR_MS)[positive]
+    if len(intervals):
+        order = np.lexsort((intervals, hours))
+        hours, intervals = hours[order], intervals[order]
+        first = np.flatnonzero(np.r_[True, hours[1:] != hours[:-1]])
+        counts = np.diff(np.r_[first, len(hours)])
+        medians = intervals[first + counts // 2].astype(np.float64)
+        keep = counts >= RATE_MIN_INTERVALS
+        hour_starts, medians = hours[first][keep], medians[keep]
+        ratio = medians[1:] / medians[:-1]
+        for i in np.flatnonzero((ratio >= RATE_FACTOR) | (ratio <= 1 / RATE_FACTOR)):
+            rate_changes.append({"time": int(hour_starts[i + 1]),
+                                 "from_s": float(medians[i]) / 1000, "to_s": float(medians[i + 1]) / 1000})
+
+    stuck = []
+    if check_stuck and values is not None and len(ts) > 1:
+        same = values[1:] == values[:-1]
+        lo, hi = _runs(same)  # run of equal neighbours covers samples lo..hi
+        long = ((ts[hi] - ts[lo]) >= STUCK_MIN * 60_000) & (hi - lo + 1 >= STUCK_MIN_SAMPLES)
+        stuck = [{"start": int(ts[a]), "end": int(ts[b]), "value": float(values[a])}
+                 for a, b in zip(lo[long], hi[long])]
+
+    return {
+        "samples": int(len(ts)),
+        "duplicates": int(np.count_nonzero(diffs == 0)),
+        "median_interval_s": float(np.median(diffs[positive])) / 1000 if positive.any() else None,
+        "gaps": gaps,
+        "rate_changes": rate_changes,
+        "stuck": stuck,
+    }
+
+
+def scan_counts(hours, counts, duplicates, start_ms, end_ms, expected=None):
+    """Quality of one variable over [start_ms, end_ms) from per-hour counts.
+
+    Args:
+        hours: Hour starts (epoch ms) with at least one row, sorted.
+        counts: Rows per hour.
+        duplicates: Rows per hour repeating an earlier timestamp.
+        start_ms, end_ms: Scanned interval, hour aligned.
+        expected: Nominal rows per hour; the median count when None.
+
+    Returns:
+        Same layout as `scan_samples`, with hour resolution and no stuck
+        runs.
+    """
+    grid = np.arange(start_ms, end_ms, HOUR_MS, dtype=np.int64)
+    n = np.zeros(len(grid), dtype=np.int64)
+    n[(np.asarray(hours, dtype=np.int64) - start_ms) // HOUR_MS] = counts
+    lo, hi = _runs(n == 0)
+    gaps = np.column_stack([grid[lo], np.r_[grid, end_ms][hi]]).tolist()
+
+    rate_changes = []
+    present = n > 0
+    if present.any():
+        reference = expected or float(np.median(n[present]))
+        ratio = n / reference
+        off = present & ((ratio >= RATE_FACTOR) | (ratio <= 1 / RATE_FACTOR))
+        # Report where the hour's state changes, not every off-rate hour.
+        for i in np.flatnonzero(off & ~np.r_[False, off[:-1]]):
+            rate_changes.append({"time": int(grid[i]), "from_s": 3600 / reference, "to_s": 3600 / int(n[i])})
+
+    total = int(n.sum())
+    return {
+        "samples": total,
+        "duplicates": int(np.sum(duplicates)),
+        "median_interval_s": 3600 / float(np.median(n[present])) if present.any() else None,
+        "gaps": gaps,
+        "rate_changes": rate_changes,
+        "stuck": [],
+    }
+
+
+def _hour_counts(db_conn, entry, start_ms, end_ms):
+    table = "variable_log_float" if entry.table == "float" else "variable_log_string"
+    with db_conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.execute(f"""
+            SELECT date - date %% %s AS hour,
+                   COUNT(*) AS n,
+                   COUNT(*) - COUNT(DISTINCT date) AS duplicates
+            FROM public.{table}
+            WHERE id_var = %s
+              AND date >= %s
+              AND date < %s
+            GROUP BY hour
+            ORDER BY hour;
+        """, (HOUR_MS, entry.id, start_ms, end_ms))
+        rows = cursor.fetchall()
+    data = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def _score(scan, start_ms, end_ms):
+    span = end_ms - start_ms
+    gap_ms = sum(end - start for start, end in scan["gaps"])
+    stuck_ms = sum(run["end"] - run["start"] for run in scan["stuck"])
+    coverage = max(0.0, 1 - gap_ms / span)
+    duplicate_share = scan["duplicates"] / scan["samples"] if scan["samples"] else 0.0
+    return {
+        "coverage": round(coverage, 4),
+        "stuck_s": stuck_ms / 1000,
+        "score": round(coverage * (1 - duplicate_share) * (1 - min(1.0, stuck_ms / span)), 4),
+    }
+
+
+def _quality_path(mode, id_var, day):
+    return os.path.join(QUALITY_DIR, mode, str(id_var), f"{day:%Y-%m-%d}.json")
+
+
+def day_quality(db_conn, entry, day, mode="raw", gap_s=None):
+    """Scan of one variable and day, computed or loaded from disk.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        entry: Catalog Variable.
+        day: datetime at local midnight of the day.
+        mode: 'raw' or 'counts'.
+        gap_s: Gap threshold in seconds; derived from the nominal sample
+            rate when None.
+
+    Returns:
+        Dict as returned by `scan_samples`, plus start, end, coverage,
+        stuck_s and score.
+    """
+    path = _quality_path(mode, entry.id, day)
+    if gap_s is None and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    start_ms = int(day.timestamp() * 1000)
+    end_ms = int(min((day + timedelta(days=1)).timestamp(), datetime.now().timestamp()) * 1000)
+    if mode == "raw":
+        ts, values = _raw_samples(db_conn, entry, start_ms, end_ms)
+        scan = scan_samples(ts, values, start_ms, end_ms, _gap_threshold_ms(entry, gap_s),
+                            check_stuck=bool(entry.sample_rate_hz))
+    else:
+        hours, counts, duplicates = _hour_counts(db_conn, entry, start_ms, end_ms)
+        expected = 3600 * entry.sample_rate_hz if entry.sample_rate_hz else None
+        hour_end = end_ms + (-end_ms) % HOUR_MS
+        scan = scan_counts(hours, counts, duplicates, start_ms, hour_end, expected)
+    scan.update(start=start_ms, end=end_ms, **_score(scan, start_ms, end_ms))
+
+    if gap_s is None and day + timedelta(days=1) <= datetime.now():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(scan, f)
+        os.replace(path + ".tmp", path)
+    return scan
+
+
+def _merge_intervals(intervals):
+    """Join intervals that touch, e.g. a gap running across midnight."""
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _time(ms):
+    return datetime.fromtimestamp(ms / 1000).astimezone()
+
+
+def get_data_quality(db_conn, id_var, start, end, mode="raw", gap_s=None):
+    """Gaps, duplicates, sampling-rate changes and stuck runs of a variable.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        id_var: Catalogued variable id.
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        mode: 'raw' (exact) or 'counts' (per-hour counts, cheaper).
+        gap_s: Gap threshold in seconds; derived from the nominal sample
+            rate when None.
+
+    Returns:
+        Dict with id_var, name, mode, score (mean of the days), days (date,
+        samples, duplicates, median_interval_s, coverage, stuck_s, score),
+        gaps (start, end, duration_s; gaps across midnight are joined),
+        rate_changes (time, from_s, to_s) and stuck (start, end,
+        duration_s, value).
+    """
+    try:
+        entry = get_catalog().get(id_var)
+        if entry is None:
+            raise ValueError(f"unknown variable {id_var}")
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {list(MODES)}")
+        if gap_s is not None and gap_s <= 0:
+            raise ValueError("gap_s must be positive")
+        day = datetime.strptime(start, "%Y-%m-%d")
+        last = datetime.strptime(end, "%Y-%m-%d")
+        if last < day:
+            raise ValueError("end must not be before start")
+
+        scans = []
+        while day <= last and day < datetime.now():
+            scans.append((day, day_quality(db_conn, entry, day, mode, gap_s)))
+            day += timedelta(days=1)
+
+        gaps = _merge_intervals([gap for _, scan in scans for gap in scan["gaps"]])
+        return {
+            "id_var": id_var,
+            "name": entry.name,
+            "mode": mode,
+            "score": round(float(np.mean([scan["score"] for _, scan in scans])), 4) if scans else None,
+            "days": [{
+                "date": f"{day:%Y-%m-%d}",
+                **{key: scan[key] for key in ("samples", "duplicates", "median_interval_s",
+                                              "coverage", "stuck_s", "score")},
+            } for day, scan in scans],
+            "gaps": [{"start": _time(s), "end": _time(e), "duration_s": (e - s) / 1000} for s, e in gaps],
+            "rate_changes": [dict(change, time=_time(change["time"]))
+                             for _, scan in scans for change in scan["rate_changes"]],
+            "stuck": [{"start": _time(run["start"]), "end": _time(run["end"]),
+                       "duration_s": (run["end"] - run["start"]) / 1000, "value": run["value"]}
+                      for _, scan in scans for run in scan["stuck"]],
+        }
+    except Exception as e:
+        raise e
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from backend.database import get_connection
+
+    parser = argparse.ArgumentParser(description="Precompute data-quality scans for a range of days.")
+    parser.add_argument("ids", help="comma-separated variable ids")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", help="last day (inclusive), YYYY-MM-DD")
+    parser.add_argument("--mode", choices=MODES, default="raw")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        for id_var in (int(i) for i in args.ids.split(",") if i.strip()):
+            entry = get_catalog()[id_var]
+            day = datetime.strptime(args.start, "%Y-%m-%d")
+            last = datetime.strptime(args.end, "%Y-%m-%d")
+            while day <= last:
+                scan = day_quality(conn, entry, day, args.mode)
+                conn.rollback()
+                print(f"{id_var} {day:%Y-%m-%d}: score {scan['score']}, {len(scan['gaps'])} gaps")
+                day += timedelta(days=1)
+    finally:
+        conn.close()
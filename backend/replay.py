@@ -0,0 +1,310 @@
+"""Replay of historical samples at accelerated speed.
+
+Live features (ingestion, the hot store loader, streaming detectors) and
+the backend itself can be load-tested without the plant by re-emitting a
+recorded range. Samples of the chosen variables are read in timestamp
+order and released on a schedule:
+
+- `--speed N`: the original inter-sample timing compressed N times, so an
+  hour of data at `--speed 60` takes a minute and bursts stay bursts.
+- `--rate R`: a fixed R samples per second regardless of the recorded
+  timing, for reproducible benchmarks.
+- neither: as fast as the sink accepts.
+
+Sources are the database (read one day at a time, float and string tables
+merged), the local archive (`backend.archive`) or CSV files written by
+`python -m backend.archive export` (one per variable, `--csv 449=path`).
+
+Sinks are a database through the batched COPY ingestor
+(`backend.ingest`, INGEST_DSN or `--dsn`), a running backend's
+`POST /api/ingest` (sending INGEST_TOKEN, honouring 503 Retry-After),
+JSON lines on stdout (to pipe into `python -m backend.ingest pipe` or a
+queue producer) or nothing, to measure the reader. With `--retime` the
+samples get the time they are emitted instead of their recorded date, so
+consumers see them as live; without it, replaying into the source
+database duplicates rows.
+
+The report gives the rows emitted, the achieved rate and speed, and the
+largest lag behind the schedule (how far the sink fell behind).
+
+Usage (from the project root; end day inclusive, as in the API):
+python -m backend.replay --ids 618,630,597 --start 2021-01-10 --end 2021-01-10 --speed 60 --to db --dsn "dbname=replay"
+python -m backend.replay --ids 449 --source csv --csv 449=temp.csv --rate 5000 --to http --url http://localhost:8000/api/ingest
+python -m backend.replay --ids 630 --start 2021-01-10 --end 2021-01-10 --to stdout | python -m backend.ingest pipe
+"""
+
+import argparse
+import csv
+import heapq
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import backend.ingest as ingest
+from backend.archive import ARCHIVE_DIR, Archive
+from backend.catalog import get_catalog
+
+SOURCES = ("db", "archive", "csv")
+SINKS = ("db", "http", "stdout", "null")
+DAY_MS = 24 * 3600 * 1000
+MAX_BATCH = 5000     # rows handed to the sink at once when behind schedule
+
+
+def _tables(ids):
+    """Variable ids grouped by their log table ('float' unless catalogued)."""
+    catalog = get_catalog()
+    tables = {}
+    for id_var in ids:
+        entry = catalog.get(id_var)
+        tables.setdefault(entry.table if entry else "float", []).append(id_var)
+    return tables
+
+
+# --- Sources -------------------------------------------------------------------
+# Each yields (date, id_var, table, value) tuples in (date, id_var) order.
+
+def read_db(db_conn, ids, start_ms, end_ms):
+    """Samples from the log tables, one day-long query per table at a time."""
+    tables = _tables(ids)
+    for day_start in range(start_ms, end_ms, DAY_MS):
+        day_end = min(day_start + DAY_MS, end_ms)
+        rows = []
+        for table, table_ids in tables.items():
+            with db_conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT date, id_var, value
+                    FROM public.variable_log_{table}
+                    WHERE id_var = ANY(%s) AND date >= %s AND date < %s
+                    ORDER BY date, id_var;
+                """, (table_ids, day_start, day_end))
+                rows.append([(int(r["date"]), r["id_var"], table, r["value"]) for r in cursor.fetchall()])
+            db_conn.rollback()
+        yield from heapq.merge(*rows, key=lambda row: row[:2])
+
+
+def read_archive(store, ids, start_ms, end_ms):
+    """Samples of archived (float) variables, merged one day at a time."""
+    for day_start in range(start_ms, end_ms, DAY_MS):
+        day_end = min(day_start + DAY_MS, end_ms)
+        parts = [(store.read(id_var, day_start, day_end), id_var) for id_var in ids]
+        ts = np.concatenate([p[0][0] for p in parts]).astype(np.int64)
+        values = np.concatenate([p[0][1] for p in parts]).astype(np.float64)
+        id_vars = np.concatenate([np.full(len(p[0][0]), p[1]) for p in parts])
+        order = np.lexsort((id_vars, ts))
+        yield from zip(ts[order].tolist(), id_vars[order].tolist(),
+                       ["float"] * len(order), values[order].tolist())
+
+
+def read_csv(paths, start_ms, end_ms):
+    """Samples of `archive export` CSV files (date,value), keyed by id.
+
+    Gap markers (empty values) are skipped.
+    """
+    def rows(id_var, path):
+        with open(path, newline="", encoding="utf-8") as f:
+            for record in csv.DictReader(f):
+                date = int(record["date"])
+                if start_ms <= date < end_ms and record["value"] != "":
+                    yield date, id_var, "float", float(record["value"])
+
+    yield from heapq.merge(*(rows(i, p) for i, p in paths.items()), key=lambda row: row[:2])
+
+
+# --- Sinks ---------------------------------------------------------------------
+
+class IngestSink:
+    """Writes to a database through the batched COPY ingestor."""
+
+    def __init__(self, dsn):
+        self.ingestor = ingest.Ingestor(ingest.CopyWriter(dsn))
+        self.ingestor.start()
+
+    def emit(self, rows):
+        self.ingestor.submit([(table, id_var, date, value) for date, id_var, table, value in rows],
+                             timeout=None)
+
+    def close(self):
+        self.ingestor.flush()
+        self.ingestor.stop()
+
+
+class HttpSink:
+    """Posts batches to a backend's /api/ingest, waiting out backpressure."""
+
+    def __init__(self, url, token=None, timeout_s=30):
+        self.url = url
+        self.token = token if token is not None else os.getenv("INGEST_TOKEN", "")
+        self.timeout_s = timeout_s
+
+    def emit(self, rows):
+        body = json.dumps([[id_var, date, value] for date, id_var, _, value in rows]).encode()
+        while True:
+            request = urllib.request.Request(self.url, data=body, method="POST",
+                                             headers={"Content-Type": "application/json",
+                                                      "X-Ingest-Token": self.token})
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout_s):
+                    return
+            except urllib.error.HTTPError as e:
+                if e.code != 503:
+                    raise
+                time.sleep(float(e.headers.get("Retry-After", "1")))
+
+    def close(self):
+        pass
+
+
+class StdoutSink:
+    """JSON lines {"id_var", "date", "value"} on stdout."""
+
+    def emit(self, rows):
+        sys.stdout.write("".join(json.dumps({"id_var": id_var, "date": date, "value": value}) + "\n"
+                                 for date, id_var, _, value in rows))
+        sys.stdout.flush()
+
+    def close(self):
+        pass
+
+
+class NullSink:
+    def emit(self, rows):
+        pass
+
+    def close(self):
+        pass
+
+
+# --- Pacing --------------------------------------------------------------------
+
+def replay(rows, sink, speed=None, rate=None, retime=False, clock=time.monotonic, sleep=time.sleep):
+    """Emit rows to a sink on schedule.
+
+    Rows due at the same time (or overdue) go to the sink together, up to
+    MAX_BATCH at a time; between them the replay sleeps until the next row
+    is due.
+
+    Args:
+        rows: Iterable of (date, id_var, table, value) in date order.
+        sink: Object with `emit(rows)`.
+        speed: Replay the recorded timing this many times faster.
+        rate: Emit this many rows per second (overrides speed).
+        retime: Replace the recorded dates by the emission schedule in
+            epoch ms.
+
+    Returns:
+        Dict with rows, source_span_s, elapsed_s, rows_per_s, speed and
+        max_lag_ms.
+    """
+    if speed is not None and speed <= 0 or rate is not None and rate <= 0:
+        raise ValueError("speed and rate must be positive")
+    started = clock()
+    wall_ms = time.time() * 1000
+    first = last = None
+    batch, emitted, max_lag = [], 0, 0.0
+
+    def flush():
+        nonlocal batch, emitted
+        if batch:
+            sink.emit(batch)
+            emitted += len(batch)
+            batch = []
+
+    for k, row in enumerate(rows):
+        date = row[0]
+        if first is None:
+            first = date
+        last = date
+        if rate is not None:
+            due = k / rate
+        elif speed is not None:
+            due = (date - first) / 1000 / speed
+        else:
+            due = None
+        if due is not None:
+            now = clock() - started
+            if due > now:
+                flush()
+                now = clock() - started
+                if due > now:
+                    sleep(due - now)
+            else:
+                max_lag = max(max_lag, now - due)
+        if retime:
+            offset = due if due is not None else clock() - started
+            row = (int(wall_ms + offset * 1000),) + row[1:]
+        batch.append(row)
+        if len(batch) >= MAX_BATCH:
+            flush()
+    flush()
+    elapsed = clock() - started
+    span = (last - first) / 1000 if first is not None else 0.0
+    return {
+        "rows": emitted,
+        "source_span_s": round(span, 3),
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(emitted / elapsed, 1) if elapsed else None,
+        "speed": round(span / elapsed, 1) if elapsed else None,
+        "max_lag_ms": round(max_lag * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay historical samples at accelerated speed.")
+    parser.add_argument("--ids", required=True, help="comma-separated variable ids")
+    parser.add_argument("--start", help="first day, YYYY-MM-DD (db and archive sources)")
+    parser.add_argument("--end", help="last day (inclusive), YYYY-MM-DD")
+    parser.add_argument("--source", choices=SOURCES, default="db")
+    parser.add_argument("--csv", action="append", default=[], metavar="ID=PATH",
+                        help="archive export of one variable (csv source, repeatable)")
+    parser.add_argument("--root", default=ARCHIVE_DIR, help="archive directory (archive source)")
+    pace = parser.add_mutually_exclusive_group()
+    pace.add_argument("--speed", type=float, help="times faster than real time")
+    pace.add_argument("--rate", type=float, help="fixed rows per second")
+    parser.add_argument("--retime", action="store_true", help="stamp samples with their emission time")
+    parser.add_argument("--to", choices=SINKS, default="null", help="where samples go")
+    parser.add_argument("--dsn", default=ingest.INGEST_DSN, help="target database (db sink)")
+    parser.add_argument("--url", default="http://localhost:8000/api/ingest", help="endpoint (http sink)")
+    args = parser.parse_args()
+
+    ids = [int(i) for i in args.ids.split(",") if i.strip()]
+    if args.start and args.end:
+        start_ms = int(datetime.strptime(args.start, "%Y-%m-%d").timestamp() * 1000)
+        end_ms = int((datetime.strptime(args.end, "%Y-%m-%d") + timedelta(days=1)).timestamp() * 1000)
+    elif args.source == "csv":
+        start_ms, end_ms = 0, int((datetime.now() + timedelta(days=1)).timestamp() * 1000)
+    else:
+        parser.error("--start and --end are required for the db and archive sources")
+
+    if args.to == "db" and not args.dsn:
+        parser.error("set INGEST_DSN or pass --dsn for the db sink")
+    sink = {"db": lambda: IngestSink(args.dsn), "http": lambda: HttpSink(args.url),
+            "stdout": StdoutSink, "null": NullSink}[args.to]()
+
+    conn = None
+    if args.source == "db":
+        from backend.database import get_connection
+
+        conn = get_connection()
+        rows = read_db(conn, ids, start_ms, end_ms)
+    elif args.source == "archive":
+        rows = read_archive(Archive(args.root), ids, start_ms, end_ms)
+    else:
+        paths = dict(item.split("=", 1) for item in args.csv)
+        rows = read_csv({int(i): p for i, p in paths.items()}, start_ms, end_ms)
+    try:
+        report = replay(rows, sink, args.speed, args.rate, args.retime)
+    finally:
+        sink.close()
+        if conn is not None:
+            conn.close()
+    print(json.dumps(report, indent=2), file=sys.stderr if args.to == "stdout" else sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
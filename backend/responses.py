@@ -0,0 +1,170 @@
+"""JSON encoding, compression and HTTP caching of API responses.
+
+Endpoints return `json_response(...)` instead of plain Python objects, which
+skips FastAPI's generic `jsonable_encoder` walk over every row:
+
+- Encoding uses orjson when it is installed (native datetime, dict
+  subclasses such as `RealDictRow`, numpy scalars and arrays) and falls
+  back to the standard library with the same output for Decimal,
+  date/datetime and numpy values, and NaN or infinity as null.
+- Bodies of at least MIN_COMPRESS_BYTES are compressed with brotli (if the
+  `brotli` package is installed and the client accepts it) or gzip.
+- Every response carries a strong ETag of its body. Data of past days never
+  changes, so those responses are also cacheable for a year; other
+  responses must be revalidated, and a matching `If-None-Match` is answered
+  with 304 Not Modified and no body.
+"""
+
+import gzip
+import hashlib
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import numpy as np
+from fastapi import Request, Response
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024
+CLOSED_MAX_AGE_S = 365 * 24 * 3600
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        if not obj.is_finite():
+            return None
+        # Same rule as FastAPI: integral decimals stay integers.
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _finite(obj):
+    """Copy of a JSON-like value with NaN and infinities replaced by None."""
+    if isinstance(obj, float):
+        return obj if np.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+def _finite_default(obj):
+    return _finite(_default(obj))
+
+
+def dumps(content):
+    """Encode a value as compact UTF-8 JSON bytes; NaN and infinities
+    become null, as orjson writes them."""
+    if orjson is not None:
+        return orjson.dumps(
+            content, default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+    try:
+        text = json.dumps(
+            content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        )
+    except ValueError:
+        # Rare: only then pay for a walk over the whole value.
+        text = json.dumps(
+            _finite(content), default=_finite_default, ensure_ascii=False, allow_nan=False,
+            separators=(",", ":"),
+        )
+    return text.encode("utf-8")
+
+
+def etag_of(body):
+    """Strong ETag of a response body."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick 'br', 'gzip' or None from an Accept-Encoding header."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    """Compress a body with 'br' or 'gzip'."""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        # Compressed variants carry the encoding as a suffix of the tag.
+        for suffix in ('-br"', '-gzip"'):
+            if candidate.endswith(suffix):
+                candidate = candidate[: -len(suffix)] + '"'
+        if candidate == etag:
+            return True
+    return False
+
+
+def json_response(request: Request, content, closed=False, headers=None):
+    """Build a compressed, cacheable JSON response.
+
+    Args:
+        request: Incoming request (for Accept-Encoding and If-None-Match).
+        content: Value to encode.
+        closed: True when the content describes past days only and can be
+            cached by clients without revalidation.
+        headers: Extra response headers.
+
+    Returns:
+        A 200 response with the encoded body, or a 304 response when the
+        client already has this version.
+    """
+    body = dumps(content)
+    etag = etag_of(body)
+    cache_control = f"public, max-age={CLOSED_MAX_AGE_S}, immutable" if closed else "no-cache"
+    headers = {**(headers or {}), "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    encoding = None
+    if len(body) >= MIN_COMPRESS_BYTES:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    # Each representation needs its own strong validator.
+    headers["ETag"] = etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is not None:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
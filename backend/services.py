@@ -1,6 +1,22 @@
 
 from datetime import datetime, timedelta
 
+from backend.catalog import id_of
+from backend.hotstore import hot_store, hour_to_datetime, hourly_means, mean_or_none
+
+# Alarm messages (second field of each entry of the ALARM_LIST variable)
+# that are reported as critical.
+CRITICAL_ALARMS = (
+    "EMERGENCIA EXTERNA",
+    "PARADA DE AVANCES",
+    "Falta tensión externa reles",
+)
+
+
+def _round(value, digits):
+    """Round like SQL ROUND(): None stays None."""
+    return None if value is None else round(value, digits)
+
 def get_daily_average_temp(db_conn, date):
     """Compute the average temperature for a single day.
 
@@ -17,15 +33,19 @@ def get_daily_average_temp(db_conn, date):
         start_ts = int(date.timestamp() * 1000)          # start of day in ms
         end_ts = int((date + timedelta(days=1)).timestamp() * 1000)  # start of next day in ms
 
+        hot = hot_store.range(id_of("temperature"), start_ts, end_ts)
+        if hot is not None:
+            return {"log_time": date.date(), "avg_temp": _round(mean_or_none(hot[1]), 1)}
+
         with db_conn.cursor() as cursor:
             cursor.execute("""
                 SELECT %s::date AS log_time,
                        ROUND(AVG(value)::numeric, 1) AS avg_temp
                 FROM "public"."variable_log_float"
-                WHERE id_var = 618
+                WHERE id_var = %s
                   AND date >= %s
                   AND date < %s;
-            """, (date, start_ts, end_ts))
+            """, (date, id_of("temperature"), start_ts, end_ts))
 
             return cursor.fetchone()
     except Exception as e:
@@ -56,17 +76,13 @@ def get_critical_alerts(db_conn, date):
                 public.variable_log_string t,
                 jsonb_array_elements(t.value::jsonb) AS event_data
             WHERE
-                t.id_var = 447
+                t.id_var = %s
                 AND t.date >= %s
                 AND t.date < %s
-                AND (event_data ->> 1) IN (
-                    'EMERGENCIA EXTERNA',
-                    'PARADA DE AVANCES',
-                    'Falta tensión externa reles'
-                )
+                AND (event_data ->> 1) = ANY(%s)
             ORDER BY
                 t.date;
-            """, (start_ts, end_ts))
+            """, (id_of("alarms"), start_ts, end_ts, list(CRITICAL_ALARMS)))
             return cursor.fetchall()
 
             
@@ -93,11 +109,11 @@ def get_number_daily_alerts(db_conn, date):
             cursor.execute("""
             SELECT COUNT(*) as alarm_snapshot_count
             FROM public.variable_log_string
-            WHERE id_var = 447
+            WHERE id_var = %s
               AND date >= %s
               AND date < %s
               AND value::text != '[]' 
-            """, (start_ts, end_ts))
+            """, (id_of("alarms"), start_ts, end_ts))
 
             result = cursor.fetchone()
             
@@ -121,15 +137,19 @@ def get_daily_average_spindle_load(db_conn, date):
         start_ts = int(date.timestamp() * 1000)  # start of day in ms
         end_ts = int((date + timedelta(days=1)).timestamp() * 1000)  # start of next day in ms
 
+        hot = hot_store.range(id_of("spindle_load"), start_ts, end_ts)
+        if hot is not None:
+            return {"log_time": date.date(), "avg_spindle": _round(mean_or_none(hot[1]), 1)}
+
         with db_conn.cursor() as cursor:
             cursor.execute("""
                 SELECT %s::date AS log_time,
                   ROUND(AVG(value)::numeric, 1) AS avg_spindle
                 FROM "public"."variable_log_float"
-                WHERE id_var = 630
+                WHERE id_var = %s
                 AND date >= %s
                 AND date < %s;
-                """, (date, start_ts, end_ts))
+                """, (date, id_of("spindle_load"), start_ts, end_ts))
             return cursor.fetchone()
     except Exception as e:
         raise e
@@ -152,33 +172,56 @@ def get_hourly_combined_stats(db_conn, date_str):
         # Constant for the machine's max power
         MAX_POWER = 37.0 
 
+        hot_temp = hot_store.range(id_of("temperature"), start_ts, end_ts)
+        hot_spindle = hot_store.range(id_of("spindle_load"), start_ts, end_ts)
+        if hot_temp is not None and hot_spindle is not None:
+            temp = hourly_means(*hot_temp)
+            spindle = hourly_means(*hot_spindle)
+            rows = []
+            for hour in sorted(temp.keys() | spindle.keys()):
+                avg_spindle = spindle.get(hour)
+                rows.append({
+                    "log_hour": hour_to_datetime(hour),
+                    "avg_temp": _round(temp.get(hour), 1),
+                    "avg_spindle": _round(avg_spindle, 1),
+                    "power_kW": _round(
+                        avg_spindle / 100.0 * MAX_POWER if avg_spindle is not None else None, 2
+                    ),
+                })
+            return rows
+
         with db_conn.cursor() as cursor:
             query = """
                 SELECT 
                     date_trunc('hour', to_timestamp(date / 1000.0)) AS log_hour,
                     
                     -- Temperature (ID 618)
-                    ROUND(AVG(CASE WHEN id_var = 618 THEN value END)::numeric, 1) as avg_temp,
+                    ROUND(AVG(CASE WHEN id_var = %(temp_id)s THEN value END)::numeric, 1) as avg_temp,
                     
                     -- Spindle Load (ID 630)
-                    ROUND(AVG(CASE WHEN id_var = 630 THEN value END)::numeric, 1) as avg_spindle,
+                    ROUND(AVG(CASE WHEN id_var = %(spindle_id)s THEN value END)::numeric, 1) as avg_spindle,
 
                     -- Power Calculation (Based on Spindle ID 630)
                     -- Formula: (Avg_Spindle / 100) * 37.0
                     ROUND(
-                        (AVG(CASE WHEN id_var = 630 THEN value END) / 100.0 * %s)::numeric, 
+                        (AVG(CASE WHEN id_var = %(spindle_id)s THEN value END) / 100.0 * %(max_power)s)::numeric, 
                         2
                     ) as "power_kW"
 
                 FROM "public"."variable_log_float"
-                WHERE id_var IN (618, 630)
-                  AND date >= %s
-                  AND date < %s
+                WHERE id_var IN (%(temp_id)s, %(spindle_id)s)
+                  AND date >= %(start_ts)s
+                  AND date < %(end_ts)s
                 GROUP BY 1
                 ORDER BY 1 ASC;
             """
-            # Pass MAX_POWER as the first parameter, then start_ts, then end_ts
-            cursor.execute(query, (MAX_POWER, start_ts, end_ts))
+            cursor.execute(query, {
+                "temp_id": id_of("temperature"),
+                "spindle_id": id_of("spindle_load"),
+                "max_power": MAX_POWER,
+                "start_ts": start_ts,
+                "end_ts": end_ts,
+            })
             return cursor.fetchall()
 
     except Exception as e:
@@ -192,19 +235,27 @@ def get_energy_usage(db_conn, date_str):
 
         MAX_POWER_KW = 37.0
 
+        hot = hot_store.range(id_of("spindle_load"), start_ts, end_ts)
+        if hot is not None:
+            return [
+                {"real_date": hour_to_datetime(hour).isoformat(),
+                 "power_kW": round(MAX_POWER_KW * (avg / 100.0), 2)}
+                for hour, avg in sorted(hourly_means(*hot).items())
+            ]
+
         with db_conn.cursor() as cursor:
             query = """
                 SELECT 
                     date_trunc('hour', to_timestamp(date/1000)) AS hour_bin,
                     AVG(value) AS avg_value
                 FROM public.variable_log_float
-                WHERE id_var = 630
+                WHERE id_var = %s
                 AND date >= %s
                 AND date < %s
                 GROUP BY hour_bin
                 ORDER BY hour_bin;
             """
-            cursor.execute(query, (start_ts, end_ts))
+            cursor.execute(query, (id_of("spindle_load"), start_ts, end_ts))
             rows = cursor.fetchall()
 
         energy_data = []
@@ -235,16 +286,20 @@ def get_daily_average_power(db_conn, date_str):
 
         MAX_POWER_KW = 37.0
 
-        with db_conn.cursor() as cursor:
-            query = """
-                SELECT AVG(value) AS daily_avg
-                FROM public.variable_log_float
-                WHERE id_var = 630
-                AND date >= %s
-                AND date < %s;
-            """
-            cursor.execute(query, (start_ts, end_ts))
-            result = cursor.fetchone()
+        hot = hot_store.range(id_of("spindle_load"), start_ts, end_ts)
+        if hot is not None:
+            result = {"daily_avg": mean_or_none(hot[1])}
+        else:
+            with db_conn.cursor() as cursor:
+                query = """
+                    SELECT AVG(value) AS daily_avg
+                    FROM public.variable_log_float
+                    WHERE id_var = %s
+                    AND date >= %s
+                    AND date < %s;
+                """
+                cursor.execute(query, (id_of("spindle_load"), start_ts, end_ts))
+                result = cursor.fetchone()
 
         if not result or result['daily_avg'] is None:
             return {"date": date_str, "avg_power_kW": 0.0}
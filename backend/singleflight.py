@@ -0,0 +1,91 @@
+"""Request coalescing (single-flight) for identical concurrent calls.
+
+When several users open the same day, or the frontend re-renders, the same
+service call with the same parameters can be running several times at
+once. `SingleFlight.do` lets the first caller (the leader) run it while
+the others wait for and share its result, or its exception. Nothing is
+cached after the call finishes: the next caller starts a new flight.
+
+Endpoints run in FastAPI's thread pool, so the coordination uses threads.
+"""
+
+import threading
+from collections import defaultdict
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executed = defaultdict(int)
+        self._coalesced = defaultdict(int)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` once for all concurrent callers of `key`.
+
+        Args:
+            key: Hashable key identifying identical calls. Its first element
+                is used as the metrics label.
+            fn: Function to run.
+
+        Returns:
+            The result of the shared call; its exception is re-raised in
+            every waiting caller.
+        """
+        label = key[0] if isinstance(key, tuple) and key else key
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._coalesced[label] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._executed[label] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        """Executed and coalesced call counts, in total and per label."""
+        with self._lock:
+            labels = sorted(set(self._executed) | set(self._coalesced), key=str)
+            return {
+                "in_flight": len(self._calls),
+                "executed": sum(self._executed.values()),
+                "coalesced": sum(self._coalesced.values()),
+                "by_call": {
+                    str(label): {
+                        "executed": self._executed[label],
+                        "coalesced": self._coalesced[label],
+                    }
+                    for label in labels
+                },
+            }
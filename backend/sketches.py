@@ -0,0 +1,309 @@
+"""Mergeable per-hour quantile sketches (t-digest).
+
+Exact percentiles over long ranges mean sorting millions of raw rows. For
+every variable and hour a t-digest is built once instead: about a hundred
+weighted centroids that summarize the hour's distribution (rank error well
+below 0.1 %, smallest in the tails), plus exact count, sum, min and max.
+Digests merge, so the percentiles of any range come from merging the
+digests of its hours.
+
+The digest is the merging variant with the k1 (arcsine) scale function:
+centroids sorted by mean are grouped so that no group spans more than one
+unit of k(q) = compression / (2 pi) * asin(2q - 1), which keeps centroids
+small near q = 0 and q = 1. Grouping is vectorized with `np.add.reduceat`.
+
+Sketches of closed days are stored per variable and day as .npz files under
+SKETCH_DIR (default backend/.cache/sketches). Raw samples are read from the
+local archive when it covers the day, otherwise from the database. They
+are built by the command line below and by the app's warm-up pool (for
+SKETCH_IDS, default temperature and spindle load, on the days it warms).
+Requests only read them: closed days without a stored sketch are refused
+instead of being scanned, and only the current day is built from raw rows.
+
+Precompute a range from the command line (from the project root):
+python -m backend.sketches 618,630 2021-01-01 2021-03-31
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import psycopg2.extensions
+
+from backend.archive import archive
+from backend.catalog import get_catalog, id_of
+
+COMPRESSION = 200
+HOUR_MS = 3600 * 1000
+SKETCH_DIR = os.getenv(
+    "SKETCH_DIR", os.path.join(os.path.dirname(__file__), ".cache", "sketches")
+)
+QUANTILES = {"p01": 0.01, "p05": 0.05, "p25": 0.25, "p50": 0.5, "p75": 0.75,
+             "p90": 0.9, "p95": 0.95, "p99": 0.99}
+
+
+class TDigest:
+    """Merging t-digest with exact count, sum, min and max."""
+
+    __slots__ = ("means", "weights", "min", "max", "sum", "compression")
+
+    def __init__(self, means=None, weights=None, vmin=np.inf, vmax=-np.inf, vsum=0.0,
+                 compression=COMPRESSION):
+        self.means = np.empty(0) if means is None else np.asarray(means, dtype=np.float64)
+        self.weights = np.empty(0) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.min = float(vmin)
+        self.max = float(vmax)
+        self.sum = float(vsum)
+        self.compression = compression
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    @classmethod
+    def from_values(cls, values, compression=COMPRESSION):
+        """Digest of raw samples; NaNs are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        values = np.sort(values[~np.isnan(values)])
+        if not len(values):
+            return cls(compression=compression)
+        digest = cls(values, np.ones(len(values)), values[0], values[-1], values.sum(), compression)
+        digest._compress(presorted=True)
+        return digest
+
+    @classmethod
+    def merge(cls, digests, compression=COMPRESSION):
+        """Single digest summarizing all given digests."""
+        digests = [d for d in digests if len(d.weights)]
+        if not digests:
+            return cls(compression=compression)
+        merged = cls(
+            np.concatenate([d.means for d in digests]),
+            np.concatenate([d.weights for d in digests]),
+            min(d.min for d in digests), max(d.max for d in digests),
+            sum(d.sum for d in digests), compression,
+        )
+        merged._compress()
+        return merged
+
+    def _compress(self, presorted=False):
+        if not presorted:
+            order = np.argsort(self.means, kind="stable")
+            self.means, self.weights = self.means[order], self.weights[order]
+        total = self.weights.sum()
+        # Quantile at the left edge of every centroid, mapped through k1.
+        q_left = (np.cumsum(self.weights) - self.weights) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q_left - 1)
+        group = np.floor(k - k[0]).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        weights = np.add.reduceat(self.weights, starts)
+        self.means = np.add.reduceat(self.means * self.weights, starts) / weights
+        self.weights = weights
+
+    def quantile(self, q):
+        """Estimated value at quantile q (0..1); NaN for an empty digest."""
+        if not len(self.weights):
+            return float("nan")
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(
+            q * total,
+            np.concatenate([[0.0], centers, [total]]),
+            np.concatenate([[self.min], self.means, [self.max]]),
+        ))
+
+
+def _raw_day(db_conn, id_var, start_ms, end_ms):
+    if archive.covers(id_var, start_ms, end_ms):
+        return archive.read(id_var, start_ms, end_ms)
+    with db_conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+        cursor.execute("""
+            SELECT date, value
+            FROM public.variable_log_float
+            WHERE id_var = %s
+              AND date >= %s
+              AND date < %s
+            ORDER BY date;
+        """, (id_var, start_ms, end_ms))
+        rows = cursor.fetchall()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    data = np.array(rows, dtype=np.float64)
+    return data[:, 0].astype(np.int64), data[:, 1]
+
+
+def _sketch_path(id_var, day):
+    return os.path.join(SKETCH_DIR, str(id_var), f"{day:%Y-%m-%d}.npz")
+
+
+def configured_ids():
+    """Ids sketched by the warm-up: SKETCH_IDS or temperature and spindle load."""
+    ids = os.getenv("SKETCH_IDS")
+    if ids:
+        return [int(i) for i in ids.split(",") if i.strip()]
+    return [id_of("temperature"), id_of("spindle_load")]
+
+
+def _closed(day):
+    return day + timedelta(days=1) <= datetime.now()
+
+
+def load_day_sketches(id_var, day):
+    """Stored hourly digests of one variable and day, None if not built yet."""
+    path = _sketch_path(id_var, day)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as stored:
+        offsets = stored["offsets"]
+        return {
+            int(hour): TDigest(stored["means"][lo:hi], stored["weights"][lo:hi], vmin, vmax, vsum)
+            for hour, lo, hi, vmin, vmax, vsum in zip(
+                stored["hours"], offsets[:-1], offsets[1:],
+                stored["min"], stored["max"], stored["sum"],
+            )
+        }
+
+
+def day_sketches(db_conn, id_var, day):
+    """Hourly digests of one variable and day, built or loaded from disk.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        id_var: Variable id.
+        day: datetime at local midnight of the day.
+
+    Returns:
+        Dict mapping hour start (epoch ms) to TDigest; hours without
+        samples are absent.
+    """
+    stored = load_day_sketches(id_var, day)
+    if stored is not None:
+        return stored
+    path = _sketch_path(id_var, day)
+
+    start_ms = int(day.timestamp() * 1000)
+    end_ms = int((day + timedelta(days=1)).timestamp() * 1000)
+    ts, values = _raw_day(db_conn, id_var, start_ms, end_ms)
+    hours = ts - ts % HOUR_MS
+    starts = np.flatnonzero(np.r_[True, hours[1:] != hours[:-1]]) if len(ts) else []
+    bounds = list(starts) + [len(ts)]
+    sketches = {
+        int(hours[lo]): TDigest.from_values(values[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:])
+    }
+    sketches = {hour: digest for hour, digest in sketches.items() if len(digest.weights)}
+
+    if _closed(day):
+        digests = [sketches[hour] for hour in sorted(sketches)]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(
+            path,
+            hours=np.array(sorted(sketches), dtype=np.int64),
+            offsets=np.cumsum([0] + [len(d.weights) for d in digests]).astype(np.int64),
+            means=np.concatenate([d.means for d in digests]) if digests else np.empty(0),
+            weights=np.concatenate([d.weights for d in digests]) if digests else np.empty(0),
+            min=np.array([d.min for d in digests]),
+            max=np.array([d.max for d in digests]),
+            sum=np.array([d.sum for d in digests]),
+        )
+    return sketches
+
+
+def get_percentiles(db_conn, id_var, start, end, bucket="hour", qs="p50,p95"):
+    """Percentiles, min, max and mean of a variable per hour, day or range.
+
+    Closed days are read from the stored sketches; the current day is built
+    from raw rows.
+
+    Args:
+        db_conn: PostgreSQL connection.
+        id_var: Variable id (numeric variables only).
+        start: First day, ISO date string YYYY-MM-DD.
+        end: Last day (inclusive), ISO date string YYYY-MM-DD.
+        bucket: 'hour', 'day' or 'none' (whole range).
+        qs: Comma-separated quantile names from QUANTILES.
+
+    Returns:
+        List of dicts with bucket (start time), count, min, max, mean and
+        one key per requested quantile.
+
+    Raises:
+        ValueError: Closed days of the range have no stored sketch.
+    """
+    try:
+        entry = get_catalog().get(id_var)
+        if entry is None or entry.table != "float":
+            raise ValueError(f"unknown or non-numeric variable {id_var}")
+        names = [q.strip() for q in qs.split(",") if q.strip()] if isinstance(qs, str) else list(qs)
+        if not names or any(q not in QUANTILES for q in names):
+            raise ValueError(f"qs must be chosen from {list(QUANTILES)}")
+        if bucket not in ("hour", "day", "none"):
+            raise ValueError("bucket must be one of ['hour', 'day', 'none']")
+        day = datetime.strptime(start, "%Y-%m-%d")
+        last = datetime.strptime(end, "%Y-%m-%d")
+        if last < day:
+            raise ValueError("end must not be before start")
+
+        range_start = int(day.timestamp() * 1000)
+        groups = {}
+        missing = []
+        while day <= last:
+            day_start = int(day.timestamp() * 1000)
+            sketches = load_day_sketches(id_var, day)
+            if sketches is None:
+                if _closed(day):
+                    missing.append(day)
+                    sketches = {}
+                else:
+                    sketches = day_sketches(db_conn, id_var, day)
+            for hour, digest in sorted(sketches.items()):
+                key = {"hour": hour, "day": day_start, "none": range_start}[bucket]
+                groups.setdefault(key, []).append(digest)
+            day += timedelta(days=1)
+        if missing:
+            raise ValueError(
+                f"no sketches for {len(missing)} days of variable {id_var}"
+                f" ({missing[0]:%Y-%m-%d} to {missing[-1]:%Y-%m-%d}); precompute them with"
+                f" python -m backend.sketches {id_var} {missing[0]:%Y-%m-%d} {missing[-1]:%Y-%m-%d}"
+            )
+
+        rows = []
+        for key, digests in sorted(groups.items()):
+            digest = digests[0] if len(digests) == 1 else TDigest.merge(digests)
+            count = digest.count
+            row = {
+                "bucket": datetime.fromtimestamp(key / 1000).astimezone(),
+                "count": int(count),
+                "min": round(digest.min, 3),
+                "max": round(digest.max, 3),
+                "mean": round(digest.sum / count, 3),
+            }
+            row.update({q: round(digest.quantile(QUANTILES[q]), 3) for q in names})
+            rows.append(row)
+        return rows
+    except Exception as e:
+        raise e
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from backend.database import get_connection
+
+    parser = argparse.ArgumentParser(description="Precompute hourly quantile sketches for a range of days.")
+    parser.add_argument("ids", help="comma-separated variable ids")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", help="last day (inclusive), YYYY-MM-DD")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        for id_var in (int(i) for i in args.ids.split(",") if i.strip()):
+            day = datetime.strptime(args.start, "%Y-%m-%d")
+            last = datetime.strptime(args.end, "%Y-%m-%d")
+            while day <= last:
+                sketches = day_sketches(conn, id_var, day)
+                conn.rollback()
+                print(f"{id_var} {day:%Y-%m-%d}: {len(sketches)} hours")
+                day += timedelta(days=1)
+    finally:
+        conn.close()
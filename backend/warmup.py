@@ -0,0 +1,195 @@
+"""Background warm-up of the dashboard for recent and adjacent days.
+
+After a restart the result cache is empty and the first dashboard loads
+pay for every aggregate. The warmer precomputes the calls the dashboard
+makes for one date (see DASHBOARD_CALLS) in a small thread pool:
+
+- at startup, for the last WARMUP_DAYS days up to the newest spindle load
+  sample, so historical databases are warmed where the data is;
+- whenever a date is requested, for the WARMUP_ADJACENT days before and
+  after it, since users mostly step through neighbouring days.
+
+Each warmed day that is closed also gets its hourly quantile sketches
+(backend.sketches) for the sketched variables, since percentile requests
+only read stored sketches.
+
+Each worker thread has its own connection, so warm-up queries never take
+a connection from the request handlers' pool, and readiness is never
+blocked. Days already queued are not queued twice, and the `run`
+callback given by the app skips results that are already cached.
+
+Configuration (environment variables):
+- WARMUP_DAYS: recent days precomputed at startup (default 7, 0 disables).
+- WARMUP_ADJACENT: days on each side of a requested date (default 1).
+- WARMUP_WORKERS: warm-up threads (default 2).
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import backend.services as services
+import backend.sketches as sketches
+from backend.catalog import id_of
+
+# What the dashboard requests when the selected date changes.
+DASHBOARD_CALLS = (
+    services.get_daily_average_temp,
+    services.get_daily_average_spindle_load,
+    services.get_number_daily_alerts,
+    services.get_critical_alerts,
+    services.get_hourly_combined_stats,
+    services.get_daily_average_power,
+)
+
+WARMUP_DAYS = int(os.getenv("WARMUP_DAYS", "7"))
+WARMUP_ADJACENT = int(os.getenv("WARMUP_ADJACENT", "1"))
+WARMUP_WORKERS = int(os.getenv("WARMUP_WORKERS", "2"))
+
+
+def newest_day(db_conn):
+    """Local date of the newest spindle load sample, None if there is none."""
+    with db_conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT MAX(date) AS newest
+            FROM public.variable_log_float
+            WHERE id_var = %s;
+        """, (id_of("spindle_load"),))
+        row = cursor.fetchone()
+    db_conn.rollback()
+    if not row or row["newest"] is None:
+        return None
+    return datetime.fromtimestamp(int(row["newest"]) / 1000).date()
+
+
+class Warmer:
+    """Precomputes dashboard calls for whole days in background threads."""
+
+    def __init__(self, run, workers=WARMUP_WORKERS, adjacent=WARMUP_ADJACENT):
+        """
+        Args:
+            run: Callback `run(db_conn, fn, date)` computing and caching one
+                service call; it should return early when already cached.
+            workers: Number of warm-up threads.
+            adjacent: Days on each side of a requested date to precompute.
+        """
+        self._run = run
+        self.workers = workers
+        self.adjacent = adjacent
+        self._executor = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._pending = set()
+        self.days_warmed = 0
+        self.failures = 0
+
+    def _connection(self):
+        from backend.database import get_connection
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            conn = self._local.conn = get_connection()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _warm_day(self, day):
+        try:
+            conn = self._connection()
+            for fn in DASHBOARD_CALLS:
+                try:
+                    self._run(conn, fn, day)
+                except Exception as e:
+                    conn.rollback()
+                    with self._lock:
+                        self.failures += 1
+                    print(f"Warm-up of {fn.__name__} for {day} failed: {e}")
+            self._sketch_day(conn, day)
+            with self._lock:
+                self.days_warmed += 1
+        except Exception as e:
+            print(f"Warm-up for {day} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(day)
+
+    def _sketch_day(self, conn, day):
+        midnight = datetime.strptime(day, "%Y-%m-%d")
+        if midnight.date() >= date.today():
+            return
+        for id_var in sketches.configured_ids():
+            try:
+                sketches.day_sketches(conn, id_var, midnight)
+                conn.rollback()
+            except Exception as e:
+                conn.rollback()
+                with self._lock:
+                    self.failures += 1
+                print(f"Warm-up of sketches of {id_var} for {day} failed: {e}")
+
+    def submit(self, day):
+        """Queue a day ('YYYY-MM-DD') unless it is already queued."""
+        with self._lock:
+            if self._executor is None or day in self._pending:
+                return
+            self._pending.add(day)
+        self._executor.submit(self._warm_day, day)
+
+    def start(self, days=WARMUP_DAYS):
+        """Start the workers and queue the most recent `days` days.
+
+        Returns immediately; finding the newest day is itself queued.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="warmup")
+        if days > 0:
+            self._executor.submit(self._warm_recent, days)
+
+    def _warm_recent(self, days):
+        try:
+            newest = newest_day(self._connection())
+        except Exception as e:
+            print(f"Warm-up could not find the newest day: {e}")
+            return
+        if newest is None:
+            return
+        for offset in range(days):
+            self.submit((newest - timedelta(days=offset)).isoformat())
+
+    def prefetch_adjacent(self, day):
+        """Queue the days around a requested date, skipping future days."""
+        if self.adjacent <= 0:
+            return
+        try:
+            requested = datetime.strptime(day, "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            return
+        today = date.today()
+        for offset in range(1, self.adjacent + 1):
+            for neighbour in (requested - timedelta(days=offset), requested + timedelta(days=offset)):
+                if neighbour <= today:
+                    self.submit(neighbour.isoformat())
+
+    def stop(self):
+        """Drop queued work and close the workers' connections."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            connections, self._connections = self._connections, []
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "days_warmed": self.days_warmed,
+                "failures": self.failures,
+            }
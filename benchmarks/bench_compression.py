@@ -0,0 +1,137 @@
+"""Benchmark of archive compression: dead-band and swinging-door vs raw months.
+
+A month of 1 Hz motor-temperature-like data (slow drift, load cycles,
+sensor noise and a few gaps) is archived raw and compressed with each
+method at several tolerances, in temporary archive directories.
+
+For each setting it reports the stored rows and bytes (compression ratio),
+the compression time, the largest reconstruction error over all samples,
+and the time of two queries against the raw month:
+
+- hourly means: raw reads the month and averages per hour; compressed
+  integrates the stored points per hour (`compression.bucket_means`).
+- full read: `Archive.read` of the month, which rebuilds compressed months
+  on the 1 s grid.
+
+Run from the project root:
+python -m benchmarks.bench_compression
+python -m benchmarks.bench_compression --tolerances 0.05,0.1,0.5 --repeat 10
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from backend import compression
+from backend.archive import Archive, month_bounds
+
+ID_VAR = 449
+MONTH = "2021-01"
+HOUR_MS = 3600 * 1000
+
+
+def synthetic_month(seed=0):
+    """(timestamps, values) of one month at 1 Hz with gaps."""
+    rng = np.random.default_rng(seed)
+    start_ms, end_ms = month_bounds(MONTH)
+    ts = np.arange(start_ms, end_ms, 1000, dtype=np.int64)
+    t = np.arange(len(ts)) / 3600.0  # hours
+    values = (35 + 4 * np.sin(2 * np.pi * t / 24)          # daily cycle
+              + 3 * (np.sin(2 * np.pi * t / 1.5) > 0.3)     # machining cycles
+              + np.cumsum(rng.normal(0, 0.001, len(ts)))    # drift
+              + rng.normal(0, 0.02, len(ts)))               # sensor noise
+    keep = np.ones(len(ts), dtype=bool)
+    for gap in rng.integers(0, len(ts) - 7200, size=8):
+        keep[gap:gap + rng.integers(600, 7200)] = False
+    return ts[keep], values[keep].astype(np.float32)
+
+
+def store(root, ts, values, settings=None):
+    archive = Archive(root)
+    start_ms, end_ms = month_bounds(MONTH)
+    elapsed, source_rows = 0.0, len(ts)
+    if settings:
+        begin = time.perf_counter()
+        ts, values = compression.compress(ts, values, settings["method"], settings["tolerance"],
+                                          gap_ms=compression.GAP_FACTOR * 1000)
+        elapsed = time.perf_counter() - begin
+    archive.append(ID_VAR, MONTH, ts, values, end_ms, settings, source_rows=source_rows)
+    return archive, elapsed
+
+
+def month_bytes(root):
+    folder = os.path.join(root, str(ID_VAR))
+    return sum(os.path.getsize(os.path.join(folder, MONTH + ext)) for ext in (".ts", ".val"))
+
+
+def hourly_means_raw(archive):
+    start_ms, end_ms = month_bounds(MONTH)
+    ts, values = archive.read(ID_VAR, start_ms, end_ms)
+    hours = (ts - start_ms) // HOUR_MS
+    n = (end_ms - start_ms) // HOUR_MS
+    counts = np.bincount(hours, minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.bincount(hours, values.astype(np.float64), minlength=n) / counts
+
+
+def hourly_means_compressed(archive):
+    start_ms, end_ms = month_bounds(MONTH)
+    (ts, values, settings), = archive.points(ID_VAR, start_ms, end_ms)
+    return compression.bucket_means(ts, values.astype(np.float64), settings["method"],
+                                    start_ms, end_ms, HOUR_MS)[1]
+
+
+def full_read(archive):
+    start_ms, end_ms = month_bounds(MONTH)
+    return archive.read(ID_VAR, start_ms, end_ms)
+
+
+def timed(fn, archive, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(archive)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tolerances", default="0.05,0.1,0.5", help="comma-separated tolerances (degrees)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per query measurement")
+    args = parser.parse_args()
+
+    ts, values = synthetic_month()
+    tmp = tempfile.mkdtemp(prefix="bench_compression_")
+    try:
+        raw, _ = store(os.path.join(tmp, "raw"), ts, values)
+        raw_bytes = month_bytes(raw.root)
+        raw_hourly_s, raw_hourly = timed(hourly_means_raw, raw, args.repeat)
+        raw_read_s, _ = timed(full_read, raw, args.repeat)
+        print(f"raw: {len(ts)} rows, {raw_bytes / 1e6:.1f} MB, hourly means {raw_hourly_s * 1000:.1f} ms,"
+              f" full read {raw_read_s * 1000:.1f} ms")
+        print(f"\n{'method':<14} {'tol':>5} {'rows':>8} {'ratio':>7} {'compress':>9} {'max err':>8}"
+              f" {'hourly':>9} {'speedup':>8} {'hourly err':>10} {'read':>9}")
+
+        for method in compression.METHODS:
+            for tolerance in (float(t) for t in args.tolerances.split(",")):
+                root = os.path.join(tmp, f"{method}_{tolerance}")
+                archive, compress_s = store(root, ts, values, {"method": method, "tolerance": tolerance})
+                rows = archive.index(ID_VAR)["months"][MONTH]["rows"]
+                rebuilt_ts, rebuilt = full_read(archive)
+                assert np.array_equal(rebuilt_ts, ts), "rebuilt grid differs from the samples"
+                max_err = float(np.max(np.abs(rebuilt.astype(np.float64) - values)))
+                hourly_s, hourly = timed(hourly_means_compressed, archive, args.repeat)
+                hourly_err = float(np.nanmax(np.abs(hourly - raw_hourly)))
+                read_s, _ = timed(full_read, archive, args.repeat)
+                print(f"{method:<14} {tolerance:>5} {rows:>8} {raw_bytes / month_bytes(root):6.1f}x"
+                      f" {compress_s * 1000:7.0f}ms {max_err:8.4f} {hourly_s * 1000:7.2f}ms"
+                      f" {raw_hourly_s / hourly_s:7.1f}x {hourly_err:10.4f} {read_s * 1000:7.1f}ms")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark of the matrix-profile engine on a synthetic week of 1 Hz data.
+
+The synthetic signal mimics spindle load: repeated machining cycles of a few
+programs, idle stretches at zero load, noise and one injected fault.
+
+Run from the project root:
+python -m benchmarks.bench_matrix_profile            # 10 s resampling
+python -m benchmarks.bench_matrix_profile --full     # also the raw 1 Hz week
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from backend.motifs import StreamingMatrixProfile, find_discords, find_motifs, matrix_profile
+
+WEEK_S = 7 * 24 * 3600
+
+
+def synthetic_week(seed=0):
+    """One week of 1 Hz spindle-load-like samples."""
+    rng = np.random.default_rng(seed)
+    programs = [
+        np.repeat(rng.uniform(10, 80, size=12), rng.integers(30, 90, size=12)).astype(float)
+        for _ in range(3)
+    ]
+    parts, total = [], 0
+    while total < WEEK_S:
+        if rng.random() < 0.3:
+            block = np.zeros(rng.integers(600, 3600))
+        else:
+            block = programs[rng.integers(len(programs))].copy()
+        parts.append(block)
+        total += len(block)
+    week = np.concatenate(parts)[:WEEK_S]
+    week += rng.normal(0, 0.5, size=WEEK_S) * (week > 0)
+    week[WEEK_S // 2:WEEK_S // 2 + 300] += np.linspace(0, 40, 300)  # injected fault
+    return week
+
+
+def timed(label, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<45} {elapsed:10.2f} s")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--full", action="store_true", help="also profile the raw 1 Hz week")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args()
+
+    week = synthetic_week()
+    coarse = week.reshape(-1, 10).mean(axis=1)  # 10 s buckets, as served by the API
+    m = 60
+    print(f"week: {len(week)} samples at 1 Hz, {len(coarse)} at 10 s, window {m} samples, "
+          f"{args.jobs} workers")
+
+    (profile, index), serial = timed("10 s grid, 1 process", matrix_profile, coarse, m, n_jobs=1)
+    _, parallel = timed(f"10 s grid, {args.jobs} processes", matrix_profile, coarse, m,
+                        n_jobs=args.jobs)
+    print(f"{'speedup':<45} {serial / parallel:10.2f} x")
+    print(f"top motifs:   {find_motifs(profile, index, 3, m // 2)}")
+    print(f"top discords: {find_discords(profile, index, 3, m // 2)}")
+
+    split = len(coarse) - 360
+    stream, _ = timed("streaming: initial profile (week - 1 h)", StreamingMatrixProfile,
+                      coarse[:split], m, n_jobs=args.jobs)
+    _, appended = timed("streaming: append 1 h (360 samples)", stream.append, coarse[split:])
+    print(f"{'streaming: per new sample':<45} {appended / 360 * 1000:10.2f} ms")
+    drift = np.nanmax(np.abs(stream.profile - profile))
+    print(f"{'streaming vs batch, max abs difference':<45} {drift:10.2e}")
+
+    if args.full:
+        timed(f"1 Hz week, window 600, {args.jobs} processes", matrix_profile, week, 600,
+              n_jobs=args.jobs)
+
+
+if __name__ == "__main__":
+    main()
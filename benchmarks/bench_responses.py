@@ -0,0 +1,106 @@
+"""Benchmark of response encoding: FastAPI's default path vs backend.responses.
+
+Payloads mimic what the services return: `RealDictRow`s with Decimal
+averages and timezone-aware datetimes, from one day of hourly stats up to a
+day of 1-minute aggregates of ten variables.
+
+For each payload it reports the time to build a response body with
+FastAPI's `jsonable_encoder` + `JSONResponse` (the previous path), with
+`dumps` (orjson when installed) and with the standard-library fallback, as
+well as body sizes after gzip (and brotli, when installed).
+
+Run from the project root:
+python -m benchmarks.bench_responses
+python -m benchmarks.bench_responses --repeat 50
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from psycopg2.extras import RealDictRow
+
+import backend.responses as responses
+
+
+def _row(**values):
+    row = RealDictRow()
+    row.update(values)
+    return row
+
+
+def payloads(seed=0):
+    """Named payloads shaped like the services' results."""
+    rng = np.random.default_rng(seed)
+    day = datetime(2021, 1, 12).astimezone()
+    hourly = [
+        _row(hour=day + timedelta(hours=h),
+             avg_temp=Decimal(f"{rng.uniform(18, 30):.2f}"),
+             avg_spindle=Decimal(f"{rng.uniform(0, 80):.2f}"))
+        for h in range(24)
+    ]
+    alerts = [
+        _row(log_time=day + timedelta(seconds=int(s)), alarm=f"ALARM {rng.integers(1000, 9999)}: axis fault")
+        for s in np.sort(rng.integers(0, 86400, size=2000))
+    ]
+    minutes = [
+        _row(id_var=int(id_var), bucket=day + timedelta(minutes=m),
+             avg=float(rng.normal(50, 10)), max=float(rng.normal(60, 10)),
+             p95=Decimal(f"{rng.normal(58, 10):.4f}"))
+        for id_var in range(600, 610) for m in range(1440)
+    ]
+    return {"hourly_combined (24 rows)": hourly,
+            "critical_alerts (2000 rows)": alerts,
+            "aggregate 1m x 10 vars (14400 rows)": minutes}
+
+
+def fastapi_default(content):
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def stdlib_fallback(content):
+    orjson, responses.orjson = responses.orjson, None
+    try:
+        return responses.dumps(content)
+    finally:
+        responses.orjson = orjson
+
+
+def timed(fn, content, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = fn(content)
+    return (time.perf_counter() - start) / repeat, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="encodings per measurement")
+    args = parser.parse_args()
+
+    encoders = [("fastapi default", fastapi_default), ("stdlib fallback", stdlib_fallback)]
+    if responses.orjson is not None:
+        encoders.append(("orjson", responses.dumps))
+    print(f"orjson: {'yes' if responses.orjson else 'no'}, brotli: {'yes' if responses.brotli else 'no'}")
+
+    for name, content in payloads().items():
+        print(f"\n{name}")
+        baseline = None
+        for label, fn in encoders:
+            elapsed, body = timed(fn, content, args.repeat)
+            baseline = baseline or elapsed
+            print(f"  {label:<18} {elapsed * 1000:9.2f} ms  {baseline / elapsed:6.1f}x  {len(body):>9} bytes")
+
+        body = responses.dumps(content)
+        for encoding in ("gzip", "br") if responses.brotli else ("gzip",):
+            elapsed, compressed = timed(lambda b: responses.compress(b, encoding), body, args.repeat)
+            print(f"  {encoding:<18} {elapsed * 1000:9.2f} ms  {len(body) / len(compressed):6.1f}x  "
+                  f"{len(compressed):>9} bytes")
+
+
+if __name__ == "__main__":
+    main()
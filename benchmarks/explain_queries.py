@@ -0,0 +1,272 @@
+"""EXPLAIN (ANALYZE, BUFFERS) regression harness for the service queries.
+
+A change to the SQL of a service can make it much slower without changing
+its result, e.g. filtering on `TO_TIMESTAMP(date / 1000)` instead of
+`date`, which turns an index range scan into a scan of the whole table.
+This harness runs every service call of CASES on a recording connection,
+which captures each statement with its parameters, and then runs every
+captured statement under `EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`
+(`--repeat` times, keeping the median timing). Per statement it records:
+
+- shape: node types with their relations and indexes, e.g.
+  `Aggregate(Index Scan[variable_log_float/idx])`;
+- buffers: shared blocks hit and read by the whole plan;
+- execution and planning time (ms) and the rows returned.
+
+With `--update` the results become the baseline (benchmarks/baselines/
+explain.json by default). Otherwise they are compared with it and a
+statement is flagged when its plan shape changed, or its buffers or
+execution time grew by more than `--threshold` (relative; timings also
+need `--min-ms` of absolute growth to ignore noise). Buffers are
+deterministic on the same data, so they catch regressions that timings on
+a warm cache hide. The exit status is 1 when anything was flagged.
+
+Baselines only compare on the same data: run against a local database
+seeded with `--seed`, which creates the two log tables with an
+(id_var, date) index and fills `--days` days of synthetic samples ending
+with `--date` (1 Hz float variables, on-change booleans, alarm snapshots
+and program names), then ANALYZEs them. The connection comes from
+EXPLAIN_DSN or, by default, the backend's DB_* settings.
+
+Run from the project root:
+python -m benchmarks.explain_queries --seed --days 3 --date 2021-01-12
+python -m benchmarks.explain_queries --date 2021-01-12 --update
+python -m benchmarks.explain_queries --date 2021-01-12 --threshold 0.25
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import backend.catalog as catalog
+import backend.services as services
+from backend.database import connection_params
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "explain.json")
+EXPLAIN_DSN = os.getenv("EXPLAIN_DSN")
+
+
+def _cases(date):
+    """(name, function, arguments) of every service call measured."""
+    return [
+        ("get_daily_average_temp", services.get_daily_average_temp, (date,)),
+        ("get_critical_alerts", services.get_critical_alerts, (date,)),
+        ("get_number_daily_alerts", services.get_number_daily_alerts, (date,)),
+        ("get_daily_average_spindle_load", services.get_daily_average_spindle_load, (date,)),
+        ("get_hourly_combined_stats", services.get_hourly_combined_stats, (date,)),
+        ("get_energy_usage", services.get_energy_usage, (date,)),
+        ("get_daily_average_power", services.get_daily_average_power, (date,)),
+        ("aggregate_hourly", catalog.aggregate, ("618,630", date, date, "hour", "avg,min,max")),
+    ]
+
+
+class RecordingCursor(RealDictCursor):
+    """RealDictCursor that records every statement it runs, parameters bound."""
+
+    log = []
+
+    def execute(self, query, vars=None):
+        RecordingCursor.log.append(self.mogrify(query, vars).decode())
+        return super().execute(query, vars)
+
+
+def connect():
+    if EXPLAIN_DSN:
+        return psycopg2.connect(EXPLAIN_DSN, cursor_factory=RealDictCursor)
+    return psycopg2.connect(**connection_params())
+
+
+def record(conn, fn, args):
+    """Statements a service call runs, in order."""
+    RecordingCursor.log = []
+    previous, conn.cursor_factory = conn.cursor_factory, RecordingCursor
+    try:
+        fn(conn, *args)
+    finally:
+        conn.cursor_factory = previous
+        conn.rollback()
+    return list(RecordingCursor.log)
+
+
+def shape(plan):
+    """Plan tree as node types with relations and indexes."""
+    label = plan["Node Type"]
+    target = "/".join(plan[key] for key in ("Relation Name", "Index Name") if key in plan)
+    if target:
+        label += f"[{target}]"
+    children = plan.get("Plans", [])
+    if children:
+        label += "(" + ", ".join(shape(child) for child in children) + ")"
+    return label
+
+
+def explain(conn, sql, repeat):
+    """EXPLAIN ANALYZE a statement `repeat` times."""
+    runs = []
+    with conn.cursor() as cursor:
+        for _ in range(repeat):
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql)
+            runs.append(cursor.fetchone()["QUERY PLAN"][0])
+    conn.rollback()
+    plan = runs[-1]["Plan"]
+    return {
+        "sql": " ".join(sql.split()),
+        "shape": shape(plan),
+        "buffers": plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0),
+        "execution_ms": round(statistics.median(r["Execution Time"] for r in runs), 3),
+        "planning_ms": round(statistics.median(r["Planning Time"] for r in runs), 3),
+        "rows": plan.get("Actual Rows"),
+    }
+
+
+def measure(conn, date, repeat):
+    """Explained statements of every case, keyed 'case#n'."""
+    results = {}
+    for name, fn, args in _cases(date):
+        for n, sql in enumerate(record(conn, fn, args)):
+            results[f"{name}#{n}"] = explain(conn, sql, repeat)
+    return results
+
+
+def compare(baseline, current, threshold, min_ms):
+    """Regressions of current against baseline as (key, reason) pairs."""
+    flagged = []
+    for key, now in current.items():
+        before = baseline.get(key)
+        if before is None:
+            flagged.append((key, "new statement (no baseline)"))
+            continue
+        if now["shape"] != before["shape"]:
+            flagged.append((key, f"plan changed: {before['shape']} -> {now['shape']}"))
+        if now["buffers"] > before["buffers"] * (1 + threshold):
+            flagged.append((key, f"buffers {before['buffers']} -> {now['buffers']}"))
+        grown = now["execution_ms"] - before["execution_ms"]
+        if grown > min_ms and now["execution_ms"] > before["execution_ms"] * (1 + threshold):
+            flagged.append((key, f"execution {before['execution_ms']} ms -> {now['execution_ms']} ms"))
+    for key in baseline.keys() - current.keys():
+        flagged.append((key, "statement no longer run"))
+    return flagged
+
+
+# --- Synthetic database ---------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS public.variable_log_float (
+    id_var integer NOT NULL, date bigint NOT NULL, value double precision);
+CREATE TABLE IF NOT EXISTS public.variable_log_string (
+    id_var integer NOT NULL, date bigint NOT NULL, value text);
+CREATE INDEX IF NOT EXISTS variable_log_float_id_var_date
+    ON public.variable_log_float (id_var, date);
+CREATE INDEX IF NOT EXISTS variable_log_string_id_var_date
+    ON public.variable_log_string (id_var, date);
+"""
+
+
+def seed(conn, last_day, days):
+    """Create the log tables and fill `days` days ending with last_day."""
+    end = datetime.strptime(last_day, "%Y-%m-%d") + timedelta(days=1)
+    end_ms = int(end.timestamp() * 1000)
+    start_ms = int((end - timedelta(days=days)).timestamp() * 1000)
+    entries = catalog.get_catalog().values()
+    sampled = [e.id for e in entries if e.table == "float" and e.sample_rate_hz]
+    on_change = [e.id for e in entries if e.table == "float" and not e.sample_rate_hz]
+    with conn.cursor() as cursor:
+        cursor.execute(SCHEMA)
+        cursor.execute("""
+            SELECT COUNT(*) AS n FROM public.variable_log_float WHERE date >= %s AND date < %s;
+        """, (start_ms, end_ms))
+        if cursor.fetchone()["n"]:
+            raise SystemExit("the range is already seeded; use another --date or a fresh database")
+        cursor.execute("""
+            INSERT INTO public.variable_log_float (id_var, date, value)
+            SELECT v.id, s,
+                   CASE WHEN v.id = %(spindle)s
+                        THEN GREATEST(0, 60 * sin(s / 1800000.0)) + random() * 5
+                        ELSE 30 + 5 * sin(s / 3600000.0 + v.id) + random() END
+            FROM unnest(%(ids)s::int[]) AS v(id),
+                 generate_series(%(start)s::bigint, %(end)s::bigint - 1, 1000) AS s;
+        """, {"ids": sampled, "spindle": catalog.id_of("spindle_load"), "start": start_ms, "end": end_ms})
+        cursor.execute("""
+            INSERT INTO public.variable_log_float (id_var, date, value)
+            SELECT v.id, s, ((s / 600000) %% 2)::double precision
+            FROM unnest(%(ids)s::int[]) AS v(id),
+                 generate_series(%(start)s::bigint, %(end)s::bigint - 1, 600000) AS s;
+        """, {"ids": on_change, "start": start_ms, "end": end_ms})
+        cursor.execute("""
+            INSERT INTO public.variable_log_string (id_var, date, value)
+            SELECT %(alarms)s, s,
+                   CASE WHEN random() < 0.2 THEN %(critical)s
+                        WHEN random() < 0.5 THEN '[["1001", "LUBRICACION"]]'
+                        ELSE '[]' END
+            FROM generate_series(%(start)s::bigint, %(end)s::bigint - 1, 300000) AS s;
+            INSERT INTO public.variable_log_string (id_var, date, value)
+            SELECT %(program)s, s, 'PROG_' || ((s / 1800000) %% 7)
+            FROM generate_series(%(start)s::bigint, %(end)s::bigint - 1, 1800000) AS s;
+        """, {"alarms": catalog.id_of("alarms"), "program": 890, "start": start_ms, "end": end_ms,
+              "critical": json.dumps([["1", services.CRITICAL_ALARMS[0]]])})
+    conn.commit()
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE public.variable_log_float;")
+        cursor.execute("ANALYZE public.variable_log_string;")
+    conn.autocommit = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--date", required=True, help="day the services are called for, YYYY-MM-DD")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative growth flagged")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="absolute execution growth flagged")
+    parser.add_argument("--repeat", type=int, default=3, help="EXPLAIN ANALYZE runs per statement")
+    parser.add_argument("--seed", action="store_true", help="create and fill a synthetic database")
+    parser.add_argument("--days", type=int, default=3, help="days seeded, ending with --date")
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        if args.seed:
+            seed(conn, args.date, args.days)
+            print(f"seeded {args.days} days ending {args.date}")
+            return 0
+        current = measure(conn, args.date, max(1, args.repeat))
+    finally:
+        conn.close()
+
+    print(f"{'statement':<36} {'buffers':>8} {'exec ms':>9} {'plan ms':>8} {'rows':>7}  shape")
+    for key, result in current.items():
+        print(f"{key:<36} {result['buffers']:>8} {result['execution_ms']:>9.2f}"
+              f" {result['planning_ms']:>8.2f} {result['rows']!s:>7}  {result['shape']}")
+
+    if args.update:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"date": args.date, "statements": current}, f, indent=2)
+        print(f"\nbaseline written to {args.baseline}")
+        return 0
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"\nno baseline at {args.baseline}; run with --update first", file=sys.stderr)
+        return 1
+    if baseline["date"] != args.date:
+        print(f"\nbaseline was measured for {baseline['date']}, not {args.date}", file=sys.stderr)
+        return 1
+    flagged = compare(baseline["statements"], current, args.threshold, args.min_ms)
+    print()
+    for key, reason in flagged:
+        print(f"REGRESSION {key}: {reason}")
+    print(f"{len(flagged)} regressions in {len(current)} statements")
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""Load test of the backend with simulated dashboard users.
+
+Every time a user picks a date in the FilterPanel, App.tsx fires six API
+calls at once (DASHBOARD_CALLS) and the dashboard is complete when the
+slowest one returns. This generator models that traffic with asyncio:
+
+- Users: each virtual user runs sessions of `--changes` date changes. A
+  session has its own HTTP client limited to 6 connections, like a
+  browser's per-host limit, and starts on a random day of the range.
+- Date changes: most changes step to the previous or next day (users step
+  through neighbouring days), the rest jump to a random day.
+- Fan-out: the six calls of a change are sent concurrently; the page time
+  is the time until all of them answered.
+- Think time: between changes a user waits an exponentially distributed
+  time with mean `--think` seconds (capped at five times the mean).
+
+Load is applied in stages of increasing concurrent users (`--users
+1,5,10,20,50`, `--stage-s` seconds each). Per stage it reports requests
+per second, error rate (non-2xx, timeouts, connection errors; 503s from
+the query governor are counted separately), and p50/p95/p99 latency of the
+pages and of every call. The saturation point is the first stage where the
+page p95 exceeds `--slo-ms`, the error rate exceeds `--max-errors`, or
+throughput grows by less than 10 % although users were added.
+
+Needs httpx (`pip install httpx`). Run from the project root against a
+running backend (uvicorn backend.main:app):
+python -m benchmarks.load_dashboard --start 2021-01-04 --end 2021-01-31
+python -m benchmarks.load_dashboard --users 1,10,25,50,100 --stage-s 60 --think 5 --json load.json
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# What App.tsx requests when the selected date changes.
+DASHBOARD_CALLS = (
+    "/api/daily_temp_avg",
+    "/api/daily_spindle_avg",
+    "/api/number_daily_alerts",
+    "/api/critical_alerts",
+    "/api/hourly_combined",
+    "/api/energy_usage/daily",
+)
+BROWSER_CONNECTIONS = 6
+STEP_PROBABILITY = 0.7   # share of date changes to a neighbouring day
+THINK_CAP = 5            # think time is capped at this many times the mean
+FLAT_GROWTH = 1.1        # throughput growth below this counts as saturated
+
+
+class StageStats:
+    """Latencies and outcomes of one stage."""
+
+    def __init__(self):
+        self.calls = {path: [] for path in DASHBOARD_CALLS}
+        self.pages = []
+        self.think = []
+        self.outcomes = Counter()
+        self.sessions = 0
+
+    def record(self, results, page_ms):
+        self.pages.append(page_ms)
+        for path, outcome, ms in results:
+            self.calls[path].append(ms)
+            self.outcomes[outcome] += 1
+
+    def summary(self, users, elapsed_s, slo_ms):
+        requests = sum(self.outcomes.values())
+        ok = sum(n for outcome, n in self.outcomes.items() if outcome.startswith("2"))
+        rejected = self.outcomes.get("503", 0)
+        return {
+            "users": users,
+            "sessions": self.sessions,
+            "pages": len(self.pages),
+            "requests": requests,
+            "rps": round(requests / elapsed_s, 1),
+            "error_rate": round((requests - ok - rejected) / requests, 4) if requests else None,
+            "rejected_rate": round(rejected / requests, 4) if requests else None,
+            "outcomes": dict(self.outcomes),
+            "mean_think_s": round(float(np.mean(self.think)), 2) if self.think else None,
+            "page": _percentiles(self.pages),
+            "page_within_slo": round(float(np.mean(np.array(self.pages) <= slo_ms)), 4) if self.pages else None,
+            "calls": {path: _percentiles(ms) for path, ms in self.calls.items()},
+        }
+
+
+def _percentiles(ms):
+    if not ms:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50": round(float(p50), 1), "p95": round(float(p95), 1), "p99": round(float(p99), 1)}
+
+
+async def call(client, path, date, timeout_s):
+    """One API call: (path, outcome, latency ms); outcome is the status or error."""
+    import httpx
+
+    begin = time.perf_counter()
+    try:
+        response = await client.get(path, params={"date": date}, timeout=timeout_s)
+        await response.aread()
+        outcome = str(response.status_code)
+    except httpx.TimeoutException:
+        outcome = "timeout"
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+    return path, outcome, (time.perf_counter() - begin) * 1000
+
+
+async def user(base_url, days, deadline, stats, rng, changes, think_s, timeout_s):
+    """One virtual user: sessions of date changes until the deadline."""
+    import httpx
+
+    limits = httpx.Limits(max_connections=BROWSER_CONNECTIONS)
+    while time.monotonic() < deadline:
+        stats.sessions += 1
+        day = int(rng.integers(len(days)))
+        async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+            for _ in range(changes):
+                if time.monotonic() >= deadline:
+                    return
+                begin = time.perf_counter()
+                results = await asyncio.gather(*(call(client, path, days[day], timeout_s)
+                                                 for path in DASHBOARD_CALLS))
+                if time.monotonic() < deadline:
+                    stats.record(results, (time.perf_counter() - begin) * 1000)
+                think = min(rng.exponential(think_s), think_s * THINK_CAP) if think_s > 0 else 0.0
+                stats.think.append(think)
+                await asyncio.sleep(think)
+                if rng.random() < STEP_PROBABILITY:
+                    day = int(np.clip(day + rng.choice((-1, 1)), 0, len(days) - 1))
+                else:
+                    day = int(rng.integers(len(days)))
+
+
+async def run_stage(base_url, days, users, stage_s, rng, changes, think_s, timeout_s):
+    stats = StageStats()
+    deadline = time.monotonic() + stage_s
+    begin = time.perf_counter()
+    tasks = [asyncio.create_task(user(base_url, days, deadline, stats,
+                                      np.random.default_rng(rng.integers(2**32)),
+                                      changes, think_s, timeout_s))
+             for _ in range(users)]
+    # Users stop at the deadline after their current page; give them one timeout to finish.
+    done, pending = await asyncio.wait(tasks, timeout=stage_s + timeout_s + think_s * THINK_CAP)
+    for task in pending:
+        task.cancel()
+    for task in done:
+        if task.exception() is not None:
+            raise task.exception()
+    return stats, min(time.perf_counter() - begin, stage_s)
+
+
+def saturation(stages, slo_ms, max_errors):
+    """First stage that breaks the SLO, errors or stops scaling, with the reasons."""
+    for i, stage in enumerate(stages):
+        reasons = []
+        if stage["page"]["p95"] is not None and stage["page"]["p95"] > slo_ms:
+            reasons.append(f"page p95 {stage['page']['p95']} ms > {slo_ms} ms")
+        failed = (stage["error_rate"] or 0) + (stage["rejected_rate"] or 0)
+        if failed > max_errors:
+            reasons.append(f"error rate {failed:.2%} > {max_errors:.2%}")
+        if i and stage["users"] > stages[i - 1]["users"] and stage["rps"] < stages[i - 1]["rps"] * FLAT_GROWTH:
+            reasons.append(f"throughput flat ({stages[i - 1]['rps']} -> {stage['rps']} req/s)")
+        if reasons:
+            return {"users": stage["users"], "last_good_users": stages[i - 1]["users"] if i else None,
+                    "reasons": reasons}
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000", help="backend base URL")
+    parser.add_argument("--start", default="2021-01-04", help="first day users pick, YYYY-MM-DD")
+    parser.add_argument("--end", default="2021-01-31", help="last day users pick, YYYY-MM-DD")
+    parser.add_argument("--users", default="1,5,10,20,50", help="concurrent users per stage")
+    parser.add_argument("--stage-s", type=float, default=30, help="duration of each stage")
+    parser.add_argument("--changes", type=int, default=10, help="date changes per session")
+    parser.add_argument("--think", type=float, default=3.0, help="mean think time between changes (s)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-call timeout (s)")
+    parser.add_argument("--slo-ms", type=float, default=1000.0, help="page p95 target")
+    parser.add_argument("--max-errors", type=float, default=0.01, help="tolerated error rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        parser.error("httpx is required: pip install httpx")
+    first = datetime.strptime(args.start, "%Y-%m-%d")
+    last = datetime.strptime(args.end, "%Y-%m-%d")
+    days = [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((last - first).days + 1)]
+    if not days:
+        parser.error("end must not be before start")
+
+    rng = np.random.default_rng(args.seed)
+    stages = []
+    print(f"{'users':>6} {'pages':>6} {'req/s':>7} {'errors':>7} {'503':>6}"
+          f" {'page p50':>9} {'p95':>8} {'p99':>8} {'think':>6}")
+    for users in (int(u) for u in args.users.split(",")):
+        stats, elapsed = asyncio.run(run_stage(args.url, days, users, args.stage_s, rng,
+                                               args.changes, args.think, args.timeout))
+        stage = stats.summary(users, elapsed, args.slo_ms)
+        stages.append(stage)
+        page = stage["page"]
+        print(f"{users:>6} {stage['pages']:>6} {stage['rps']:>7} {stage['error_rate'] or 0:>7.2%}"
+              f" {stage['rejected_rate'] or 0:>6.2%} {page['p50'] or 0:>7.0f}ms {page['p95'] or 0:>6.0f}ms"
+              f" {page['p99'] or 0:>6.0f}ms {stage['mean_think_s'] or 0:>5.1f}s")
+
+    print("\nper call (last stage): p50 / p95 / p99 ms")
+    for path, p in stages[-1]["calls"].items():
+        print(f"  {path:<28} {p['p50']} / {p['p95']} / {p['p99']}")
+    point = saturation(stages, args.slo_ms, args.max_errors)
+    if point:
+        print(f"\nsaturated at {point['users']} users ({'; '.join(point['reasons'])});"
+              f" last good stage: {point['last_good_users']} users")
+    else:
+        print("\nno saturation within the tested stages")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"stages": stages, "saturation": point, "settings": vars(args)}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())